@@ -1,22 +1,34 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from scipy.optimize import curve_fit
 import plotly.graph_objects as go
-import plotly.express as px
 import os
 from utils import (get_colors, 
                    find_pulse_end, 
                    find_pulse_start, 
+                   detect_pulse_edges,
                    data_extractor, 
                    extract_filename, 
-                   get_file_name,
-                   extract_metadata)
+                   get_file_name)
 from leakage_current_functions import (calculate_current_difference, 
                                        calculate_falling_time, 
                                        exponential_fit, 
                                        power_law_fit)
+from uncertainty_functions import bootstrap_curve_fit, confidence_intervals
+from resampling_functions import batched_interp, ensemble_stats
+from pulse_functions import average_pulses, xcorr_edge_times
+from filter_functions import filter_current, filter_chunks, fit_baselines
+from profiling import start_profiler, show_profile
+from ingest_functions import csv_source, file_digest, read_measurement, read_metadata, source_locator
+from result_cache_functions import code_version, result_cache, result_key
+from warehouse_functions import append_results, result_row
+from plot_functions import density_figure, density_range, small_multiples_figure
 st.set_page_config(layout="wide")
+profiler = start_profiler("I-t_app")
+
+# Filtered traces only depend on the raw current and filter settings, so analysis
+# parameters can change without refiltering
+cached_filter_current = st.cache_data(max_entries=256, show_spinner=False)(filter_current)
 
 # Set page title
 st.title("I-t Curve Analysis")
@@ -26,13 +38,32 @@ st.caption("Created by: John Feng")
 with st.sidebar:
     show_raw_data = st.checkbox("Show raw data", value=False)
     # align_pulse_start = st.checkbox("Align pulse start", value=True)
-    align_pulse = st.radio("Align pulse", options=["Start", "End", "raw"], index=0)
+    align_pulse = st.radio("Align pulse", options=["Start", "End", "raw", "Xcorr"], index=0,
+                           help="Xcorr registers every trace to the rising edge of the trace with the largest step by cross-correlation")
     alignment_shift = st.number_input("Alignment shift (ms)", min_value=-100, max_value=100, value=0, step=1)
     alignment_shift = alignment_shift * 1e-3 # Convert to seconds
     log_y = st.checkbox("Log y-axis", value=False)
     log_x = st.checkbox("Log x-axis", value=False)
     show_threshold_line = st.checkbox("Show current threshold line", value=True)
-    if align_pulse == "Start":
+    plot_mode = st.radio("Plot mode", options=["Traces", "Ensemble", "Density"], index=0, horizontal=True,
+                         help="Ensemble resamples the aligned traces onto a common time grid and plots group statistics. "
+                              "Density bins all aligned traces into one 2D histogram image, for hundreds of files")
+    if plot_mode == "Ensemble":
+        ensemble_group = st.selectbox(
+            "Ensemble group", ["Surface Treatment + Guard Ring", "Surface Treatment", "Guard Ring", "All"], index=0
+        )
+        ensemble_band = st.radio("Ensemble band", options=["Percentile", "Mean ± std"], index=0, horizontal=True)
+        ensemble_low, ensemble_high = st.slider("Ensemble percentiles", min_value=0, max_value=100, value=(10, 90), step=5)
+        ensemble_points = st.number_input("Ensemble time points", min_value=100, max_value=10000, value=1000, step=100)
+    if plot_mode == "Density":
+        ensemble_group = st.selectbox(
+            "Density group", ["All", "Surface Treatment + Guard Ring", "Surface Treatment", "Guard Ring"], index=0,
+            help="Every group is drawn in its own colour"
+        )
+        density_width = st.number_input("Density pixels (time)", min_value=100, max_value=4000, value=800, step=100)
+        density_height = st.number_input("Density pixels (current)", min_value=50, max_value=2000, value=400, step=50)
+        density_log_counts = st.checkbox("Log density counts", value=True)
+    if align_pulse in ("Start", "Xcorr"):
         time_min, time_max = st.slider(
             "Time range", min_value=-1.0, max_value=10.0, value=(-0.2, 1.8), step=0.1
         )
@@ -48,6 +79,38 @@ with st.sidebar:
     threshold_input = st.number_input(
         "Pulse Start Threshold (nA)", min_value=1, max_value=10000, value=2000
     )
+    edge_detection = st.radio("Edge detection", options=["Threshold", "Change-point"], index=0, horizontal=True,
+                              help="Change-point finds the pulse edges as the best mean shifts, independent of the threshold")
+    spike_filter = st.checkbox("Spike filter", value=False,
+                               help="Hampel filter: replace samples far from the rolling median before analysis")
+    if spike_filter:
+        c1, c2 = st.columns(2)
+        with c1:
+            hampel_half_window = st.number_input("Hampel half window", min_value=1, max_value=50, value=5, step=1)
+        with c2:
+            hampel_n_sigmas = st.number_input("Hampel n sigmas", min_value=1.0, max_value=20.0, value=5.0, step=0.5)
+        smoothing = st.checkbox("Savitzky-Golay smoothing", value=False)
+        c1, c2 = st.columns(2)
+        with c1:
+            savgol_window = st.number_input("Smoothing window", min_value=5, max_value=201, value=11, step=2,
+                                            disabled=not smoothing)
+        with c2:
+            savgol_polyorder = st.number_input("Polynomial order", min_value=1, max_value=5, value=2, step=1,
+                                               disabled=not smoothing)
+        filter_settings = dict(
+            hampel_half_window=hampel_half_window,
+            n_sigmas=hampel_n_sigmas,
+            savgol_window=savgol_window if smoothing else 0,
+            savgol_polyorder=savgol_polyorder,
+        )
+    pulse_averaging = st.checkbox("Average repeated pulses", value=False,
+                                  help="Align every LED pulse in a file at its onset and analyse the averaged response")
+    if pulse_averaging:
+        c1, c2 = st.columns(2)
+        with c1:
+            pulse_pre_time = st.number_input("Window before onset (s)", min_value=0.01, max_value=10.0, value=0.2, step=0.1)
+        with c2:
+            pulse_post_time = st.number_input("Window after onset (s)", min_value=0.1, max_value=60.0, value=2.0, step=0.1)
     marker_size = st.slider("Marker size", min_value=1, max_value=10, value=5, step=1)
     line_width = st.slider(
         "Line width", min_value=0.5, max_value=5.0, value=1.0, step=0.5
@@ -73,6 +136,11 @@ with st.sidebar:
         ],
         index=0,
     )
+    st.subheader("Fit uncertainty:")
+    bootstrap_fit = st.checkbox("Bootstrap confidence intervals", value=False)
+    bootstrap_resamples = st.number_input("Max bootstrap resamples", min_value=10, max_value=5000, value=500, step=10)
+    bootstrap_budget = st.number_input("Bootstrap time budget (s)", min_value=1.0, max_value=60.0, value=5.0, step=1.0)
+    confidence_level = st.slider("Confidence level", min_value=0.80, max_value=0.99, value=0.95, step=0.01)
     st.subheader("Plot labels:")
 
 st.subheader("Plot all I-t Photocurrents")
@@ -129,40 +197,180 @@ with st.expander("Leakage Current and Afterglow Analysis Control Panel", expande
             value=400,
             step=100,)
 
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        baseline_correction = st.checkbox(
+            "Baseline drift correction", value=False,
+            help="Subtract a robust polynomial fit to the dark current before the pulse and after the afterglow")
+    with c2:
+        baseline_degree = st.selectbox("Baseline degree", options=[0, 1, 2, 3], index=1)
+    with c3:
+        baseline_margin = st.number_input(
+            "Baseline margin (points)", min_value=0, max_value=1000, value=10, step=1,
+            help="Samples before the pulse start left out of the baseline fit")
+
 with st.expander("Leakage Current Analysis Data", expanded=False):
     stats_container = st.container()
     
-stats_df = pd.DataFrame()
+stats_rows = []
 # Create a figure for all curves
 fig_main = go.Figure()
+aligned_traces = []
 
-# Process each uploaded file
-for idx, data_file in enumerate(st.session_state.data_files):
+# Read every file first so batched stages (e.g. cross-correlation alignment) see all traces
+traces = []
+trace_digests = []
+trace_sources = []
+for data_file in st.session_state.data_files:
     file_path = extract_filename(data_source, data_file)
     file_name = get_file_name(file_path)
-    try:
-        metadata = extract_metadata(data_file)
-    except:
-        metadata = {}
-    
-    color_idx = idx % len(colors)  # Fallback in case we have more files than colors
+    digest = file_digest(data_file)
+
     # Read the CSV file
-    df = pd.read_csv(data_file, comment="#")
+    n_pulses = None
+    if pulse_averaging:
+        with profiler.stage("extract_metadata"):
+            metadata = read_metadata(data_file)
+        # Stream the file in chunks so memory does not grow with the number of pulses
+        with profiler.stage("read_filter_average_pulses"):
+            df_chunks = pd.read_csv(csv_source(data_file), comment="#", chunksize=100000)
+            if spike_filter:
+                df_chunks = filter_chunks(df_chunks, **filter_settings)
+            df, n_pulses = average_pulses(df_chunks, threshold_input * 1e-9, pulse_pre_time, pulse_post_time)
+        if n_pulses == 0:
+            st.warning(f"No complete pulses found in {file_name}")
+            continue
+        df["Device ID"] = metadata.get("Device ID", file_name)
+        df["Contact ID"] = metadata.get("Contact ID", "")
+    else:
+        # Parsed once per file content, later reruns and duplicate files are served from the cache
+        with profiler.stage("read_measurement"):
+            df, metadata = read_measurement(data_file, digest)
+        if spike_filter:
+            with profiler.stage("spike_filter"):
+                df["Raw Current (A)"] = df["Current (A)"]
+                df["Current (A)"], df["Replaced"] = cached_filter_current(
+                    df["Raw Current (A)"].to_numpy(), **filter_settings
+                )
+    traces.append((file_name, metadata, df, n_pulses))
+    trace_digests.append(digest)
+    trace_sources.append(source_locator(data_file))
+
+if align_pulse == "Xcorr" and traces:
+    with profiler.stage("xcorr_alignment"):
+        edge_times, edge_scores = xcorr_edge_times(
+            [(df["Time (s)"].to_numpy(), df["Current (A)"].to_numpy()) for _, _, df, _ in traces]
+        )
 
-    pulse_start_index, pulse_start_time = find_pulse_start(df, threshold_input * 1e-9)
-    pulse_end_index, pulse_end_time = find_pulse_end(df, threshold_input * 1e-9, pulse_start_index)
-    if show_raw_data:
-        with st.expander(f"Raw data for {file_name}"):
-            df["Current (nA)"] = df["Current (A)"] * 1e9
-            st.write(
-                f"Pulse start index: {pulse_start_index}, Pulse start time: {pulse_start_time}"
-            )
-            st.write(df)
+# Find the pulse edges of every trace
+pulse_positions = []
+for file_name, metadata, df, n_pulses in traces:
+    pulse_edges = None
+    with profiler.stage("edge_detection"):
+        if edge_detection == "Change-point":
+            pulse_edges = detect_pulse_edges(df)
+            pulse_start_index = df.index[pulse_edges['start_index']]
+            pulse_start_time = df["Time (s)"].iloc[max(pulse_edges['start_index'] - 1, 0)]
+            pulse_end_index = df.index[pulse_edges['end_index']]
+            pulse_end_time = df["Time (s)"].iloc[pulse_edges['end_index']]
+        else:
+            pulse_start_index, pulse_start_time = find_pulse_start(df, threshold_input * 1e-9)
+            pulse_end_index, pulse_end_time = find_pulse_end(df, threshold_input * 1e-9, pulse_start_index)
+    pulse_positions.append((pulse_start_index, pulse_start_time, pulse_end_index, pulse_end_time, pulse_edges))
+
+# Traces without an edge matching the template (or all of them, if every trace is flat) are
+# aligned at their threshold pulse start instead
+if align_pulse == "Xcorr" and traces:
+    for idx in np.flatnonzero(~np.isfinite(edge_times)):
+        st.warning(f"No rising edge found by cross-correlation in {traces[idx][0]}, aligned at the pulse start instead")
+        edge_times[idx] = pulse_positions[idx][1]
+
+# Fit the dark current baselines of all traces in one batch: the samples before the pulse
+# (minus a margin) and after the falling edge window are taken as dark
+if baseline_correction and traces:
+    dark_masks = []
+    for (_, _, df, _), (start_index, _, end_index, _, _) in zip(traces, pulse_positions):
+        position = np.arange(len(df))
+        dark_masks.append((position < start_index - baseline_margin) | (position >= end_index + n_time_points))
+    with profiler.stage("baseline_fit"):
+        baselines = fit_baselines(
+            [df["Time (s)"].to_numpy() for _, _, df, _ in traces],
+            [df["Current (A)"].to_numpy() for _, _, df, _ in traces],
+            dark_masks,
+            degree=baseline_degree,
+        )
+    for (file_name, _, df, _), baseline in zip(traces, baselines):
+        if np.isnan(baseline).all():
+            st.warning(f"Not enough dark samples to fit a baseline for {file_name}")
+        df["Baseline (A)"] = baseline
+        df["Corrected Current (A)"] = df["Current (A)"] - baseline
+
+# Per-file detail figures: paginated charts, or one small-multiples grid of every file.
+# Statistics are still computed for every file
+detail_view = st.radio("Detail view", options=["Per-file charts", "Small multiples"], index=0, horizontal=True,
+                       help="Small multiples draws every file in one compact subplot grid")
+c1, c2 = st.columns(2)
+if detail_view == "Per-file charts":
+    with c1:
+        detail_page_size = st.number_input("Detail figures per page", min_value=1, max_value=50, value=5, step=1)
+    n_detail_pages = max(1, -(-len(traces) // detail_page_size))
+    with c2:
+        detail_page = st.number_input(f"Detail page (of {n_detail_pages})", min_value=1, max_value=n_detail_pages,
+                                      value=1, step=1)
+    detail_first = (detail_page - 1) * detail_page_size
+else:
+    with c1:
+        small_multiples_cols = st.number_input("Columns", min_value=1, max_value=10, value=4, step=1)
+    with c2:
+        small_multiples_points = st.number_input("Points per panel", min_value=100, max_value=10000, value=1000, step=100)
+    st.info("Small multiples has no per-file sections, so falling edge curve fits, their bootstrap intervals "
+            "and raw data tables are skipped. Switch to Per-file charts to run them; the statistics table "
+            "below still covers every file.")
+small_multiples = []
+
+# Leakage and afterglow statistics are kept on disk by file content, the settings they depend
+# on and the analysis code version, so files analysed before (by anyone) are not recomputed
+analysis_params = dict(
+    threshold=threshold_input,
+    edge_detection=edge_detection,
+    spike_filter=filter_settings if spike_filter else None,
+    pulse_averaging=(pulse_pre_time, pulse_post_time) if pulse_averaging else None,
+    baseline=(baseline_degree, baseline_margin) if baseline_correction else None,
+    align_pulse=align_pulse,
+    alignment_shift=alignment_shift,
+    edge_margins=(left_edge_margin, right_edge_margin, falling_edge_margin),
+    n_time_points=n_time_points,
+    n_points_averaged=(first_n_points, last_n_points),
+    percent_drop=percent_drop_input,
+    calculate=(calculate_leakage, calculate_afterglow),
+)
+analysis_version = code_version(__file__, "utils", "leakage_current_functions", "filter_functions",
+                                "pulse_functions", "ingest_functions")
+# Xcorr edge times depend on the reference trace, so they are part of each file's key
+result_keys = [
+    result_key(digest, dict(analysis_params, xcorr_edge_time=edge_times[idx] if align_pulse == "Xcorr" else None),
+               analysis_version)
+    for idx, digest in enumerate(trace_digests)
+]
+with profiler.stage("result_cache_lookup"):
+    cached_results = result_cache.get_many(result_keys)
+new_results = {}
+# Statistics are also appended to the results warehouse for trend queries; it skips the
+# files already stored with the same settings and code version
+warehouse_rows = []
+
+# Process each uploaded file
+for idx, (file_name, metadata, df, n_pulses) in enumerate(traces):
+    color_idx = idx % len(colors)  # Fallback in case we have more files than colors
+
+    pulse_start_index, pulse_start_time, pulse_end_index, pulse_end_time, pulse_edges = pulse_positions[idx]
     # Align time to pulse start
     if align_pulse == "Start":
         df["Aligned_time (s)"] = df["Time (s)"] - pulse_start_time - alignment_shift
     elif align_pulse == "End":
         df["Aligned_time (s)"] = df["Time (s)"] - pulse_end_time - alignment_shift
+    elif align_pulse == "Xcorr":
+        df["Aligned_time (s)"] = df["Time (s)"] - edge_times[idx] - alignment_shift
     else:
         df["Aligned_time (s)"] = df["Time (s)"]
 
@@ -176,14 +384,125 @@ for idx, data_file in enumerate(st.session_state.data_files):
         except:
             plot_label = st.text_input(f"Plot {idx+1}", value=f"{file_name}")
 
-    fig_main.add_scatter(
-        x=df_slice["Aligned_time (s)"],
-        y=df_slice["Current (A)"],
-        name=plot_label,
-        mode="markers+lines",
-        line=dict(width=line_width, color=colors[color_idx]),
-        marker=dict(symbol="circle", size=marker_size, color=colors[color_idx]),
-    )
+    if plot_mode in ("Ensemble", "Density"):
+        if ensemble_group == "All":
+            group_label = "All"
+        elif ensemble_group == "Surface Treatment + Guard Ring":
+            group_label = f"{metadata.get('Surface Treatment', 'unknown')}_Guard-{metadata.get('Guard Ring', 'unknown')}"
+        else:
+            group_label = str(metadata.get(ensemble_group, "unknown"))
+        aligned_traces.append((group_label, df_slice["Aligned_time (s)"].to_numpy(), df_slice["Current (A)"].to_numpy()))
+    else:
+        fig_main.add_scatter(
+            x=df_slice["Aligned_time (s)"],
+            y=df_slice["Current (A)"],
+            name=plot_label,
+            mode="markers+lines",
+            line=dict(width=line_width, color=colors[color_idx]),
+            marker=dict(symbol="circle", size=marker_size, color=colors[color_idx]),
+        )
+
+    df_top_edge = df.iloc[(pulse_start_index + left_edge_margin) : (pulse_end_index - right_edge_margin)]
+    df_falling_edge = df.iloc[(pulse_end_index + falling_edge_margin) : (pulse_end_index + n_time_points)]
+
+    if result_keys[idx] in cached_results:
+        leakage_stats, afterglow_stats, leakage_stats_corrected, afterglow_stats_corrected = cached_results[result_keys[idx]]
+    else:
+        with profiler.stage("leakage_afterglow_stats"):
+            leakage_stats = None
+            afterglow_stats = None
+            if calculate_leakage:
+                leakage_stats = calculate_current_difference(df_top_edge, first_n_points, last_n_points)
+            if calculate_afterglow:
+                afterglow_stats = calculate_falling_time(df_falling_edge, percent_drop=percent_drop_input)
+
+            # Same statistics on the drift corrected current, reported next to the uncorrected ones
+            leakage_stats_corrected = None
+            afterglow_stats_corrected = None
+            if "Corrected Current (A)" in df:
+                if calculate_leakage:
+                    leakage_stats_corrected = calculate_current_difference(
+                        df_top_edge.assign(**{"Current (A)": df_top_edge["Corrected Current (A)"]}),
+                        first_n_points, last_n_points)
+                if calculate_afterglow:
+                    afterglow_stats_corrected = calculate_falling_time(
+                        df_falling_edge.assign(**{"Current (A)": df_falling_edge["Corrected Current (A)"]}),
+                        percent_drop=percent_drop_input)
+        # Failed falling time calculations are not stored, so their error is shown again next time
+        if not (calculate_afterglow and afterglow_stats is None):
+            new_results[result_keys[idx]] = (leakage_stats, afterglow_stats,
+                                             leakage_stats_corrected, afterglow_stats_corrected)
+    if not (calculate_afterglow and afterglow_stats is None):
+        warehouse_rows.append(result_row(
+            "I-t", file_name, trace_sources[idx], trace_digests[idx], metadata, params=analysis_params,
+            version=analysis_version,
+            leakage_current=leakage_stats['difference'] if leakage_stats else None,
+            photocurrent_start=leakage_stats['start'] if leakage_stats else None,
+            photocurrent_end=leakage_stats['end'] if leakage_stats else None,
+            afterglow_time=afterglow_stats['time_drop'] if afterglow_stats else None,
+            leakage_current_corrected=leakage_stats_corrected['difference'] if leakage_stats_corrected else None,
+            afterglow_time_corrected=afterglow_stats_corrected['time_drop'] if afterglow_stats_corrected else None,
+            baseline_drift=df['Baseline (A)'].iloc[-1] - df['Baseline (A)'].iloc[0] if "Baseline (A)" in df else None,
+        ))
+
+    stats = {'file_name': file_name, 
+            'Device ID': df.iloc[0]['Device ID'],
+            'Contact ID': df.iloc[0]['Contact ID'],
+            }
+    if leakage_stats is not None:
+        stats['photocurrent_start'] = f"{leakage_stats['start']:.2e}"
+        stats['photocurrent_end'] = f"{leakage_stats['end']:.2e}" 
+        stats['leakage_current'] = f"{leakage_stats['difference']:.2e}"
+        stats['percent_drop_threshold'] = percent_drop_input
+    if afterglow_stats is not None:
+        stats['afterglow_time_ms'] = np.round(afterglow_stats['time_drop']*1e3, 2)
+        stats['afterglow_time'] = np.round(afterglow_stats['time_drop'], 5)
+    if leakage_stats_corrected is not None:
+        stats['photocurrent_start_corrected'] = f"{leakage_stats_corrected['start']:.2e}"
+        stats['photocurrent_end_corrected'] = f"{leakage_stats_corrected['end']:.2e}"
+        stats['leakage_current_corrected'] = f"{leakage_stats_corrected['difference']:.2e}"
+    if afterglow_stats_corrected is not None:
+        stats['afterglow_time_ms_corrected'] = np.round(afterglow_stats_corrected['time_drop']*1e3, 2)
+    if "Baseline (A)" in df:
+        stats['baseline_drift'] = f"{df['Baseline (A)'].iloc[-1] - df['Baseline (A)'].iloc[0]:.2e}"
+    if pulse_averaging:
+        stats['n_pulses_averaged'] = n_pulses
+    if spike_filter and "Replaced" in df:
+        stats['n_samples_replaced'] = int(df["Replaced"].sum())
+    if edge_detection == "Change-point":
+        time_step = df["Time (s)"].diff().median()
+        stats['start_edge_snr'] = np.round(pulse_edges['start_snr'], 1)
+        stats['start_edge_ci_ms'] = np.round((pulse_edges['start_ci'][1] - pulse_edges['start_ci'][0] + 1) * time_step * 1e3, 2)
+        stats['end_edge_snr'] = np.round(pulse_edges['end_snr'], 1)
+        stats['end_edge_ci_ms'] = np.round((pulse_edges['end_ci'][1] - pulse_edges['end_ci'][0] + 1) * time_step * 1e3, 2)
+    if align_pulse == "Xcorr":
+        stats['xcorr_edge_time'] = np.round(edge_times[idx], 5)
+        stats['xcorr_score'] = np.round(edge_scores[idx], 3)
+
+    stats_rows.append(stats)
+
+    if detail_view == "Small multiples":
+        small_multiples.append({
+            'label': plot_label,
+            'trace': df_slice,
+            'top_edge': df_top_edge if show_top_edge else None,
+            'leakage_times': (df_top_edge["Aligned_time (s)"].iloc[0], df_top_edge["Aligned_time (s)"].iloc[-1])
+            if len(df_top_edge) else None,
+            'falling_edge': df_falling_edge if show_falling_edge else None,
+            'leakage_stats': leakage_stats,
+            'afterglow_stats': afterglow_stats,
+        })
+        continue
+    # Per-file figures and fits are only built for the files on the selected detail page
+    if not detail_first <= idx < detail_first + detail_page_size:
+        continue
+    if show_raw_data:
+        with st.expander(f"Raw data for {file_name}"):
+            df["Current (nA)"] = df["Current (A)"] * 1e9
+            st.write(
+                f"Pulse start index: {pulse_start_index}, Pulse start time: {pulse_start_time}"
+            )
+            st.write(df)
 
     # Create main plot
     fig = go.Figure()
@@ -222,7 +541,29 @@ for idx, data_file in enumerate(st.session_state.data_files):
             annotation_font_color=annotation_font_color,
         )
 
-    df_top_edge = df.iloc[(pulse_start_index + left_edge_margin) : (pulse_end_index - right_edge_margin)]
+    if "Replaced" in df and "Raw Current (A)" in df:
+        df_replaced = df_slice[df_slice["Replaced"]]
+        fig.add_trace(
+            go.Scatter(
+                x=df_replaced["Aligned_time (s)"],
+                y=df_replaced["Raw Current (A)"],
+                mode="markers",
+                name=f"Replaced samples ({int(df['Replaced'].sum())})",
+                marker=dict(symbol="x", color="red", size=marker_size + 2),
+            )
+        )
+
+    if "Baseline (A)" in df:
+        fig.add_trace(
+            go.Scatter(
+                x=df_slice["Aligned_time (s)"],
+                y=df_slice["Baseline (A)"],
+                mode="lines",
+                name="Baseline",
+                line=dict(color="grey", dash="dot"),
+            )
+        )
+
     if show_top_edge:
         fig.add_trace(
             go.Scatter(
@@ -235,7 +576,6 @@ for idx, data_file in enumerate(st.session_state.data_files):
             )
         )
 
-    df_falling_edge = df.iloc[(pulse_end_index + falling_edge_margin) : (pulse_end_index + n_time_points)]
     if show_falling_edge:
         fig.add_trace(
             go.Scatter(
@@ -277,11 +617,7 @@ for idx, data_file in enumerate(st.session_state.data_files):
         ),
     )
 
-    if calculate_leakage:
-        with col2:
-            leakage_stats = calculate_current_difference(df_top_edge, first_n_points, last_n_points)
-            # st.write(f"Start: **{leakage_stats['start']:.2e}** A, End: **{leakage_stats['end']:.2e}** A, Difference: **{leakage_stats['difference']:.2e}** A")
-        
+    if leakage_stats is not None:
         fig.add_hline(
             y=leakage_stats['start'],
             line_dash="dash",
@@ -301,49 +637,30 @@ for idx, data_file in enumerate(st.session_state.data_files):
             annotation_font_color=annotation_font_color,
         )
 
-    if calculate_afterglow:
-        afterglow_stats = calculate_falling_time(df_falling_edge, percent_drop=percent_drop_input)
-        if afterglow_stats is not None:  # Only add lines if calculation was successful
-            # with col1:
-            #     st.write(f"Falling Time at {percent_drop_input*100}% Drop = {afterglow_stats['time_drop']*1e3:.2f} ms")
-            fig.add_hline(
-                y=afterglow_stats['threshold_drop']+afterglow_stats['end_current'],
-                line_dash="dash",
-                line_color="grey",
-                annotation_text=f"{percent_drop_input*100}% Drop: {afterglow_stats['threshold_drop']:.2e} A",
-                annotation_position="top right",
-                annotation_font_size=annotation_font_size,
-                annotation_font_color=annotation_font_color,
-            )
-            fig.add_vline(
-                x=afterglow_stats['time_index'],
-                line_dash="dash",
-                line_color=colors[2],
-                annotation_text=f"Time Drop: {afterglow_stats['time_drop']*1e3:.2f} ms",
-                annotation_position="bottom right",
-                annotation_font_size=annotation_font_size,
-                annotation_font_color=annotation_font_color,
-            )
+    if afterglow_stats is not None:  # Only add lines if calculation was successful
+        fig.add_hline(
+            y=afterglow_stats['threshold_drop']+afterglow_stats['end_current'],
+            line_dash="dash",
+            line_color="grey",
+            annotation_text=f"{percent_drop_input*100}% Drop: {afterglow_stats['threshold_drop']:.2e} A",
+            annotation_position="top right",
+            annotation_font_size=annotation_font_size,
+            annotation_font_color=annotation_font_color,
+        )
+        fig.add_vline(
+            x=afterglow_stats['time_index'],
+            line_dash="dash",
+            line_color=colors[2],
+            annotation_text=f"Time Drop: {afterglow_stats['time_drop']*1e3:.2f} ms",
+            annotation_position="bottom right",
+            annotation_font_size=annotation_font_size,
+            annotation_font_color=annotation_font_color,
+        )
 
     # Display main plot
-    with st.expander("Full Curve", expanded=True):
+    with st.expander("Full Curve", expanded=True), profiler.stage("plotly_chart_per_file"):
         st.plotly_chart(fig, use_container_width=True)
 
-    stats = {'file_name': file_name, 
-            'Device ID': df.iloc[0]['Device ID'],
-            'Contact ID': df.iloc[0]['Contact ID'],
-            }
-    if 'leakage_stats' in locals() and leakage_stats is not None:
-        stats['photocurrent_start'] = f"{leakage_stats['start']:.2e}"
-        stats['photocurrent_end'] = f"{leakage_stats['end']:.2e}" 
-        stats['leakage_current'] = f"{leakage_stats['difference']:.2e}"
-        stats['percent_drop_threshold'] = percent_drop_input
-    if 'afterglow_stats' in locals() and afterglow_stats is not None:
-        stats['afterglow_time_ms'] = np.round(afterglow_stats['time_drop']*1e3, 2)
-        stats['afterglow_time'] = np.round(afterglow_stats['time_drop'], 5)
-
-    stats_df = pd.concat([stats_df, pd.DataFrame([stats])], ignore_index=True)
-
 
 
     
@@ -354,6 +671,7 @@ for idx, data_file in enumerate(st.session_state.data_files):
     curve_fit_falling_edge = st.checkbox("Curve Fit Falling Edge", value=False, key=f"curve_fit_{file_name}")
     # Show fits if requested
     if curve_fit_falling_edge:
+        from scipy.optimize import curve_fit  # only loaded once a fit is requested
         with st.expander("Falling Edge Analysis", expanded=True):
             # Create fit plot
             fig_fit = go.Figure()
@@ -368,15 +686,30 @@ for idx, data_file in enumerate(st.session_state.data_files):
                 )
             )
 
-            # Power law fit
+            # Fits and their bootstrap intervals are cached like the statistics
+            fit_params = dict(bootstrap=bootstrap_fit, resamples=bootstrap_resamples, budget=bootstrap_budget,
+                              confidence=confidence_level)
+            fit_version = code_version(__file__, "leakage_current_functions", "uncertainty_functions")
+            power_law_key = result_key(result_keys[idx], dict(fit_params, model="power_law"), fit_version)
+            exponential_key = result_key(result_keys[idx], dict(fit_params, model="exponential"), fit_version)
+            cached_fits = result_cache.get_many([power_law_key, exponential_key])
+
+            fit_updates = {}
+
+            # Power law fit. The bootstrap has its own try below, so a failed bootstrap does
+            # not hide a fit that succeeded
+            power_law = cached_fits.get(power_law_key)
             try:
-                popt, pcov = curve_fit(
-                    power_law_fit,
-                    df_falling_edge["Aligned_time (s)"],
-                    df_falling_edge["Current (A)"],
-                    p0=(0.1, -1e-7, 5e-8),
-                )
-                a, n, c = popt
+                if power_law is None:
+                    with profiler.stage("curve_fit"):
+                        popt, _ = curve_fit(
+                            power_law_fit,
+                            df_falling_edge["Aligned_time (s)"],
+                            df_falling_edge["Current (A)"],
+                            p0=(0.1, -1e-7, 5e-8),
+                        )
+                    power_law = fit_updates[power_law_key] = {'popt': popt}
+                a, n, c = power_law['popt']
                 fig_fit.add_trace(
                     go.Scatter(
                         x=df_falling_edge["Aligned_time (s)"],
@@ -386,18 +719,49 @@ for idx, data_file in enumerate(st.session_state.data_files):
                     )
                 )
             except:
+                power_law = None
                 st.warning("Power law fit failed")
+            if bootstrap_fit and power_law is not None:
+                try:
+                    if 'intervals' not in power_law:
+                        with profiler.stage("bootstrap_curve_fit"):
+                            bootstrap_stats = bootstrap_curve_fit(
+                                power_law_fit,
+                                df_falling_edge["Aligned_time (s)"],
+                                df_falling_edge["Current (A)"],
+                                power_law['popt'],
+                                n_resamples=bootstrap_resamples,
+                                time_budget=bootstrap_budget,
+                            )
+                        power_law['intervals'] = confidence_intervals(bootstrap_stats['samples'], ['a', 'n', 'c'],
+                                                                      confidence_level)
+                        power_law['n_resamples'] = bootstrap_stats['n_resamples']
+                        fit_updates[power_law_key] = power_law
+                    intervals = power_law['intervals']
+                    st.write(
+                        f"Power law {confidence_level*100:.0f}% CI: "
+                        f"n = [{intervals['n'][0]:.5f}, {intervals['n'][1]:.5f}], "
+                        f"a = [{intervals['a'][0]:.5f}, {intervals['a'][1]:.5f}], "
+                        f"c = [{intervals['c'][0]:.5f}, {intervals['c'][1]:.5f}] "
+                        f"({power_law['n_resamples']} resamples)"
+                    )
+                except Exception as error:
+                    st.warning(f"Power law bootstrap failed: {error}")
             st.write("Power law equation: I(t) = (t - a)^n + c - a")
             st.write(f"Power law fit: a={a:.5f}, n={n:.5f}, c={c:.5f}")
             # Exponential fit
+            exponential = cached_fits.get(exponential_key)
             try:
-                popt, _ = curve_fit(
-                    exponential_fit,
-                    df_falling_edge["Aligned_time (s)"],
-                    df_falling_edge["Current (A)"],
-                    p0=(1e2, 1e2, 5e-8),
-                )
-                a, b, c = popt
+                if exponential is None:
+                    with profiler.stage("curve_fit"):
+                        popt, _ = curve_fit(
+                            exponential_fit,
+                            df_falling_edge["Aligned_time (s)"],
+                            df_falling_edge["Current (A)"],
+                            p0=(1e2, 1e2, 5e-8),
+                        )
+                    exponential = fit_updates[exponential_key] = {'popt': popt}
+                a, b, c = exponential['popt']
                 fig_fit.add_trace(
                     go.Scatter(
                         x=df_falling_edge["Aligned_time (s)"],
@@ -407,7 +771,34 @@ for idx, data_file in enumerate(st.session_state.data_files):
                     )
                 )
             except:
+                exponential = None
                 st.warning("Exponential fit failed")
+            if bootstrap_fit and exponential is not None:
+                try:
+                    if 'tau_interval' not in exponential:
+                        with profiler.stage("bootstrap_curve_fit"):
+                            bootstrap_stats = bootstrap_curve_fit(
+                                exponential_fit,
+                                df_falling_edge["Aligned_time (s)"],
+                                df_falling_edge["Current (A)"],
+                                exponential['popt'],
+                                n_resamples=bootstrap_resamples,
+                                time_budget=bootstrap_budget,
+                            )
+                        # τ = 1/a, so its interval comes from the inverted samples
+                        tau_samples = 1 / bootstrap_stats['samples'][:, :1]
+                        exponential['tau_interval'] = confidence_intervals(tau_samples, ['tau'], confidence_level)['tau']
+                        exponential['n_resamples'] = bootstrap_stats['n_resamples']
+                        fit_updates[exponential_key] = exponential
+                    tau_interval = exponential['tau_interval']
+                    st.write(
+                        f"Afterglow τ {confidence_level*100:.0f}% CI: "
+                        f"[{tau_interval[0]:.4f}, {tau_interval[1]:.4f}] s "
+                        f"({exponential['n_resamples']} resamples)"
+                    )
+                except Exception as error:
+                    st.warning(f"Exponential bootstrap failed: {error}")
+            result_cache.put_many(fit_updates)
             st.write("Exponential equation: I(t) = exp(-a*t + b) + c")
             st.write(f"Exponential fit: a={a:.3f}, b={b:.3f}, c={c:.3f}")
 
@@ -436,7 +827,29 @@ for idx, data_file in enumerate(st.session_state.data_files):
             )
 
             # Display fit plot
-            st.plotly_chart(fig_fit, use_container_width=True)
+            with profiler.stage("plotly_chart_fit"):
+                st.plotly_chart(fig_fit, use_container_width=True)
+
+with profiler.stage("result_cache_store"):
+    result_cache.put_many(new_results)
+with profiler.stage("warehouse_append"):
+    try:
+        append_results(warehouse_rows)
+    except OSError as error:
+        st.warning(f"Could not append the results to the results warehouse: {error}")
+stats_df = pd.DataFrame(stats_rows)
+
+if small_multiples:
+    with st.expander("Small Multiples", expanded=True), profiler.stage("plotly_chart_small_multiples"):
+        fig_small_multiples = small_multiples_figure(
+            small_multiples,
+            n_cols=small_multiples_cols,
+            colors=colors,
+            max_points=small_multiples_points,
+            log_x=log_x,
+            log_y=log_y,
+        )
+        st.plotly_chart(fig_small_multiples, use_container_width=True)
 
 with stats_container:
     # Format numeric columns to scientific notation
@@ -451,6 +864,65 @@ with stats_container:
         mime="text/csv",
     )
 
+if plot_mode == "Ensemble" and aligned_traces:
+    # Resample every aligned trace onto one time grid and plot a few traces per group
+    time_grid = np.linspace(time_min, time_max, ensemble_points)
+    group_labels = np.array([group_label for group_label, _, _ in aligned_traces])
+    with profiler.stage("ensemble_resample"):
+        stack = batched_interp(
+            [time for _, time, _ in aligned_traces], [current for _, _, current in aligned_traces], time_grid
+        )
+    for group_idx, group_label in enumerate(np.unique(group_labels)):
+        group_stats = ensemble_stats(stack[group_labels == group_label], (ensemble_low, ensemble_high))
+        color = colors[group_idx % len(colors)]
+        if ensemble_band == "Percentile":
+            band_low, band_high = group_stats[ensemble_low], group_stats[ensemble_high]
+            band_name = f"{group_label} P{ensemble_low}-P{ensemble_high}"
+        else:
+            band_low = group_stats['mean'] - group_stats['std']
+            band_high = group_stats['mean'] + group_stats['std']
+            band_name = f"{group_label} mean ± std"
+        fig_main.add_scatter(
+            x=np.concatenate([time_grid, time_grid[::-1]]),
+            y=np.concatenate([band_high, band_low[::-1]]),
+            fill="toself",
+            fillcolor=color,
+            opacity=0.25,
+            line=dict(width=0),
+            name=band_name,
+        )
+        fig_main.add_scatter(
+            x=time_grid,
+            y=group_stats['mean'],
+            name=f"{group_label} mean (n={int(group_stats['count'].max())})",
+            mode="lines",
+            line=dict(width=2 * line_width, color=color),
+        )
+        fig_main.add_scatter(
+            x=time_grid,
+            y=group_stats['median'],
+            name=f"{group_label} median",
+            mode="lines",
+            line=dict(width=line_width, color=color, dash="dash"),
+        )
+
+if plot_mode == "Density" and aligned_traces:
+    # One heatmap per group, so the browser draws a fixed number of pixels however many files are loaded
+    groups = {}
+    for group_label, time, current in aligned_traces:
+        groups.setdefault(group_label, ([], []))
+        groups[group_label][0].append(time)
+        groups[group_label][1].append(current)
+    current_range = density_range(np.concatenate([current for _, _, current in aligned_traces]), log_y)
+    current_range = current_range or (1e-12, 1e-5)
+    time_range = (max(time_min, 1e-4), time_max) if log_x else (time_min, time_max)
+    with profiler.stage("density_histogram"):
+        fig_density = density_figure(
+            groups, time_range, current_range, colors=colors, width=density_width, height=density_height,
+            log_x=log_x, log_y=log_y, log_counts=density_log_counts,
+        )
+    fig_main.add_traces(fig_density.data)
+
 # Add horizontal line for threshold current
 if show_threshold_line:
     fig_main.add_hline(
@@ -516,5 +988,7 @@ fig_main.update_layout( # Legend configuration
     )
 )
 
-with main_plot_container:
-    st.plotly_chart(fig_main, use_container_width=True, config={"responsive": True})
\ No newline at end of file
+with main_plot_container, profiler.stage("plotly_chart_main"):
+    st.plotly_chart(fig_main, use_container_width=True, config={"responsive": True})
+
+show_profile(profiler)
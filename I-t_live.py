@@ -0,0 +1,128 @@
+import os
+import streamlit as st
+import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+from utils import find_pulse_end, get_sample_data
+from leakage_current_functions import calculate_current_difference
+from live_functions import RingBuffer, TailReader
+from ingest_functions import DATA_ROOT, data_root_path
+from pulse_functions import OnsetTracker
+
+st.set_page_config(layout="wide")
+
+# Set page title
+st.title("Live I-t Acquisition")
+st.caption("Created by: John Feng")
+
+with st.sidebar:
+    watch_folder = st.text_input("Watch folder", value="SAMPLES",
+                                 help=f"Inside {DATA_ROOT} (the DATA_ROOT setting)")
+    try:
+        watch_folder = data_root_path(watch_folder)
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
+    live_files = sorted(get_sample_data("I-t", watch_folder) if os.path.isdir(watch_folder) else [],
+                        key=os.path.getmtime, reverse=True)
+    if not live_files:
+        st.warning("No I-t files found in the watch folder")
+        st.stop()
+    live_file = st.selectbox("Acquisition file", live_files, index=0, help="Newest file first",
+                             format_func=lambda file: os.path.relpath(file, watch_folder))
+    live_update = st.toggle("Live update", value=True)
+    refresh_interval = st.number_input("Refresh interval (s)", min_value=0.2, max_value=60.0, value=1.0, step=0.2)
+    buffer_capacity = st.number_input("Buffer size (samples)", min_value=1000, max_value=5_000_000, value=100_000, step=1000)
+    display_window = st.number_input("Display window (s)", min_value=1.0, max_value=3600.0, value=30.0, step=1.0)
+    threshold_input = st.number_input(
+        "Pulse Start Threshold (nA)", min_value=1, max_value=10000, value=2000
+    )
+    first_n_points = st.number_input("First n Points to average", min_value=1, max_value=100, value=10, step=1)
+    last_n_points = st.number_input("Last n Points to average", min_value=1, max_value=100, value=10, step=1)
+    restart = st.button("Restart from beginning of file")
+
+# The reader, buffer and running stats live in the session so every refresh only
+# parses the bytes written since the previous one
+def reset_live_state():
+    st.session_state.live_buffer = RingBuffer(capacity=buffer_capacity)
+    st.session_state.live_onsets = OnsetTracker(threshold_input * 1e-9)
+    st.session_state.live_pending = []
+    st.session_state.live_pulse_stats = []
+
+
+live_key = (live_file, buffer_capacity, threshold_input, first_n_points, last_n_points)
+if restart or st.session_state.get("live_key") != live_key:
+    st.session_state.live_key = live_key
+    st.session_state.live_reader = TailReader(live_file)
+    st.session_state.live_generation = 0
+    reset_live_state()
+
+
+@st.fragment(run_every=refresh_interval if live_update else None)
+def live_view():
+    reader = st.session_state.live_reader
+    new_rows = reader.read_new()
+    if reader.generation != st.session_state.live_generation:
+        # The file was replaced by a new run: drop the samples and pulses of the old one
+        st.session_state.live_generation = reader.generation
+        reset_live_state()
+    buffer = st.session_state.live_buffer
+    if len(new_rows) and "Time (s)" in new_rows and "Current (A)" in new_rows:
+        buffer.append(new_rows)
+        st.session_state.live_pending += st.session_state.live_onsets.update(
+            new_rows["Time (s)"].to_numpy(), new_rows["Current (A)"].to_numpy()
+        )
+    df = buffer.to_frame()
+
+    # Pulses are analysed once, as soon as the current has dropped below the threshold again
+    pending = []
+    for onset in st.session_state.live_pending:
+        df_pulse = df[df["Time (s)"] >= onset].reset_index(drop=True)
+        if df_pulse.empty:
+            continue  # pulse already scrolled out of the buffer
+        pulse_end_index, pulse_end_time = find_pulse_end(df_pulse, threshold_input * 1e-9)
+        if pulse_end_index >= df_pulse.index[-1]:
+            pending.append(onset)
+            continue
+        leakage_stats = calculate_current_difference(df_pulse.iloc[:pulse_end_index], first_n_points, last_n_points)
+        st.session_state.live_pulse_stats.append({
+            'pulse': len(st.session_state.live_pulse_stats) + 1,
+            'onset_time': np.round(onset, 4),
+            'pulse_width': np.round(pulse_end_time - onset, 4),
+            'photocurrent_start': f"{leakage_stats['start']:.2e}",
+            'photocurrent_end': f"{leakage_stats['end']:.2e}",
+            'leakage_current': f"{leakage_stats['difference']:.2e}",
+        })
+    st.session_state.live_pending = pending
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Rows read", f"{buffer.n_total:,}")
+    col2.metric("Bytes read", f"{reader.offset:,}")
+    col3.metric("Pulses detected", len(st.session_state.live_onsets.onsets))
+    col4.metric("Last sample (s)", f"{df['Time (s)'].iloc[-1]:.2f}" if len(df) else "-")
+    # Files from the instrument simulator record their start time, so the age of the
+    # newest sample when it was read shows how far the dashboard is behind the acquisition
+    lag = reader.lag()
+    if lag is not None:
+        col5.metric("Lag (s)", f"{lag:.2f}")
+
+    df_window = df[df["Time (s)"] >= df["Time (s)"].max() - display_window] if len(df) else df
+    fig = go.Figure()
+    fig.add_scatter(x=df_window["Time (s)"], y=df_window["Current (A)"], mode="lines", name="Current")
+    for onset in st.session_state.live_onsets.onsets:
+        if len(df_window) and onset >= df_window["Time (s)"].iloc[0]:
+            fig.add_vline(x=onset, line_dash="dash", line_color="grey")
+    fig.update_layout(
+        title=reader.metadata.get("Device ID", os.path.basename(live_file)),
+        xaxis_title="Time (s)",
+        yaxis_title="Current (A)",
+        height=500,
+        yaxis=dict(exponentformat="e", showexponent="all"),
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    if st.session_state.live_pulse_stats:
+        st.dataframe(pd.DataFrame(st.session_state.live_pulse_stats), use_container_width=True)
+
+
+live_view()
@@ -3,15 +3,27 @@ import pandas as pd
 import numpy as np
 import os
 import plotly.graph_objects as go
-import plotly.express as px
 from utils import (get_colors, 
                    calculate_first_derivative, 
                    data_extractor, 
                    extract_filename,
-                   get_file_name,
-                   extract_metadata)
+                   get_file_name)
+from iv_functions import (stack_iv_curves, 
+                          parse_region_edges, 
+                          weighted_power_law_fit, 
+                          weighted_fit_rows, 
+                          segment_power_law, 
+                          log_voltage_grid, 
+                          resample_iv_curves, 
+                          iv_envelope)
+from profiling import start_profiler, show_profile
+from ingest_functions import file_digest, read_measurement, source_locator
+from result_cache_functions import code_version
+from warehouse_functions import append_results, result_row
+from plot_functions import density_figure, density_range
 
 st.set_page_config(layout="wide")
+profiler = start_profiler("IV_app")
 
 # Set page title
 st.title("IV Curve Analysis")
@@ -26,6 +38,20 @@ with st.sidebar:
     only_positive_voltage = st.checkbox("Voltage > 0", value=False)
     only_negative_voltage = st.checkbox("Voltage < 0", value=False)
     log_bar_chart = st.checkbox("Log y-axis for bar chart", value=True)
+    bar_chart_voltage = st.number_input("Bar chart voltage (V)", min_value=-1000.0, max_value=1000.0, value=1000.0, step=10.0)
+    show_envelope = st.checkbox("Show I-V envelope across devices", value=False)
+    density_view = st.checkbox("Density view of all curves", value=False,
+                               help="Bin all curves into one 2D histogram image instead of one trace per file")
+    if density_view:
+        density_group = st.selectbox("Density group", ["All", "Surface Treatment", "Guard Ring"], index=0)
+        density_width = st.number_input("Density pixels (voltage)", min_value=100, max_value=4000, value=800, step=100)
+        density_height = st.number_input("Density pixels (current)", min_value=50, max_value=2000, value=400, step=50)
+    show_slope_error_bars = st.checkbox("Slope error bars", value=False)
+    weighted_fit = st.checkbox("Weighted power law fit (Current Std)", value=False)
+    region_edges_input = st.text_input("Region boundaries (V)", value="1, 10, 100, 1000")
+    segment_regimes = st.checkbox("Conduction regime segmentation", value=False)
+    segment_penalty = st.number_input("Segment penalty", min_value=0.001, max_value=10.0, value=0.05, step=0.01, format="%.3f")
+    segment_min_points = st.number_input("Min points per segment", min_value=2, max_value=20, value=3, step=1)
     st.subheader("Plot settings:")
     marker_size = st.slider("Marker size", min_value=1, max_value=10, value=5, step=1)
     line_width = st.slider(
@@ -59,23 +85,25 @@ data_source, data_files = data_extractor(measurement_type="I-V")
 # Create a figure for all curves
 fig_IV = go.Figure()
 fig_power_law = go.Figure()
-colors = get_colors(color_scheme)
+colors = get_colors(color_scheme, len(data_files))
 df_bar_chart = pd.DataFrame()
+iv_curves = []
+iv_labels = []
+iv_files = []
+density_traces = []
 
 for idx, data_file in enumerate(data_files):
     file_path = extract_filename(data_source, data_file)
     file_name = get_file_name(file_path)
     
-    try:
-        metadata = extract_metadata(data_file)
-    except:
-        metadata = {}
-        
-    # Read the CSV file
-    df = pd.read_csv(data_file, comment="#")
+    # Read the CSV file, parsed once per file content
+    with profiler.stage("read_measurement"):
+        digest = file_digest(data_file)
+        df, metadata = read_measurement(data_file, digest)
     df["Voltage sign"] = np.sign(df["Voltage (V)"])
     # Calculate first derivative
-    df = calculate_first_derivative(df)
+    with profiler.stage("first_derivative"):
+        df = calculate_first_derivative(df)
 
     # with st.expander("Raw Data", expanded=False):
     #     st.write(df)
@@ -106,7 +134,7 @@ for idx, data_file in enumerate(data_files):
     df_negative = df_IV[df_IV["Voltage sign"] < 0]
 
     # Add positive voltage trace
-    if not df_positive.empty:
+    if not df_positive.empty and not density_view:
         fig_IV.add_scatter(
             x=df_positive["Voltage (V)"],
             y=df_positive["Current (A)"],
@@ -117,17 +145,20 @@ for idx, data_file in enumerate(data_files):
             marker=dict(symbol="circle", size=marker_size, color=colors[idx]),
             showlegend=True,
         )
-        
+
+    if not df_positive.empty:
         fig_power_law.add_scatter(
             x=df_positive["Voltage (V)"],
             y=df_positive["power_law_slope"],
             name=plot_label + " (V ≥ 0)",
             mode="markers+lines",
             line=dict(width=line_width, color=colors[idx]),
+            error_y=dict(type="data", array=df_positive["power_law_slope_err"], visible=True)
+            if show_slope_error_bars and "power_law_slope_err" in df_positive else None,
         )
 
     # Add negative voltage trace
-    if not df_negative.empty:
+    if not df_negative.empty and not density_view:
         fig_IV.add_scatter(
             x=df_negative["Voltage (V)"],
             y=df_negative["Current (A)"],
@@ -137,7 +168,8 @@ for idx, data_file in enumerate(data_files):
             marker=dict(symbol=negative_marker_symbol, size=marker_size, color=colors[idx]),
             showlegend=True,
         )
-        
+
+    if not df_negative.empty:
         fig_power_law.add_scatter(
             x=df_negative["Abs Voltage (V)"],
             y=df_negative["power_law_slope"],
@@ -145,11 +177,21 @@ for idx, data_file in enumerate(data_files):
             mode="markers+lines",
             line=dict(width=line_width, color=colors[idx], dash=negative_line_style),
             marker=dict(symbol=negative_marker_symbol, size=marker_size, color=colors[idx]),
+            error_y=dict(type="data", array=df_negative["power_law_slope_err"], visible=True)
+            if show_slope_error_bars and "power_law_slope_err" in df_negative else None,
             showlegend=True,
         )
 
+    iv_curves.append(df)
+    iv_labels.append(plot_label)
+    iv_files.append((file_name, source_locator(data_file), digest, metadata))
+    if density_view:
+        density_label = str(metadata.get(density_group, "unknown")) if density_group != "All" else "All"
+        for df_branch in (df_positive, df_negative):
+            if len(df_branch):
+                density_traces.append((density_label, df_branch["Voltage (V)"].to_numpy(), df_branch["Current (A)"].to_numpy()))
+
     if "Surface Treatment" in metadata:
-        current_at_1000V = df[df["Voltage (V)"] == 1000]["Current (A)"]
         df_bar_chart = pd.concat(
             [
             df_bar_chart,
@@ -159,7 +201,6 @@ for idx, data_file in enumerate(data_files):
                     "File Name": file_name,
                     "Device ID": df["Device ID"].iloc[0],
                     "Contact ID": df["Contact ID"].iloc[0],
-                    "Current at 1000V": current_at_1000V,
                     "Color": colors[idx],
                     "Surface Treatment": metadata["Surface Treatment"],
                     "Guard Ring": metadata["Guard Ring"],
@@ -168,7 +209,6 @@ for idx, data_file in enumerate(data_files):
             ]
         )
     else:
-        current_at_1000V = df[df["Voltage (V)"] == 1000]["Current (A)"]
         df_bar_chart = pd.concat(
             [
             df_bar_chart,
@@ -178,13 +218,80 @@ for idx, data_file in enumerate(data_files):
                     "File Name": file_name,
                     "Device ID": df["Device ID"].iloc[0],
                     "Contact ID": df["Contact ID"].iloc[0],
-                    "Current at 1000V": current_at_1000V,
                     "Color": colors[idx],
                 }
             ),
             ]
         )
         
+if segment_regimes and iv_curves:
+    # Segment every curve and polarity in one pass; overlay the segment slopes on the slope plot
+    segment_rows = []
+    for polarity, polarity_label, line_dash in [(1, "V ≥ 0", "solid"), (-1, "V < 0", negative_line_style)]:
+        voltage_grid, stacked = stack_iv_curves(iv_curves, polarity=polarity)
+        with profiler.stage("segment_power_law"):
+            curve_segments = segment_power_law(
+                voltage_grid, stacked["Current (A)"], penalty=segment_penalty, min_size=segment_min_points
+            )
+        for idx, (plot_label, segments) in enumerate(zip(iv_labels, curve_segments)):
+            for segment in segments:
+                segment_rows.append({
+                    'Curve': plot_label,
+                    'Polarity': polarity_label,
+                    'Start |V|': round(segment['start_voltage'], 2),
+                    'End |V|': round(segment['end_voltage'], 2),
+                    'Slope': round(segment['slope'], 3),
+                    'Regime': segment['regime'],
+                    'Points': segment['n_points'],
+                })
+            fig_power_law.add_scatter(
+                x=[v for segment in segments for v in (segment['start_voltage'], segment['end_voltage'], None)],
+                y=[m for segment in segments for m in (segment['slope'], segment['slope'], None)],
+                name=f"{plot_label} ({polarity_label}) segments",
+                mode="lines",
+                line=dict(width=3 * line_width, color=colors[idx], dash=line_dash),
+            )
+
+# |I| at the chosen voltage, interpolated in log-log space rather than matched exactly; the
+# magnitude is plotted for either polarity, so negative voltages still show on the log axis
+bar_chart_label = f"|I| at {bar_chart_voltage:g}V"
+if iv_curves:
+    with profiler.stage("resample_bar_chart"):
+        df_bar_chart[bar_chart_label] = resample_iv_curves(
+            iv_curves, [bar_chart_voltage], polarity=1 if bar_chart_voltage >= 0 else -1
+        )[:, 0]
+
+# Dark current at 1000 V of every file for the results warehouse, which skips the files
+# already stored by the same code version
+if iv_curves:
+    warehouse_version = code_version(__file__, "iv_functions", "ingest_functions")
+    with profiler.stage("warehouse_append"):
+        dark_current = resample_iv_curves(iv_curves, [1000.0], polarity=1)[:, 0]
+        try:
+            append_results([result_row("I-V", *iv_file, params={'voltage': 1000.0}, version=warehouse_version,
+                                       dark_current_1000V=current)
+                            for iv_file, current in zip(iv_files, dark_current)])
+        except OSError as error:
+            st.warning(f"Could not append the results to the results warehouse: {error}")
+
+if density_view and density_traces:
+    groups = {}
+    for group_label, voltage, current in density_traces:
+        groups.setdefault(group_label, ([], []))
+        groups[group_label][0].append(voltage)
+        groups[group_label][1].append(current)
+    voltage_range = density_range(np.concatenate([voltage for _, voltage, _ in density_traces]), log_x)
+    current_range = density_range(np.concatenate([current for _, _, current in density_traces]), log_y)
+    if voltage_range is None or current_range is None:
+        st.info("No data points to draw the density of on these axes")
+    else:
+        with profiler.stage("density_histogram"):
+            fig_density = density_figure(
+                groups, voltage_range, current_range,
+                colors=colors, width=density_width, height=density_height, log_x=log_x, log_y=log_y,
+            )
+        fig_IV.add_traces(fig_density.data)
+
 # Update layout for better visualization
 fig_IV.update_layout(
     showlegend=show_legend,
@@ -257,29 +364,119 @@ fig_power_law.update_layout(
     ),
 )
 
-st.plotly_chart(fig_IV, use_container_width=True, config={"responsive": True})
+with profiler.stage("plotly_chart_iv"):
+    st.plotly_chart(fig_IV, use_container_width=True, config={"responsive": True})
 
 with st.expander("Power Law Slope", expanded=True):
-    st.plotly_chart(fig_power_law, use_container_width=True)
+    with profiler.stage("plotly_chart_power_law"):
+        st.plotly_chart(fig_power_law, use_container_width=True)
+
+
+if weighted_fit and iv_curves:
+    with st.expander("Weighted Power Law Fits", expanded=True):
+        # Fit every curve, region and polarity in one pass on a common voltage grid
+        try:
+            region_edges = parse_region_edges(region_edges_input)
+        except ValueError as error:
+            st.error(str(error))
+            region_edges = None
+        weighted_fit_table = []
+        for polarity, polarity_label in [(1, "V ≥ 0"), (-1, "V < 0")] if region_edges else []:
+            voltage_grid, stacked = stack_iv_curves(iv_curves, polarity=polarity)
+            with profiler.stage("weighted_power_law_fit"):
+                fit_stats = weighted_power_law_fit(
+                    voltage_grid, stacked["Current (A)"], stacked["Current Std (A)"], region_edges
+                )
+            weighted_fit_table += weighted_fit_rows(fit_stats, iv_labels, region_edges, polarity_label)
+        if weighted_fit_table:
+            st.write(pd.DataFrame(weighted_fit_table))
+
+if segment_regimes and iv_curves:
+    with st.expander("Conduction Regime Segments", expanded=True):
+        st.write(pd.DataFrame(segment_rows))
 
+if show_envelope and iv_curves:
+    with st.expander("I-V Envelope Across Devices", expanded=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            envelope_group = st.radio("Envelope group", ["All", "Surface Treatment", "Guard Ring"], index=0, horizontal=True)
+        with col2:
+            envelope_low, envelope_high = st.slider("Envelope percentiles", min_value=0, max_value=100, value=(10, 90), step=5)
+        voltage_grid = log_voltage_grid(0.1, 1000.0, 200)
+        if envelope_group == "All" or envelope_group not in df_bar_chart:
+            group_labels = np.array(["All"] * len(iv_curves))
+        else:
+            group_labels = df_bar_chart[envelope_group].astype(str).to_numpy()
+        fig_envelope = go.Figure()
+        envelope_colors = get_colors(color_scheme)
+        for polarity, polarity_label, line_dash in [(1, "V ≥ 0", "solid"), (-1, "V < 0", negative_line_style)]:
+            with profiler.stage("resample_envelope"):
+                resampled = resample_iv_curves(iv_curves, voltage_grid, polarity=polarity)
+            for group_idx, group in enumerate(np.unique(group_labels)):
+                envelope = iv_envelope(resampled[group_labels == group], (envelope_low, 50, envelope_high))
+                color = envelope_colors[group_idx % len(envelope_colors)]
+                fig_envelope.add_scatter(
+                    x=np.concatenate([voltage_grid, voltage_grid[::-1]]),
+                    y=np.concatenate([envelope[envelope_high], envelope[envelope_low][::-1]]),
+                    fill="toself",
+                    fillcolor=color,
+                    opacity=0.2,
+                    line=dict(width=0),
+                    name=f"{group} ({polarity_label}) P{envelope_low}-P{envelope_high}",
+                )
+                fig_envelope.add_scatter(
+                    x=voltage_grid,
+                    y=envelope[50],
+                    mode="lines",
+                    line=dict(width=2 * line_width, color=color, dash=line_dash),
+                    name=f"{group} ({polarity_label}) median",
+                )
+        fig_envelope.update_layout(
+            title="Median and Percentile Envelope of |I| vs |V|",
+            height=size_y,
+            width=size_x,
+            xaxis=dict(
+                title="Absolute Voltage (V)",
+                type="log",
+                title_font=dict(size=axis_label_size, color=axis_tick_color),
+                tickfont=dict(size=axis_tick_size, color=axis_tick_color),
+                showgrid=True,
+                gridwidth=1,
+                gridcolor="lightgrey",
+            ),
+            yaxis=dict(
+                title="Absolute Current (A)",
+                type="log",
+                title_font=dict(size=axis_label_size, color=axis_tick_color),
+                tickfont=dict(size=axis_tick_size, color=axis_tick_color),
+                showgrid=True,
+                gridwidth=1,
+                gridcolor="lightgrey",
+                exponentformat="e",
+                showexponent="all",
+            ),
+        )
+        with profiler.stage("plotly_chart_envelope"):
+            st.plotly_chart(fig_envelope, use_container_width=True, config={"responsive": True})
 
-with st.expander("Bar Chart of Dark Current at 1000V", expanded=True):
+with st.expander(f"Bar Chart of Dark Current at {bar_chart_voltage:g}V", expanded=True):
     col1, col2 = st.columns(2)
     with col1:
         x_choice = st.radio("X-axis", ["Device ID", "Contact ID", "Surface Treatment", "Guard Ring"], index=0)
     with col2:
         group_choice = st.radio("Group by", ["Device ID", "Contact ID", "Surface Treatment", "Guard Ring"], index=1)
+    import plotly.express as px  # only the bar chart uses plotly express
     fig_bar = px.bar(
         df_bar_chart,
         x=x_choice,
-        y="Current at 1000V",
+        y=bar_chart_label,
         color=group_choice,
         color_discrete_map=dict(zip(df_bar_chart["Device ID"], df_bar_chart["Color"])),
         barmode='group'  # Show bars side by side
     )
     
     fig_bar.update_layout(
-        title="Dark Current at 1000V",
+        title=f"Dark Current at {bar_chart_voltage:g}V",
         showlegend=True,
         bargap=0.15,  # Reduce space between bars in different groups
         bargroupgap=0.1,  # Reduce space between bars in the same group
@@ -293,7 +490,7 @@ with st.expander("Bar Chart of Dark Current at 1000V", expanded=True):
         ),
 
         yaxis=dict(
-            title="Current (A) - log scale" if log_bar_chart else "Current (A)",
+            title="Absolute Current (A) - log scale" if log_bar_chart else "Absolute Current (A)",
             type="log" if log_bar_chart else "linear",  # Set y-axis to logarithmic scale
             exponentformat="e",  # Use scientific notation
             showexponent="all",  # Show exponent for all numbers
@@ -305,6 +502,7 @@ with st.expander("Bar Chart of Dark Current at 1000V", expanded=True):
             tickfont=dict(size=axis_tick_size, color=axis_tick_color),  # Increase tick label font size
         ),
     )
-    st.plotly_chart(fig_bar, use_container_width=True, config={"responsive": True})
-
+    with profiler.stage("plotly_chart_bar"):
+        st.plotly_chart(fig_bar, use_container_width=True, config={"responsive": True})
 
+show_profile(profiler)
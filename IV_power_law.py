@@ -6,11 +6,16 @@ from utils import (get_colors,
                    calculate_first_derivative, 
                    data_extractor, 
                    extract_filename,
-                   get_file_name,
-                   extract_metadata)
+                   get_file_name)
 from plotly.subplots import make_subplots
+from uncertainty_functions import bootstrap_linear_fit, confidence_intervals
+from iv_functions import stack_iv_curves, parse_region_edges, weighted_power_law_fit, weighted_fit_rows
+from profiling import start_profiler, show_profile
+from ingest_functions import file_digest, read_measurement
+from result_cache_functions import code_version, result_cache, result_key
 
 st.set_page_config(layout="wide")
+profiler = start_profiler("IV_power_law")
 
 # Set page title
 st.title("I-V Power Law Analysis")
@@ -25,6 +30,17 @@ with st.sidebar:
     only_positive_voltage = st.checkbox("Voltage > 0", value=False)
     only_negative_voltage = st.checkbox("Voltage < 0", value=False)
     overlay_power_law = st.checkbox("Overlay power law fit", value=False)
+    bootstrap_exponent = st.checkbox("Bootstrap power law exponent", value=False)
+    fit_voltage_min, fit_voltage_max = st.slider(
+        "Exponent fit voltage range (V)", min_value=1.0, max_value=1000.0, value=(10.0, 1000.0), step=1.0
+    )
+    bootstrap_resamples = st.number_input("Bootstrap resamples", min_value=100, max_value=100000, value=5000, step=100)
+    bootstrap_budget = st.number_input("Bootstrap time budget (s)", min_value=0.5, max_value=30.0, value=2.0, step=0.5)
+    confidence_level = st.slider("Confidence level", min_value=0.80, max_value=0.99, value=0.95, step=0.01)
+    st.subheader("Weighted fitting:")
+    weighted_fit = st.checkbox("Weighted power law fit (Current Std)", value=False)
+    region_edges_input = st.text_input("Region boundaries (V)", value="1, 10, 100, 1000")
+    show_slope_error_bars = st.checkbox("Slope error bars", value=False)
     marker_size = st.slider("Marker size", min_value=1, max_value=10, value=5, step=1)
     line_width = st.slider(
         "Line width", min_value=0.5, max_value=5.0, value=1.0, step=0.5
@@ -43,23 +59,29 @@ data_source, data_files = data_extractor(measurement_type="I-V")
 # Create a figure with secondary y-axis
 fig = make_subplots(specs=[[{"secondary_y": True}]])
 fig2 = go.Figure()
-colors = get_colors(color_scheme)
+colors = get_colors(color_scheme, len(data_files))
+exponent_rows = []
+iv_curves = []
+iv_labels = []
+# Bootstrapped exponents are kept on disk by file content, fit settings and code version
+exponent_params = dict(voltage_range=(fit_voltage_min, fit_voltage_max), resamples=bootstrap_resamples,
+                       budget=bootstrap_budget, confidence=confidence_level)
+exponent_version = code_version(__file__, "utils", "uncertainty_functions", "ingest_functions")
 
 # Process each uploaded file
 for idx, data_file in enumerate(data_files):
     file_path = extract_filename(data_source, data_file)
     file_name = get_file_name(file_path)
-    try:
-        metadata = extract_metadata(data_file)
-    except:
-        metadata = {}
-    # Read the CSV file
-    df = pd.read_csv(data_file, comment="#")
+    # Read the CSV file, parsed once per file content
+    with profiler.stage("read_measurement"):
+        digest = file_digest(data_file)
+        df, metadata = read_measurement(data_file, digest)
     # Filter for positive voltages
     df = df[df["Voltage (V)"] > 0]
 
     # Calculate first derivative and power law slope
-    df = calculate_first_derivative(df)
+    with profiler.stage("first_derivative"):
+        df = calculate_first_derivative(df)
     power_law_slope = np.gradient(
         np.log10(df["Current (A)"]), np.log10(df["Voltage (V)"])
     )
@@ -97,8 +119,36 @@ for idx, data_file in enumerate(data_files):
             mode="markers+lines",
             line=dict(width=line_width, dash="dot"),
             marker=dict(symbol="circle", size=marker_size, color=colors[idx]),
+            error_y=dict(type="data", array=df["power_law_slope_err"], visible=True)
+            if show_slope_error_bars and "power_law_slope_err" in df else None,
         )
     )
+    iv_curves.append(df)
+    iv_labels.append(plot_label)
+
+    if bootstrap_exponent:
+        # Straight-line fit of log(I) vs log(V): the slope is the power law exponent
+        df_fit = df[(df["Voltage (V)"] >= fit_voltage_min) & (df["Voltage (V)"] <= fit_voltage_max)]
+        exponent_key = result_key(digest, exponent_params, exponent_version)
+        exponent = result_cache.get(exponent_key)
+        if exponent is None and len(df_fit) > 2:
+            with profiler.stage("bootstrap_linear_fit"):
+                bootstrap_stats = bootstrap_linear_fit(
+                    np.log10(df_fit["Voltage (V)"]),
+                    np.log10(df_fit["Current (A)"].abs()),
+                    n_resamples=bootstrap_resamples,
+                    time_budget=bootstrap_budget,
+                )
+            intervals = confidence_intervals(bootstrap_stats['samples'], ['exponent', 'intercept'], confidence_level)
+            exponent = {
+                'Exponent': round(bootstrap_stats['popt'][0], 4),
+                'CI lower': round(intervals['exponent'][0], 4),
+                'CI upper': round(intervals['exponent'][1], 4),
+                'Resamples': bootstrap_stats['n_resamples'],
+            }
+            result_cache.put(exponent_key, exponent)
+        if exponent is not None:
+            exponent_rows.append({'Curve': plot_label, **exponent})
 
     if overlay_power_law:
         # Add power law slope trace on secondary y-axis
@@ -115,6 +165,37 @@ for idx, data_file in enumerate(data_files):
         )
 
 
+if weighted_fit and iv_curves:
+    try:
+        region_edges = parse_region_edges(region_edges_input)
+    except ValueError as error:
+        st.error(str(error))
+        region_edges = None
+if weighted_fit and iv_curves and region_edges:
+    # Fit every curve and region in one pass on a common voltage grid
+    voltage_grid, stacked = stack_iv_curves(iv_curves, polarity=1)
+    with profiler.stage("weighted_power_law_fit"):
+        fit_stats = weighted_power_law_fit(
+            voltage_grid, stacked["Current (A)"], stacked["Current Std (A)"], region_edges
+        )
+    weighted_fit_table = weighted_fit_rows(fit_stats, iv_labels, region_edges)
+    for idx, plot_label in enumerate(iv_labels):
+        for region, (low, high) in enumerate(zip(region_edges[:-1], region_edges[1:])):
+            slope = fit_stats['slope'][idx, region]
+            intercept = fit_stats['intercept'][idx, region]
+            if np.isfinite(slope):
+                fit_voltage = np.array([low, high])
+                fig.add_trace(
+                    go.Scatter(
+                        x=fit_voltage,
+                        y=10 ** intercept * fit_voltage ** slope,
+                        name=f"{plot_label} - Fit {low:g}-{high:g} V (n={slope:.2f})",
+                        mode="lines",
+                        line=dict(width=line_width, dash="dash", color=colors[idx]),
+                    ),
+                    secondary_y=False,
+                )
+
 # Update layout for better visualization
 fig.update_layout(
     showlegend=show_legend,
@@ -201,8 +282,16 @@ fig2.update_yaxes(
 
 # Display the plot with full width
 with st.expander("IV Curves", expanded=True):
-    st.plotly_chart(fig, use_container_width=True, config={"responsive": True})
+    with profiler.stage("plotly_chart_iv"):
+        st.plotly_chart(fig, use_container_width=True, config={"responsive": True})
 with st.expander("Power Law Slope", expanded=False):
-    st.plotly_chart(fig2, use_container_width=True, config={"responsive": True})
-
+    with profiler.stage("plotly_chart_power_law"):
+        st.plotly_chart(fig2, use_container_width=True, config={"responsive": True})
+if weighted_fit and iv_curves and region_edges:
+    with st.expander("Weighted Power Law Fits", expanded=True):
+        st.write(pd.DataFrame(weighted_fit_table))
+if bootstrap_exponent:
+    with st.expander(f"Power Law Exponent ({confidence_level*100:.0f}% bootstrap CI)", expanded=True):
+        st.write(pd.DataFrame(exponent_rows))
 
+show_profile(profiler)
@@ -0,0 +1,298 @@
+"""Benchmarks of the dashboard analysis stages at several data sizes.
+
+    python benchmarks.py --sizes 10000 100000 1000000 --output bench.json
+    python benchmarks.py --output bench_new.json --compare bench.json
+    python benchmarks.py --startup --output startup.json
+    python benchmarks.py --import-profile utils
+
+Each stage is timed `repeat` times on synthetic data (see synthetic_data.py) and run once
+more under tracemalloc for its peak Python memory. Results are written as JSON together with
+the git commit and library versions, and --compare prints the change against an earlier run.
+--startup times the first run of every dashboard page in a fresh interpreter instead, and
+--import-profile lists the slowest imports of a module.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+import scipy
+from scipy.optimize import OptimizeWarning, curve_fit
+from ingest_functions import parse_measurement
+from instrument_simulator import IT_COLUMNS, IV_COLUMNS
+from leakage_current_functions import calculate_current_difference, calculate_falling_time, exponential_fit, power_law_fit
+from synthetic_data import synthetic_it_trace, synthetic_iv_sweep, synthetic_metadata, write_pymeasure_csv
+from utils import calculate_first_derivative, extract_metadata, find_pulse_end, find_pulse_start
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+PAGES = ["I-t_app.py", "I-t_live.py", "IV_app.py", "IV_power_law.py"]
+THRESHOLD = 2e-6  # default pulse threshold of the I-t page
+N_TIME_POINTS = 400  # default falling edge length of the I-t page
+
+
+def benchmark_stage(func, repeat=5):
+    """Time func() `repeat` times after one warm-up call (lazy imports, caches), then run it
+    once more under tracemalloc for the peak memory.
+    """
+    func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    stage_stats = {
+        'repeat': repeat,
+        'min_s': min(durations),
+        'median_s': float(np.median(durations)),
+        'mean_s': float(np.mean(durations)),
+        'peak_memory_bytes': peak,
+    }
+    return stage_stats
+
+
+def it_stages(folder, n_samples, seed=0):
+    """Benchmark callables for the I-t page stages on one synthetic trace of n_samples."""
+    rng = np.random.default_rng([seed, 0, n_samples])
+    df = synthetic_it_trace(n_samples, rng=rng)
+    df["Voltage (V)"] = 1000.0
+    metadata = synthetic_metadata("I-t", 0)
+    df["Device ID"] = metadata["Device ID"]
+    df["Contact ID"] = metadata["Contact ID"]
+    file_path = os.path.join(folder, f"I-t_bench_{n_samples}.csv")
+    write_pymeasure_csv(df, file_path, metadata, IT_COLUMNS)
+
+    df = pd.read_csv(file_path, comment="#")
+    pulse_start_index, pulse_start_time = find_pulse_start(df, THRESHOLD)
+    pulse_end_index, _ = find_pulse_end(df, THRESHOLD, pulse_start_index)
+    df["Aligned_time (s)"] = df["Time (s)"] - pulse_start_time
+    df_top_edge = df.iloc[pulse_start_index:pulse_end_index]
+    df_falling_edge = df.iloc[pulse_end_index:pulse_end_index + N_TIME_POINTS]
+    x_fit = df_falling_edge["Aligned_time (s)"]
+    y_fit = df_falling_edge["Current (A)"]
+
+    def read_csv_metadata():
+        pd.read_csv(file_path, comment="#")
+        extract_metadata(file_path)
+
+    def read_typed_pruned():
+        with open(file_path, "rb") as file:
+            parse_measurement(file.read())
+
+    def pulse_edges():
+        start_index, _ = find_pulse_start(df, THRESHOLD)
+        find_pulse_end(df, THRESHOLD, start_index)
+
+    def fit(model, p0):
+        def run():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", OptimizeWarning)
+                try:
+                    curve_fit(model, x_fit, y_fit, p0=p0)
+                except (RuntimeError, ValueError):
+                    pass
+        return run
+
+    def figure_build():
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=df["Aligned_time (s)"], y=df["Current (A)"], mode="markers+lines"))
+        fig.update_layout(height=600, yaxis=dict(exponentformat="e"))
+        return fig
+
+    stages = {
+        'read_csv_metadata': read_csv_metadata,
+        'read_typed_pruned': read_typed_pruned,
+        'find_pulse_start_end': pulse_edges,
+        'calculate_current_difference': lambda: calculate_current_difference(df_top_edge),
+        'calculate_falling_time': lambda: calculate_falling_time(df_falling_edge),
+        'curve_fit_power_law': fit(power_law_fit, (0.1, -1e-7, 5e-8)),
+        'curve_fit_exponential': fit(exponential_fit, (1e2, 1e2, 5e-8)),
+        'figure_build': figure_build,
+        'figure_serialise': lambda: figure_build().to_json(),
+    }
+    return stages
+
+
+def iv_stages(folder, n_points, seed=0):
+    """Benchmark callables for the I-V page stages on one synthetic sweep of n_points."""
+    rng = np.random.default_rng([seed, 1, n_points])
+    df = synthetic_iv_sweep(n_points, rng=rng)
+    df["Temperature (C)"] = np.nan
+    metadata = synthetic_metadata("I-V", 0)
+    df["Device ID"] = metadata["Device ID"]
+    df["Contact ID"] = metadata["Contact ID"]
+    file_path = os.path.join(folder, f"I-V_bench_{n_points}.csv")
+    write_pymeasure_csv(df, file_path, metadata, IV_COLUMNS)
+    df = pd.read_csv(file_path, comment="#")
+    df_positive = df[df["Voltage (V)"] > 0]
+
+    def read_csv_metadata():
+        pd.read_csv(file_path, comment="#")
+        extract_metadata(file_path)
+
+    def read_typed_pruned():
+        with open(file_path, "rb") as file:
+            parse_measurement(file.read())
+
+    stages = {
+        'iv_read_csv_metadata': read_csv_metadata,
+        'iv_read_typed_pruned': read_typed_pruned,
+        'calculate_first_derivative': lambda: calculate_first_derivative(df_positive.copy()),
+    }
+    return stages
+
+
+def run_benchmarks(sizes=(10_000, 100_000, 1_000_000), repeat=5, seed=0, stages=None):
+    """Benchmark every stage at every size. Returns a list of result dicts."""
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            size_stages = {**it_stages(folder, size, seed), **iv_stages(folder, size, seed)}
+            for name, func in size_stages.items():
+                if stages and name not in stages:
+                    continue
+                results.append({'stage': name, 'size': size, **benchmark_stage(func, repeat)})
+                print(f"{name:32s} {size:>10d}  {results[-1]['median_s'] * 1e3:10.2f} ms  "
+                      f"{results[-1]['peak_memory_bytes'] / 1e6:8.1f} MB")
+    return results
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+harness = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=300).run()
+first_run = time.perf_counter()
+app.run()
+rerun = time.perf_counter()
+print(json.dumps({'harness_s': harness - start, 'first_run_s': first_run - harness, 'rerun_s': rerun - first_run,
+                  'n_exceptions': len(app.exception)}))
+"""
+
+
+def startup_benchmark(pages=PAGES, repeat=3):
+    """Time to the first complete run of every page in a fresh interpreter, with the sample data.
+
+    The first run includes all imports of the page, the rerun shows the cost once they are
+    loaded. The streamlit test harness import is timed separately and not included.
+    """
+    results = []
+    for page in pages:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, page], capture_output=True,
+                                    text=True, cwd=REPO, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        first_runs = [run['first_run_s'] for run in runs]
+        results.append({
+            'stage': f"startup {page}",
+            'size': 0,
+            'repeat': repeat,
+            'min_s': min(first_runs),
+            'median_s': float(np.median(first_runs)),
+            'mean_s': float(np.mean(first_runs)),
+            'rerun_median_s': float(np.median([run['rerun_s'] for run in runs])),
+            'peak_memory_bytes': 0,
+            'n_exceptions': runs[-1]['n_exceptions'],
+        })
+        print(f"{page:32s} first run {results[-1]['median_s'] * 1e3:8.0f} ms  "
+              f"rerun {results[-1]['rerun_median_s'] * 1e3:8.0f} ms")
+    return results
+
+
+def import_profile(module, top=15):
+    """Slowest imports of module in a fresh interpreter, from python -X importtime.
+    Returns (package, self_s, cumulative_s) tuples, slowest cumulative time first.
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                            text=True, cwd=REPO, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, package = line[len("import time:"):].split("|")
+        imports.append((package.rstrip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return sorted(imports, key=lambda row: row[2], reverse=True)[:top]
+
+
+def environment_info() -> dict:
+    """Git commit, versions and machine of the run, so results can be compared over time."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        'timestamp': datetime.now().isoformat(timespec="seconds"),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'plotly': plotly.__version__,
+        'machine': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare_results(results, baseline_results):
+    """Print the median time and peak memory ratio of every stage against a baseline run."""
+    baseline = {(row['stage'], row['size']): row for row in baseline_results}
+    for row in results:
+        previous = baseline.get((row['stage'], row['size']))
+        if previous is None:
+            continue
+        memory = (f"memory x{row['peak_memory_bytes'] / previous['peak_memory_bytes']:6.2f}"
+                  if previous['peak_memory_bytes'] else "")  # not measured for --startup
+        print(f"{row['stage']:32s} {row['size']:>10d}  time x{row['median_s'] / previous['median_s']:6.2f}  {memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="rows per I-t trace and I-V sweep")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=None, help="only run these stages")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    parser.add_argument("--startup", action="store_true", help="time the first run of the dashboard pages instead")
+    parser.add_argument("--pages", nargs="+", default=PAGES, help="pages for --startup")
+    parser.add_argument("--import-profile", default=None, metavar="MODULE",
+                        help="print the slowest imports of MODULE and exit")
+    args = parser.parse_args()
+
+    if args.import_profile:
+        for package, self_s, cumulative_s in import_profile(args.import_profile):
+            print(f"{package:48s} self {self_s * 1e3:8.1f} ms  cumulative {cumulative_s * 1e3:8.1f} ms")
+        return
+    if args.startup:
+        results = startup_benchmark(args.pages, args.repeat)
+    else:
+        results = run_benchmarks(args.sizes, args.repeat, args.seed, args.stages)
+    with open(args.output, "w") as file:
+        json.dump({'environment': environment_info(), 'results': results}, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare_results(results, json.load(file)['results'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import warnings
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def hampel_filter(current, half_window=3, n_sigmas=3.0, min_mad=0.0, min_mad_fraction=1e-3):
+    """Replace samples that deviate from their rolling median by more than n_sigmas robust
+    standard deviations (1.4826 * rolling MAD). Returns (filtered, replaced mask).
+
+    Where the window is flat, e.g. quantised readings repeating one value, the MAD is 0 and
+    any change would be replaced. The MAD is therefore at least min_mad (A) and at least
+    min_mad_fraction of the rolling median's absolute value.
+    """
+    current = np.asarray(current, dtype=float)
+    windows = sliding_window_view(np.pad(current, half_window, mode="edge"), 2 * half_window + 1)
+    median = np.median(windows, axis=1)
+    mad = 1.4826 * np.median(np.abs(windows - median[:, np.newaxis]), axis=1)
+    mad = np.maximum(mad, np.maximum(min_mad, min_mad_fraction * np.abs(median)))
+    replaced = np.abs(current - median) > n_sigmas * mad
+    return np.where(replaced, median, current), replaced
+
+
+def filter_halo(hampel_half_window=3, savgol_window=0):
+    """Number of neighbouring samples on each side that one filtered sample depends on."""
+    return hampel_half_window + savgol_window // 2
+
+
+def filter_block(current, hampel_half_window=3, n_sigmas=3.0, savgol_window=0, savgol_polyorder=2):
+    """Hampel filter followed by optional Savitzky-Golay smoothing (savgol_window > 0)."""
+    filtered, replaced = hampel_filter(current, hampel_half_window, n_sigmas)
+    if savgol_window > savgol_polyorder and len(filtered) >= savgol_window:
+        from scipy.signal import savgol_filter  # scipy.signal takes about a second to import
+        filtered = savgol_filter(filtered, savgol_window, savgol_polyorder)
+    return filtered, replaced
+
+
+def filter_current(current, hampel_half_window=3, n_sigmas=3.0, savgol_window=0, savgol_polyorder=2,
+                   block_size=1_000_000):
+    """Spike filter a whole trace in fixed-size blocks, so the temporary rolling-window
+    arrays stay bounded for long traces. Blocks overlap by the filter halo and the overlap is
+    trimmed, so the result equals filtering the trace in one go.
+    Returns (filtered current, mask of samples replaced by the Hampel filter).
+    """
+    current = np.asarray(current, dtype=float)
+    halo = filter_halo(hampel_half_window, savgol_window)
+    filtered = np.empty_like(current)
+    replaced = np.zeros(len(current), dtype=bool)
+    for start in range(0, len(current), block_size):
+        stop = min(start + block_size, len(current))
+        lo = max(start - halo, 0)
+        hi = min(stop + halo, len(current))
+        block, block_replaced = filter_block(current[lo:hi], hampel_half_window, n_sigmas,
+                                             savgol_window, savgol_polyorder)
+        filtered[start:stop] = block[start - lo:stop - lo]
+        replaced[start:stop] = block_replaced[start - lo:stop - lo]
+    return filtered, replaced
+
+
+def filter_chunks(chunks, hampel_half_window=3, n_sigmas=3.0, savgol_window=0, savgol_polyorder=2):
+    """Spike filter a stream of I-t DataFrame chunks, e.g. from pd.read_csv(..., chunksize=n).
+
+    Each chunk is filtered together with the last samples of the previous one, and the final
+    `halo` samples are held back until the next chunk supplies their right-hand neighbours,
+    so the output matches filter_current on the whole trace. Yields filtered chunks with a
+    `Replaced` column marking the samples the Hampel filter replaced.
+    """
+    halo = filter_halo(hampel_half_window, savgol_window)
+    history = None  # already emitted raw samples kept as left context
+    pending = None  # raw samples not emitted yet
+    for chunk in chunks:
+        data = pd.concat([frame for frame in (history, pending, chunk) if frame is not None], ignore_index=True)
+        n_history = 0 if history is None else len(history)
+        n_final = len(data) - halo
+        if n_final <= n_history:
+            pending = data.iloc[n_history:]
+            continue
+        yield _filtered_rows(data, n_history, n_final, hampel_half_window, n_sigmas, savgol_window, savgol_polyorder)
+        history = data.iloc[max(n_final - halo, 0):n_final]
+        pending = data.iloc[n_final:]
+
+    if pending is not None and len(pending):
+        data = pd.concat([frame for frame in (history, pending) if frame is not None], ignore_index=True)
+        n_history = 0 if history is None else len(history)
+        yield _filtered_rows(data, n_history, len(data), hampel_half_window, n_sigmas, savgol_window, savgol_polyorder)
+
+
+def _filtered_rows(data, first, last, hampel_half_window, n_sigmas, savgol_window, savgol_polyorder):
+    """Filter the raw samples in data and return rows first:last with the filtered current."""
+    filtered, replaced = filter_block(data["Current (A)"].to_numpy(dtype=float), hampel_half_window,
+                                      n_sigmas, savgol_window, savgol_polyorder)
+    rows = data.iloc[first:last].copy()
+    rows["Current (A)"] = filtered[first:last]
+    rows["Replaced"] = replaced[first:last]
+    return rows
+
+
+def fit_baselines(times, currents, dark_masks, degree=1, n_iterations=5, tuning=4.685):
+    """Robust polynomial baseline of every trace from its dark samples, in one batch.
+
+    times, currents and dark_masks are lists with one array per trace; dark_masks select the
+    samples (before the pulse and after the afterglow) that define the baseline. Traces are
+    padded into 2D arrays and all weighted least-squares problems are solved together with
+    batched normal equations. Outliers are down-weighted by a few iterations of Tukey's
+    bisquare reweighting. Time is centred and scaled per trace to keep the fit well
+    conditioned. Returns a list with the baseline evaluated at every sample of each trace;
+    traces with too few dark samples get a NaN baseline.
+    """
+    n_traces = len(times)
+    if n_traces == 0:
+        return []
+    length = max(len(time) for time in times)
+    t = np.zeros((n_traces, length))
+    y = np.zeros((n_traces, length))
+    mask = np.zeros((n_traces, length), dtype=bool)
+    for i, (time, current, dark) in enumerate(zip(times, currents, dark_masks)):
+        t[i, :len(time)] = time
+        y[i, :len(time)] = current
+        mask[i, :len(time)] = dark
+    mask &= np.isfinite(y)
+    y = np.where(mask, y, 0.0)
+
+    # Centre and scale time on the dark samples of each trace
+    n_dark = mask.sum(axis=1)
+    t_centre = (t * mask).sum(axis=1) / np.maximum(n_dark, 1)
+    t_scale = np.where(mask, np.abs(t - t_centre[:, np.newaxis]), 0.0).max(axis=1)
+    t_scale = np.where(t_scale > 0, t_scale, 1.0)
+    design = ((t - t_centre[:, np.newaxis]) / t_scale[:, np.newaxis])[..., np.newaxis] ** np.arange(degree + 1)
+
+    weights = mask.astype(float)
+    ridge = 1e-12 * np.eye(degree + 1)
+    for _ in range(n_iterations):
+        weighted_design = design * weights[..., np.newaxis]
+        normal_matrix = np.einsum("nlp,nlq->npq", weighted_design, design) + ridge
+        normal_rhs = np.einsum("nlp,nl->np", weighted_design, y)
+        coefficients = np.linalg.solve(normal_matrix, normal_rhs[..., np.newaxis])[..., 0]
+        residuals = y - np.einsum("nlp,np->nl", design, coefficients)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # traces without dark samples
+            scale = 1.4826 * np.nanmedian(np.where(mask, np.abs(residuals), np.nan), axis=1)
+        scale = np.where(np.isfinite(scale), scale, 0.0)
+        scale = np.where(scale > 0, scale, np.inf)
+        u = residuals / (tuning * scale[:, np.newaxis])
+        weights = np.where(mask & (np.abs(u) < 1), (1 - u ** 2) ** 2, 0.0)
+
+    baseline = np.einsum("nlp,np->nl", design, coefficients)
+    baseline[n_dark < degree + 1] = np.nan
+    return [baseline[i, :len(time)] for i, time in enumerate(times)]
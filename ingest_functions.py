@@ -0,0 +1,353 @@
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+ARCHIVE_SUFFIXES = (".zip", ".tar.gz", ".tgz", ".csv.gz")
+# Paths typed into the pages must be inside this folder, so browser users can only make the
+# server read the measurement data it is meant to serve
+DATA_ROOT = os.environ.get("DATA_ROOT", os.path.dirname(os.path.abspath(__file__)))
+# Columns the pages analyse, and string columns that only repeat a header parameter
+MEASUREMENT_COLUMNS = ("Time (s)", "Current (A)", "Voltage (V)", "Current Std (A)")
+CONSTANT_COLUMNS = ("Device ID", "Contact ID")
+
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE, CSV_OPTIONS = "pyarrow", {}
+except ImportError:
+    # pyarrow parses floats exactly, round_trip makes the C parser give the same numbers
+    CSV_ENGINE, CSV_OPTIONS = "c", {"float_precision": "round_trip"}
+
+
+def content_digest(payload: bytes) -> str:
+    """Fingerprint of a file's bytes. Identical files get the same digest whatever their name."""
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _path_digest(path, mtime_ns, size):
+    with open(path, "rb") as file:
+        return content_digest(file.read())
+
+
+def file_digest(data_file) -> str:
+    """Content digest of a sample file path, an uploaded file or an archive member. Paths are
+    only re-hashed when their modification time or size changes."""
+    if isinstance(data_file, (str, os.PathLike)):
+        stat = os.stat(data_file)
+        return _path_digest(os.fspath(data_file), stat.st_mtime_ns, stat.st_size)
+    if getattr(data_file, "digest", None):
+        return data_file.digest
+    return content_digest(data_file.getvalue())
+
+
+def find_duplicates(data_files, digests) -> dict:
+    """Map every file that repeats an earlier file's content to that earlier file."""
+    first_seen = {}
+    duplicates = {}
+    for data_file, digest in zip(data_files, digests):
+        if digest in first_seen:
+            duplicates[data_file] = first_seen[digest]
+        else:
+            first_seen[digest] = data_file
+    return duplicates
+
+
+def parse_header(lines) -> dict:
+    """Metadata from the `#Key: value` header lines of a PyMeasure CSV file."""
+    metadata = {}
+    for line in lines:
+        if line.startswith("#"):
+            key, _, value = line.strip("#").partition(":")
+            metadata[key.strip()] = value.strip()
+    return metadata
+
+
+def read_metadata(data_file) -> dict:
+    """Header metadata of a sample file path, an uploaded file or an archive member."""
+    if isinstance(data_file, ArchiveMember):
+        return dict(data_file.metadata)
+    if isinstance(data_file, (str, os.PathLike)):
+        with open(data_file, "rb") as file:
+            header = _read_header(file)
+    else:
+        header = _read_header(io.BytesIO(data_file.getvalue()))
+    return parse_header(header.decode(errors="replace").splitlines())
+
+
+def csv_source(data_file):
+    """Path or in-memory file object of data_file for pd.read_csv, e.g. to read it in chunks."""
+    if isinstance(data_file, (str, os.PathLike)):
+        return data_file
+    return io.BytesIO(data_file.getvalue())
+
+
+def parse_measurement(payload: bytes):
+    """DataFrame and header metadata of a PyMeasure CSV file held in memory.
+
+    Only the MEASUREMENT_COLUMNS are parsed, as float64 and with the multithreaded pyarrow
+    CSV reader when it is installed. The CONSTANT_COLUMNS repeat a header parameter on every
+    row, so they are filled from the header as categoricals instead of parsed.
+    """
+    stream = io.BytesIO(payload)
+    header = _read_header(stream)
+    metadata = parse_header(header.decode(errors="replace").splitlines())
+    stream.seek(len(header))
+    columns = stream.readline().decode(errors="replace").strip().split(",")
+    stream.seek(len(header))
+    constant_columns = [column for column in CONSTANT_COLUMNS if column in columns and column in metadata]
+    usecols = [column for column in columns if column in MEASUREMENT_COLUMNS or
+               (column not in constant_columns and column in CONSTANT_COLUMNS)]
+    df = pd.read_csv(stream, usecols=usecols,
+                     dtype={column: "float64" for column in usecols if column in MEASUREMENT_COLUMNS},
+                     engine=CSV_ENGINE, **CSV_OPTIONS)
+    for column in constant_columns:
+        df[column] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[metadata[column]])
+    return df[[column for column in columns if column in df]], metadata
+
+
+class MeasurementCache:
+    """Parsed measurements by content digest, least recently used dropped first once the
+    DataFrames together take more than max_bytes.
+    """
+
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # filled from the prefetch thread pool
+
+    def get(self, digest):
+        with self.lock:
+            if digest not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(digest)
+            return self.entries[digest][:2]
+
+    def put(self, digest, df, metadata):
+        size = int(df.memory_usage(deep=True).sum())
+        with self.lock:
+            if digest in self.entries:
+                return
+            self.entries[digest] = (df, metadata, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, dropped_size) = self.entries.popitem(last=False)
+                self.n_bytes -= dropped_size
+
+
+measurement_cache = MeasurementCache()
+
+
+def _payload(data_file) -> bytes:
+    if isinstance(data_file, (str, os.PathLike)):
+        with open(data_file, "rb") as file:
+            return file.read()
+    return data_file.getvalue()
+
+
+def read_measurement(data_file, digest=None):
+    """DataFrame and metadata of a sample file path or uploaded file.
+
+    Files are parsed once per content: reruns, re-uploads and copies under another name come
+    from measurement_cache. The DataFrame is a copy, so callers may add columns to it.
+    """
+    digest = digest or file_digest(data_file)
+    cached = measurement_cache.get(digest)
+    if cached is None:
+        cached = parse_measurement(_payload(data_file))
+        measurement_cache.put(digest, *cached)
+    df, metadata = cached
+    return df.copy(), dict(metadata)
+
+
+def parse_into_cache(data_file, payload=None):
+    """Parse data_file (or its already read bytes) into measurement_cache unless it is there."""
+    payload = _payload(data_file) if payload is None else payload
+    digest = file_digest(data_file) if isinstance(data_file, (str, os.PathLike)) else content_digest(payload)
+    if isinstance(data_file, ArchiveMember):
+        data_file.digest = digest
+    if digest not in measurement_cache.entries:
+        measurement_cache.put(digest, *parse_measurement(payload))
+
+
+def is_cached(data_file) -> bool:
+    """Whether data_file is parsed already. Archive members are not hashed until first read."""
+    if isinstance(data_file, ArchiveMember) and data_file.digest is None:
+        return False
+    return file_digest(data_file) in measurement_cache.entries
+
+
+def source_locator(data_file) -> str:
+    """Where data_file can be read again later: its absolute path, `archive path::member` for
+    a member of an archive on disk, or "" for uploads."""
+    if isinstance(data_file, (str, os.PathLike)):
+        return os.path.abspath(data_file)
+    if isinstance(data_file, ArchiveMember) and isinstance(data_file.source, (str, os.PathLike)):
+        return f"{os.path.abspath(data_file.source)}::{data_file.member}"
+    return ""
+
+
+def resolve_source(locator):
+    """The file a source_locator points to, as a path or ArchiveMember, or None if it is
+    an upload or no longer exists. Only the archive's headers are read, not its members."""
+    archive, _, member = locator.partition("::")
+    if not archive or not os.path.exists(archive):
+        return None
+    if not member:
+        return archive
+    return next((candidate for candidate in list_archive(archive) if candidate.member == member), None)
+
+
+def data_root_path(path, root=DATA_ROOT) -> str:
+    """Real path of a user-entered path, relative ones taken from root. Raises ValueError
+    if it is outside root, also through symbolic links."""
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"{path} is outside the data folder {root}")
+    return resolved
+
+
+def is_archive(name) -> bool:
+    return os.fspath(name).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class ArchiveMember:
+    """One CSV file inside a .zip, .tar.gz or .csv.gz archive.
+
+    Has the `name` and `getvalue()` of an uploaded file, so it goes through the same
+    analysis code. Only the header is read when the archive is listed; getvalue()
+    decompresses the member into memory, nothing is extracted to disk.
+    """
+
+    def __init__(self, archive_name, member, source, header):
+        self.archive_name = archive_name
+        self.member = member
+        self.name = os.path.basename(member)
+        self.source = source  # archive path or bytes
+        self.metadata = parse_header(header.decode(errors="replace").splitlines())
+        self.digest = None
+
+    def _archive_file(self):
+        return open(self.source, "rb") if isinstance(self.source, (str, os.PathLike)) else io.BytesIO(self.source)
+
+    def getvalue(self) -> bytes:
+        with self._archive_file() as file:
+            if self.archive_name.lower().endswith(".zip"):
+                with zipfile.ZipFile(file) as archive:
+                    payload = archive.read(self.member)
+            elif self.archive_name.lower().endswith(".csv.gz"):
+                payload = gzip.GzipFile(fileobj=file).read()
+            else:
+                with tarfile.open(fileobj=file, mode="r:gz") as archive:
+                    payload = archive.extractfile(self.member).read()
+        self.digest = self.digest or content_digest(payload)
+        return payload
+
+    def __repr__(self):
+        return f"{self.archive_name}/{self.member}"
+
+
+def _read_header(stream) -> bytes:
+    """The leading `#` lines of a binary stream, without reading the rest of it."""
+    lines = []
+    for line in stream:
+        if not line.startswith(b"#"):
+            break
+        lines.append(line)
+    return b"".join(lines)
+
+
+def _list_archive(archive_name, source):
+    members = []
+    with (open(source, "rb") if isinstance(source, (str, os.PathLike)) else io.BytesIO(source)) as file:
+        if archive_name.lower().endswith(".zip"):
+            with zipfile.ZipFile(file) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(".csv"):
+                        with archive.open(info) as member:
+                            members.append(ArchiveMember(archive_name, info.filename, source, _read_header(member)))
+        elif archive_name.lower().endswith(".csv.gz"):
+            with gzip.GzipFile(fileobj=file) as member:
+                members.append(ArchiveMember(archive_name, os.path.basename(archive_name)[:-3], source,
+                                             _read_header(member)))
+        else:
+            # tar.gz can only be read front to back, so each member's header is read in passing
+            with tarfile.open(fileobj=file, mode="r|gz") as archive:
+                for info in archive:
+                    if info.isfile() and info.name.lower().endswith(".csv"):
+                        members.append(ArchiveMember(archive_name, info.name, source,
+                                                     _read_header(archive.extractfile(info))))
+    return members
+
+
+_archive_listings = OrderedDict()
+
+
+def list_archive(archive):
+    """CSV members of an archive path or uploaded archive, with their header metadata.
+
+    Listings are kept for the 16 most recent archives, keyed by path and modification time
+    or by upload content, so reruns do not open the archive again.
+    """
+    if isinstance(archive, (str, os.PathLike)):
+        stat = os.stat(archive)
+        key = (os.fspath(archive), stat.st_mtime_ns, stat.st_size)
+        archive_name, source = os.path.basename(archive), os.fspath(archive)
+    else:
+        source = archive.getvalue()
+        key = content_digest(source)
+        archive_name = archive.name
+    if key not in _archive_listings:
+        _archive_listings[key] = _list_archive(archive_name, source)
+        while len(_archive_listings) > 16:
+            _archive_listings.popitem(last=False)
+    _archive_listings.move_to_end(key)
+    return _archive_listings[key]
+
+
+def _tar_payloads(members):
+    """(member, payload) of tar.gz members in a single pass over each archive."""
+    by_archive = OrderedDict()
+    for member in members:
+        by_archive.setdefault((member.archive_name, id(member.source)), []).append(member)
+    for archive_members in by_archive.values():
+        wanted = {member.member: member for member in archive_members}
+        with archive_members[0]._archive_file() as file, tarfile.open(fileobj=file, mode="r|gz") as archive:
+            for info in archive:
+                if info.name in wanted:
+                    yield wanted.pop(info.name), archive.extractfile(info).read()
+                    if not wanted:
+                        break
+
+
+def prefetch_measurements(data_files, max_workers=None):
+    """Parse every file that is not in measurement_cache yet on a thread pool.
+
+    Archive members are decompressed in memory while earlier ones are being parsed; the
+    pandas C parser releases the GIL, so the parsing runs in parallel. read_measurement
+    then finds every file in the cache.
+    """
+    pending = [data_file for data_file in data_files if not is_cached(data_file)]
+    if len(pending) < 2:
+        return
+    tar_members = [data_file for data_file in pending if isinstance(data_file, ArchiveMember)
+                   and data_file.archive_name.lower().endswith((".tar.gz", ".tgz"))]
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        futures = [pool.submit(parse_into_cache, data_file) for data_file in pending if data_file not in tar_members]
+        futures += [pool.submit(parse_into_cache, member, payload) for member, payload in _tar_payloads(tar_members)]
+        for future in futures:
+            future.result()
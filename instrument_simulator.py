@@ -0,0 +1,228 @@
+"""Simulated measurement stations that write PyMeasure-format I-t and I-V files.
+
+Every station appends rows in real time at its own sample rate, so live ingest and the
+dashboard can be load tested without the prober. Run for example
+
+    python instrument_simulator.py --folder LIVE --it-stations 4 --sample-rate 800 --duration 60 --measure-lag
+
+With --measure-lag every file is also followed with the dashboard's TailReader at the
+refresh interval, and the report shows how far the reader falls behind the writers.
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+import numpy as np
+from live_functions import TailReader
+
+IT_COLUMNS = ["Device ID", "Contact ID", "Voltage (V)", "Current (A)", "Time (s)"]
+IV_COLUMNS = ["Device ID", "Contact ID", "Temperature (C)", "Voltage (V)", "Current (A)", "Current Std (A)"]
+
+
+def pymeasure_header(parameters: dict, columns, procedure="IVProcedure") -> str:
+    """#Procedure/#Parameters/#Data header followed by the column line, as PyMeasure writes it."""
+    lines = [f"#Procedure: <__main__.{procedure}>", "#Parameters:"]
+    lines += [f"#\t{key}: {value}" for key, value in parameters.items()]
+    lines += ["#Data:", ",".join(columns)]
+    return "\n".join(lines) + "\n"
+
+
+def pulse_train_current(time, pulse_delay=5.0, pulse_width=1.0, period=10.0, dark_current=2e-9,
+                        photocurrent=5e-6, leakage=5e-8, rise_time=1e-3, fall_time=2e-3,
+                        drift=1e-12, noise=1e-9, rng=None):
+    """I-t response to a periodic LED pulse: exponential rise and afterglow, a slow photocurrent
+    increase during the pulse (leakage), linear dark current drift and Gaussian noise.
+    """
+    rng = rng or np.random.default_rng()
+    time = np.asarray(time, dtype=float)
+    phase = np.mod(time - pulse_delay, period)
+    started = time >= pulse_delay
+    on = started & (phase < pulse_width)
+    rise = photocurrent * (1 - np.exp(-phase / rise_time)) + leakage * phase / pulse_width
+    end_current = photocurrent * (1 - np.exp(-pulse_width / rise_time)) + leakage
+    fall = end_current * np.exp(-(phase - pulse_width) / fall_time)
+    light = np.where(on, rise, np.where(started, fall, 0.0))
+    return dark_current + drift * time + light + noise * rng.standard_normal(len(time))
+
+
+def sweep_voltages(voltage_max=1000.0, voltage_min=0.1, n_points=50):
+    """Negative-to-positive voltage sweep with log-spaced magnitudes on both polarities."""
+    magnitudes = np.logspace(np.log10(voltage_max), np.log10(voltage_min), n_points // 2)
+    return np.concatenate([-magnitudes, magnitudes[::-1]])
+
+
+def iv_current(voltage, ohmic_current=1e-9, sclc_voltage=30.0, exponent=2.0, compliance=1e-4,
+               noise=0.01, rng=None):
+    """Ohmic at low bias, power law above sclc_voltage, clipped at the compliance current."""
+    rng = rng or np.random.default_rng()
+    magnitude = np.abs(voltage)
+    current = ohmic_current * magnitude * np.maximum(1.0, magnitude / sclc_voltage) ** (exponent - 1)
+    current = np.minimum(current, compliance) * (1 + noise * rng.standard_normal(len(voltage)))
+    return np.sign(voltage) * current, np.abs(current) * noise
+
+
+class Station:
+    """One simulated station writing one acquisition file at a time."""
+
+    def __init__(self, name, folder, measurement_type="I-t", sample_rate=800.0, n_points=10000,
+                 pulse_settings=None, seed=None):
+        self.name = name
+        self.folder = folder
+        self.measurement_type = measurement_type
+        self.sample_rate = sample_rate
+        self.n_points = n_points
+        self.pulse_settings = pulse_settings or {}
+        self.rng = np.random.default_rng(seed)
+        self.n_files = 0
+        self.rows_written = 0
+        self.new_file()
+
+    def new_file(self):
+        """Start the next acquisition file and write its header."""
+        self.n_files += 1
+        self.start_time = time.time()
+        self.file_rows = 0
+        device_id = f"SIM{self.name}"
+        contact_id = "guarded_centerpixel_sim"
+        date = datetime.now().strftime("%Y-%m-%d")
+        parameters = {
+            "Contact ID": contact_id,
+            "Data Points": self.n_points,
+            "Device ID": device_id,
+            "Surface Treatment": "Simulated",
+            "Guard Ring": True,
+            "Probe Location": "center_pixel",
+            "Start Time (Unix s)": f"{self.start_time:.3f}",
+        }
+        if self.measurement_type == "I-t":
+            parameters["Sampling Rate (Hz)"] = self.sample_rate
+            parameters["Voltage (V)"] = 1000
+            columns = IT_COLUMNS
+        else:
+            self.voltages = sweep_voltages(n_points=self.n_points)
+            columns = IV_COLUMNS
+        self.file_path = os.path.join(
+            self.folder, f"{self.measurement_type}_{device_id}_{contact_id}_{date}_{self.n_files}.csv"
+        )
+        self.row_prefix = f"{device_id},{contact_id}"
+        with open(self.file_path, "w") as file:
+            file.write(pymeasure_header(parameters, columns))
+
+    def write_due_rows(self, now):
+        """Append every row the station should have produced by wall-clock time `now`.
+        Returns the number of rows written.
+        """
+        n_due = min(int((now - self.start_time) * self.sample_rate), self.n_points) - self.file_rows
+        if n_due <= 0:
+            return 0
+        index = self.file_rows + np.arange(n_due)
+        if self.measurement_type == "I-t":
+            sample_time = index / self.sample_rate
+            current = pulse_train_current(sample_time, rng=self.rng, **self.pulse_settings)
+            rows = [f"{self.row_prefix},1000.0,{i:.6e},{t}" for i, t in zip(current, sample_time)]
+        else:
+            voltage = self.voltages[index]
+            current, current_std = iv_current(voltage, rng=self.rng)
+            rows = [f"{self.row_prefix},nan,{v},{i:.6e},{s:.6e}" for v, i, s in zip(voltage, current, current_std)]
+        with open(self.file_path, "a") as file:
+            file.write("\n".join(rows) + "\n")
+        self.file_rows += n_due
+        self.rows_written += n_due
+        if self.file_rows >= self.n_points:
+            self.new_file()
+        return n_due
+
+
+def run_simulation(stations, duration=60.0, write_interval=0.1, measure_lag=False, refresh_interval=1.0):
+    """Run the stations for `duration` seconds, writing every `write_interval`.
+
+    With measure_lag, each station's current file is followed by a TailReader every
+    refresh_interval seconds, as the live page does. The lag is TailReader.lag(), the age of
+    the newest row the reader has parsed at the time it parsed it, from the row's own
+    "Time (s)" and the file's start time header. I-V files have no time column and report
+    no lag. read_rate is the number of rows the reader parses
+    per second of read time, an upper bound on the total rate it can keep up with.
+    Returns a report dict per station.
+    """
+    report = {station.name: {'rows_written': 0, 'files': 0, 'write_time': 0.0, 'lags': [], 'read_time': 0.0,
+                             'rows_read': 0} for station in stations}
+    readers = {}
+    start = time.time()
+    next_refresh = start + refresh_interval
+    while time.time() - start < duration:
+        now = time.time()
+        for station in stations:
+            t0 = time.perf_counter()
+            station.write_due_rows(now)
+            report[station.name]['write_time'] += time.perf_counter() - t0
+
+        if measure_lag and now >= next_refresh:
+            next_refresh += refresh_interval
+            for station in stations:
+                reader = readers.get(station.name)
+                t0 = time.perf_counter()
+                if reader is None or reader.file_path != station.file_path:
+                    if reader is not None:
+                        report[station.name]['rows_read'] += len(reader.read_new())  # finish the previous file
+                    reader = readers[station.name] = TailReader(station.file_path)
+                n_rows = len(reader.read_new())
+                report[station.name]['read_time'] += time.perf_counter() - t0
+                report[station.name]['rows_read'] += n_rows
+                # Same measurement as the live page: the newest parsed sample against the read time
+                lag = reader.lag()
+                if lag is not None:
+                    report[station.name]['lags'].append(lag)
+        time.sleep(max(write_interval - (time.time() - now), 0))
+
+    elapsed = time.time() - start
+    for station in stations:
+        station_report = report[station.name]
+        station_report['rows_written'] = station.rows_written
+        station_report['files'] = station.n_files
+        station_report['achieved_rate'] = station.rows_written / elapsed
+        station_report['target_rate'] = station.sample_rate
+        station_report['read_rate'] = station_report['rows_read'] / max(station_report['read_time'], 1e-9)
+        lags = station_report.pop('lags')
+        station_report['mean_lag_s'] = float(np.mean(lags)) if lags else np.nan
+        station_report['max_lag_s'] = float(np.max(lags)) if lags else np.nan
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="LIVE", help="folder the stations write into")
+    parser.add_argument("--it-stations", type=int, default=1, help="number of I-t stations")
+    parser.add_argument("--iv-stations", type=int, default=0, help="number of I-V stations")
+    parser.add_argument("--sample-rate", type=float, default=800.0, help="rows per second per I-t station")
+    parser.add_argument("--iv-rate", type=float, default=1.0, help="voltage points per second per I-V station")
+    parser.add_argument("--points", type=int, default=10000, help="rows per I-t file")
+    parser.add_argument("--pulse-delay", type=float, default=5.0, help="dark time before the first pulse (s)")
+    parser.add_argument("--pulse-width", type=float, default=1.0, help="LED on time (s)")
+    parser.add_argument("--period", type=float, default=10.0, help="time between pulse starts (s)")
+    parser.add_argument("--duration", type=float, default=60.0, help="simulation time (s)")
+    parser.add_argument("--measure-lag", action="store_true", help="follow the files and report the reader lag")
+    parser.add_argument("--refresh", type=float, default=1.0, help="reader refresh interval (s)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    os.makedirs(args.folder, exist_ok=True)
+    pulse_settings = dict(pulse_delay=args.pulse_delay, pulse_width=args.pulse_width, period=args.period)
+    seeds = np.random.SeedSequence(args.seed).spawn(args.it_stations + args.iv_stations)
+    stations = [Station(f"IT{i + 1}", args.folder, "I-t", args.sample_rate, args.points, pulse_settings, seeds[i])
+                for i in range(args.it_stations)]
+    stations += [Station(f"IV{i + 1}", args.folder, "I-V", args.iv_rate, 50, seed=seeds[args.it_stations + i])
+                 for i in range(args.iv_stations)]
+
+    report = run_simulation(stations, args.duration, measure_lag=args.measure_lag, refresh_interval=args.refresh)
+    for name, station_report in report.items():
+        print(f"{name}: {station_report['rows_written']} rows in {station_report['files']} file(s), "
+              f"{station_report['achieved_rate']:.0f}/{station_report['target_rate']:.0f} rows/s, "
+              f"write {station_report['write_time']:.2f} s", end="")
+        if args.measure_lag:
+            print(f", read {station_report['read_time']:.2f} s ({station_report['read_rate']:.0f} rows/s), "
+                  f"lag mean {station_report['mean_lag_s']:.2f} s max {station_report['max_lag_s']:.2f} s", end="")
+        print()
+
+
+if __name__ == "__main__":
+    main()
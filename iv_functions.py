@@ -0,0 +1,288 @@
+import numpy as np
+from resampling_functions import batched_interp
+
+
+def stack_iv_curves(dfs, polarity=1, value_columns=("Current (A)", "Current Std (A)"),
+                    std_columns=("Current Std (A)",)):
+    """Stack the I-V curves of one polarity onto a common |V| grid.
+    Set points are matched on log10|V| rounded to 6 decimals, so sweeps that share a
+    voltage grid line up even when the stored floats differ in the last digits.
+    A voltage measured more than once in a curve (e.g. up and down sweeps) gets the mean
+    of its readings; std_columns are combined as the standard error of that mean.
+    Points a curve does not have are NaN. Returns (voltage_grid, {column: 2D array}).
+    """
+    curve_keys = []
+    for df in dfs:
+        voltage = df["Voltage (V)"].to_numpy(dtype=float)
+        mask = np.sign(voltage) == polarity
+        curve_keys.append((mask, np.round(np.log10(np.abs(voltage[mask])), 6)))
+
+    if curve_keys:
+        grid_keys = np.unique(np.concatenate([keys for _, keys in curve_keys]))
+    else:
+        grid_keys = np.empty(0)
+    stacked = {column: np.full((len(dfs), len(grid_keys)), np.nan) for column in value_columns}
+    for i, (df, (mask, keys)) in enumerate(zip(dfs, curve_keys)):
+        positions = np.searchsorted(grid_keys, keys)
+        unique_positions, inverse, counts = np.unique(positions, return_inverse=True, return_counts=True)
+        for column in value_columns:
+            if column not in df:
+                continue
+            values = df[column].to_numpy(dtype=float)[mask]
+            if column in std_columns:
+                values = values ** 2
+            totals = np.zeros(len(unique_positions))
+            np.add.at(totals, inverse, values)
+            if column in std_columns:
+                stacked[column][i, unique_positions] = np.sqrt(totals) / counts
+            else:
+                stacked[column][i, unique_positions] = totals / counts
+    return 10 ** grid_keys, stacked
+
+
+def log_log_sigma(current, current_std):
+    """Standard error of log10|I| from the standard error of I."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.abs(current_std) / (np.abs(current) * np.log(10))
+
+
+def log_log_slope_with_uncertainty(voltage, current, current_std):
+    """Pointwise power law slope d log|I| / d log|V| along the last axis, with its standard error.
+    The slope uses np.gradient; the error propagates independent errors on each point
+    through the same stencil (second order in the interior, first order at the edges).
+    voltage is 1D; current and current_std can be 1D or stacked as (n_curves, n_points).
+    With fewer than 2 points there is no slope, and both outputs are NaN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.log10(np.abs(np.asarray(voltage, dtype=float)))
+        y = np.log10(np.abs(np.asarray(current, dtype=float)))
+        if x.shape[-1] < 2:
+            return np.full(y.shape, np.nan), np.full(y.shape, np.nan)
+        sigma_y = log_log_sigma(np.asarray(current, dtype=float), np.asarray(current_std, dtype=float))
+        slope = np.gradient(y, x, axis=-1)
+
+        variance = np.empty_like(slope)
+        h1 = x[1:-1] - x[:-2]
+        h2 = x[2:] - x[1:-1]
+        coef_prev = -h2 / (h1 * (h1 + h2))
+        coef_mid = (h2 - h1) / (h1 * h2)
+        coef_next = h1 / (h2 * (h1 + h2))
+        variance[..., 1:-1] = ((coef_prev * sigma_y[..., :-2]) ** 2
+                               + (coef_mid * sigma_y[..., 1:-1]) ** 2
+                               + (coef_next * sigma_y[..., 2:]) ** 2)
+        variance[..., 0] = (sigma_y[..., 0] ** 2 + sigma_y[..., 1] ** 2) / (x[1] - x[0]) ** 2
+        variance[..., -1] = (sigma_y[..., -1] ** 2 + sigma_y[..., -2] ** 2) / (x[-1] - x[-2]) ** 2
+    return slope, np.sqrt(variance)
+
+
+def parse_region_edges(text):
+    """Voltage region edges from comma separated text such as "1, 10, 100, 1000".
+    Empty fields are ignored. Raises ValueError unless there are at least two positive,
+    strictly increasing edges.
+    """
+    fields = [field.strip() for field in text.split(",") if field.strip()]
+    try:
+        region_edges = [float(field) for field in fields]
+    except ValueError:
+        raise ValueError(f"Region boundaries must be numbers separated by commas, got '{text}'")
+    if len(region_edges) < 2:
+        raise ValueError("Enter at least two region boundaries")
+    if not all(np.isfinite(edge) and edge > 0 for edge in region_edges):
+        raise ValueError("Region boundaries must be positive voltages")
+    if np.any(np.diff(region_edges) <= 0):
+        raise ValueError("Region boundaries must be strictly increasing")
+    return region_edges
+
+
+def weighted_fit_rows(fit_stats, labels, region_edges, polarity_label=None):
+    """Table rows of weighted_power_law_fit results, one per curve and region."""
+    rows = []
+    for idx, label in enumerate(labels):
+        for region, (low, high) in enumerate(zip(region_edges[:-1], region_edges[1:])):
+            row = {'Curve': label}
+            if polarity_label is not None:
+                row['Polarity'] = polarity_label
+            row.update({
+                'Region (|V|)': f"{low:g}-{high:g}",
+                'Exponent': round(fit_stats['slope'][idx, region], 4),
+                'Exponent Std': round(fit_stats['slope_err'][idx, region], 4),
+                'Reduced chi2': round(fit_stats['chi2_reduced'][idx, region], 2),
+                'Points': fit_stats['n_points'][idx, region],
+            })
+            rows.append(row)
+    return rows
+
+
+def weighted_power_law_fit(voltage_grid, current, current_std, region_edges):
+    """Weighted straight-line fit of log10|I| vs log10|V| in each voltage region, for every curve at once.
+
+    current and current_std are stacked as (n_curves, n_points) on voltage_grid. Each point is
+    weighted by 1/sigma^2 of log10|I|; points without a finite weight are skipped. Regions are
+    the intervals between consecutive region_edges, half-open [low, high) except the last,
+    which includes its upper edge, so a point on an edge is fitted only once. Returns a dict
+    of (n_curves, n_regions) arrays.
+    """
+    region_edges = np.asarray(region_edges, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_v = np.log10(np.abs(voltage_grid))
+        log_i = np.log10(np.abs(current))
+        weights = 1 / log_log_sigma(current, current_std) ** 2
+    valid = np.isfinite(log_i) & np.isfinite(weights) & (weights > 0)
+
+    # (n_regions, 1, n_points) masks broadcast against the (n_curves, n_points) data
+    below_upper = voltage_grid < region_edges[1:, np.newaxis]
+    below_upper[-1] |= voltage_grid == region_edges[-1]
+    in_region = ((voltage_grid >= region_edges[:-1, np.newaxis]) & below_upper)[:, np.newaxis, :]
+    mask = in_region & valid[np.newaxis, :, :]
+    w = np.where(mask, weights, 0.0)
+    x = np.where(mask, log_v, 0.0)
+    y = np.where(mask, log_i, 0.0)
+
+    s = w.sum(axis=-1)
+    sx = (w * x).sum(axis=-1)
+    sy = (w * y).sum(axis=-1)
+    sxx = (w * x * x).sum(axis=-1)
+    sxy = (w * x * y).sum(axis=-1)
+    n_points = mask.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = s * sxx - sx ** 2
+        slope = (s * sxy - sx * sy) / delta
+        intercept = (sxx * sy - sx * sxy) / delta
+        slope_err = np.sqrt(s / delta)
+        intercept_err = np.sqrt(sxx / delta)
+        chi2 = (w * (y - slope[..., np.newaxis] * x - intercept[..., np.newaxis]) ** 2).sum(axis=-1)
+        chi2_reduced = chi2 / (n_points - 2)
+
+    too_few = n_points < 2
+    fit_stats = {
+        'slope': np.where(too_few, np.nan, slope).T,
+        'slope_err': np.where(too_few, np.nan, slope_err).T,
+        'intercept': np.where(too_few, np.nan, intercept).T,
+        'intercept_err': np.where(too_few, np.nan, intercept_err).T,
+        'chi2_reduced': np.where(n_points < 3, np.nan, chi2_reduced).T,
+        'n_points': n_points.T,
+    }
+    return fit_stats
+
+
+# Power law exponent ranges used to name the conduction regime of a segment
+CONDUCTION_REGIMES = [
+    (0.5, "saturated"),
+    (1.5, "ohmic"),
+    (2.5, "SCLC"),
+    (10.0, "trap-limited"),
+    (np.inf, "breakdown"),
+]
+
+
+def classify_conduction_regime(slope):
+    """Name the conduction regime of a log-log segment from its power law exponent."""
+    for upper_slope, regime in CONDUCTION_REGIMES:
+        if slope < upper_slope:
+            return regime
+    return "undefined"
+
+
+def segment_power_law(voltage_grid, current, penalty=0.05, min_size=3):
+    """Optimal piecewise-linear segmentation of log10|I| vs log10|V| for every curve at once.
+
+    Minimises the total squared error of independent straight-line fits plus `penalty` per
+    segment (optimal partitioning by dynamic programming). Segment costs for every start/end
+    pair come from prefix sums in O(1) each, and the DP recursion is vectorised over curves
+    and start points, so only the loop over end points runs in Python.
+    current is stacked as (n_curves, n_points) on voltage_grid; NaN points are ignored.
+    Returns one list of segment dicts per curve.
+    """
+    current = np.atleast_2d(current)
+    n_curves, n_points = current.shape
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.log10(np.abs(voltage_grid))
+        y = np.log10(np.abs(current))
+    valid = np.isfinite(y) & np.isfinite(x)
+    w = valid.astype(float)
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+
+    def prefix(values):
+        return np.concatenate([np.zeros((n_curves, 1)), np.cumsum(values, axis=1)], axis=1)
+
+    def segment_sum(values):
+        # [curve, start, end] sum over the half-open range start:end
+        p = prefix(values)
+        return p[:, np.newaxis, :] - p[:, :, np.newaxis]
+
+    s = segment_sum(w)
+    sx = segment_sum(w * x)
+    sy = segment_sum(w * y)
+    sxx = segment_sum(w * x * x)
+    sxy = segment_sum(w * x * y)
+    syy = segment_sum(w * y * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_x = sxx - sx ** 2 / s
+        cov_xy = sxy - sx * sy / s
+        sse = syy - sy ** 2 / s - cov_xy ** 2 / var_x
+        slope = cov_xy / var_x
+        intercept = (sy - slope * sx) / s
+    cost = np.where((s >= min_size) & np.isfinite(sse), np.maximum(sse, 0.0), np.inf)
+
+    best = np.full((n_curves, n_points + 1), np.inf)
+    best[:, 0] = -penalty
+    last_start = np.zeros((n_curves, n_points + 1), dtype=int)
+    for end in range(1, n_points + 1):
+        candidates = best[:, :end] + cost[:, :end, end] + penalty
+        last_start[:, end] = np.argmin(candidates, axis=1)
+        best[:, end] = candidates[np.arange(n_curves), last_start[:, end]]
+
+    segments = []
+    for curve in range(n_curves):
+        curve_segments = []
+        end = n_points
+        while end > 0 and np.isfinite(best[curve, end]):
+            start = last_start[curve, end]
+            points = np.flatnonzero(valid[curve, start:end]) + start
+            curve_segments.append({
+                'start_voltage': voltage_grid[points[0]],
+                'end_voltage': voltage_grid[points[-1]],
+                'slope': slope[curve, start, end],
+                'intercept': intercept[curve, start, end],
+                'n_points': len(points),
+                'regime': classify_conduction_regime(slope[curve, start, end]),
+            })
+            end = start
+        segments.append(curve_segments[::-1])
+    return segments
+
+
+def log_voltage_grid(voltage_min=0.1, voltage_max=1000.0, n_points=200):
+    """Shared |V| grid with log spacing for resampling I-V curves."""
+    return np.logspace(np.log10(voltage_min), np.log10(voltage_max), n_points)
+
+
+def resample_iv_curves(dfs, voltage_grid, polarity=1):
+    """Interpolate |I| of every curve onto a shared |V| grid, linearly in log-log space.
+    All curves are interpolated in one batched call; grid points outside a curve's
+    measured range are NaN, except within 1e-9 in log10|V| of its ends, so a sweep whose
+    stored end voltage differs from the set point in the last digits still gives a value
+    there. Returns |I| stacked as (n_curves, n_grid).
+    """
+    log_v, log_i = [], []
+    for df in dfs:
+        voltage = df["Voltage (V)"].to_numpy(dtype=float)
+        current = df["Current (A)"].to_numpy(dtype=float)
+        mask = np.sign(voltage) == polarity
+        with np.errstate(divide="ignore"):
+            log_v.append(np.log10(np.abs(voltage[mask])))
+            log_i.append(np.log10(np.abs(current[mask])))
+    log_grid = np.log10(np.abs(np.atleast_1d(np.asarray(voltage_grid, dtype=float))))
+    return 10 ** batched_interp(log_v, log_i, log_grid, atol=1e-9)
+
+
+def iv_envelope(resampled, percentiles=(10, 50, 90)):
+    """Percentiles of resampled |I| across curves at every grid voltage, taken in log space."""
+    with np.errstate(divide="ignore"):
+        log_current = np.log10(resampled)
+    envelope = {}
+    for percentile in percentiles:
+        with np.errstate(invalid="ignore"):
+            envelope[percentile] = 10 ** np.nanpercentile(log_current, percentile, axis=0)
+    return envelope
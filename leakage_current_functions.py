@@ -1,5 +1,4 @@
 import numpy as np
-import streamlit as st
 
 def exponential_fit(t, a, b, c):
     return np.exp(-a * t + b) + c
@@ -31,6 +30,7 @@ def calculate_falling_time(df_falling_edge, percent_drop=0.98):
         # Find the first index where current drops below threshold
         threshold_indices = df_falling_edge[df_falling_edge["Current (A)"] <= (threshold_drop+end_current)].index
         if len(threshold_indices) == 0:
+            import streamlit as st
             st.warning("Could not find current below drop threshold.")
             afterglow_stats = {'threshold_drop': threshold_drop, 'time_index': 0, 'time_drop': 0}
             return afterglow_stats
@@ -43,5 +43,6 @@ def calculate_falling_time(df_falling_edge, percent_drop=0.98):
         
         return afterglow_stats
     except Exception as e:
+        import streamlit as st
         st.error(f"Error calculating falling time: {str(e)}")
         return None
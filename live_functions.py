@@ -0,0 +1,119 @@
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of the most recent rows of numeric columns.
+    Appending overwrites the oldest rows once the buffer is full, so memory stays
+    constant however long the acquisition runs.
+    """
+
+    def __init__(self, columns=("Time (s)", "Current (A)"), capacity=100_000):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.data = np.full((capacity, len(self.columns)), np.nan)
+        self.n_total = 0  # rows appended since the buffer was created
+
+    def __len__(self):
+        return min(self.n_total, self.capacity)
+
+    def append(self, df: pd.DataFrame):
+        """Append the buffer columns of df, keeping only the last `capacity` rows."""
+        values = df[self.columns].to_numpy(dtype=float)[-self.capacity:]
+        # Rows dropped from the front of a long df still advance the write position
+        positions = (self.n_total + len(df) - len(values) + np.arange(len(values))) % self.capacity
+        self.data[positions] = values
+        self.n_total += len(df)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Buffered rows in acquisition order, indexed from 0."""
+        if self.n_total <= self.capacity:
+            values = self.data[:self.n_total]
+        else:
+            values = np.roll(self.data, -(self.n_total % self.capacity), axis=0)
+        return pd.DataFrame(values, columns=self.columns)
+
+
+class TailReader:
+    """Incremental reader for a PyMeasure CSV that is still being written.
+
+    Each call to read_new() reads only the bytes appended since the previous call, starting
+    from the stored byte offset. The `#` header is parsed into metadata, the first line
+    after it gives the column names, and a trailing line without a newline is held back
+    until the writer finishes it.
+
+    A new run reusing the file name is detected when the file shrinks, is replaced by
+    another file (new inode) or no longer starts with the bytes read before. The reader
+    then starts over from byte zero and increments `generation`, so callers can drop
+    whatever they derived from the previous run.
+    """
+
+    HEAD_BYTES = 4096  # start of the file compared on every read to detect a rewrite
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.generation = 0
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.partial = b""
+        self.metadata = {}
+        self.columns = None
+        self.head = b""
+        self.file_id = None
+        self.read_time = None  # time.time() of the last read that returned rows
+        self.last_time = None  # newest "Time (s)" parsed
+
+    def restart(self):
+        self.reset()
+        self.generation += 1
+
+    def read_new(self) -> pd.DataFrame:
+        """Rows completed since the last call (an empty DataFrame if there are none)."""
+        with open(self.file_path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            file_id = (stat.st_dev, stat.st_ino)
+            if self.offset and (stat.st_size < self.offset or file_id != self.file_id
+                                or file.read(len(self.head)) != self.head):
+                self.restart()
+            self.file_id = file_id
+            file.seek(self.offset)
+            new_bytes = file.read()
+        if self.offset < self.HEAD_BYTES:
+            self.head = (self.head + new_bytes)[:self.HEAD_BYTES]
+        self.offset += len(new_bytes)
+
+        lines = (self.partial + new_bytes).split(b"\n")
+        self.partial = lines.pop()  # empty if the chunk ended with a newline
+        data_lines = []
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if self.columns is None:
+                text = line.decode("utf-8", errors="replace")
+                if text.startswith("#"):
+                    key, _, value = text.strip("#").partition(":")
+                    if value:
+                        self.metadata[key.strip()] = value.strip()
+                elif text:
+                    self.columns = text.split(",")
+            elif line and not line.startswith(b"#"):
+                data_lines.append(line)
+
+        if not data_lines:
+            return pd.DataFrame(columns=self.columns or [])
+        df = pd.read_csv(io.BytesIO(b"\n".join(data_lines)), names=self.columns, header=None)
+        self.read_time = time.time()
+        if "Time (s)" in df and len(df):
+            self.last_time = float(df["Time (s)"].iloc[-1])
+        return df
+
+    def lag(self):
+        """Seconds between the acquisition of the newest parsed row and the read that parsed
+        it, for files that record a `Start Time (Unix s)` header (None otherwise)."""
+        if "Start Time (Unix s)" not in self.metadata or self.read_time is None or self.last_time is None:
+            return None
+        return self.read_time - float(self.metadata["Start Time (Unix s)"]) - self.last_time
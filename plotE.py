@@ -2,12 +2,14 @@ from statistics import covariance
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 import math
+from two_term_functions import two_term_function
+from uncertainty_functions import bootstrap_curve_fit, confidence_intervals
+from profiling import start_profiler, show_profile
 
 
 st.set_page_config(layout="wide")
+profiler = start_profiler("plotE")
 
 st.title("Two-Term Fit Analysis")
 st.caption("Created by: Adriaan Frencken")
@@ -15,7 +17,8 @@ st.caption("Created by: Adriaan Frencken")
 # File uploader to drop CSV data files
 uploaded_file = st.sidebar.file_uploader("Upload CSV Data File", type=["csv"])
 if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file)
+    with profiler.stage("read_csv"):
+        df = pd.read_csv(uploaded_file)
     st.success(f"Loaded data from: {uploaded_file.name}")
 else:
     # Default file if nothing uploaded
@@ -39,16 +42,21 @@ init_E1p = st.sidebar.number_input("Initial E₁", value=0.65, format="%.2e")
 init_N2 = st.sidebar.number_input("Initial N₂", value=1.0E10, format="%.2e")
 init_E2p = st.sidebar.number_input("Initial E₂", value=0.58, format="%.2e")
 
+# Bootstrap confidence intervals for the fit parameters
+st.sidebar.header("Fit Uncertainty")
+bootstrap_fit = st.sidebar.checkbox("Bootstrap confidence intervals", value=False)
+bootstrap_resamples = st.sidebar.number_input("Max bootstrap resamples", min_value=10, max_value=5000, value=200, step=10)
+bootstrap_budget = st.sidebar.number_input("Bootstrap time budget (s)", min_value=1.0, max_value=120.0, value=10.0, step=1.0)
+confidence_level = st.sidebar.slider("Confidence level", min_value=0.80, max_value=0.99, value=0.95, step=0.01)
+
 
 # Replace 'x_column' and 'y_column' with your actual column names
 x1 = 1E-6 * abs(df['Total Current (uA)'])
 y1 = df['rho (e/cm^3)']
 
-def two_term_function(x, N_1, E1p, N_2, E2p):
-    return (N_1*1.3E-6*x)/(1.3E-6*x+math.exp(-E1p/0.025))-(N_2*math.exp(-E2p/0.025))/(1.3E-6*x+math.exp(-E2p/0.025))
-
 # Fit function with positive constraints
 def fit_two_term_from_csv(x1, y1, init_N1, init_E1p, init_N2, init_E2p):
+    from scipy.optimize import curve_fit
 
     x = x1
     y = y1
@@ -72,7 +80,8 @@ def fit_two_term_from_csv(x1, y1, init_N1, init_E1p, init_N2, init_E2p):
     return fitted_y, params
 
 # Predict y using the fitted function
-fitted_y, params = fit_two_term_from_csv(x1, y1, init_N1, init_E1p, init_N2, init_E2p)
+with profiler.stage("curve_fit"):
+    fitted_y, params = fit_two_term_from_csv(x1, y1, init_N1, init_E1p, init_N2, init_E2p)
 
 st.header(
     r"Fitted Equation: $y = \frac{N_1 \cdot a \cdot x}{a \cdot x + \exp\left(-\frac{E_1}{0.025}\right)} - \frac{N_2 \cdot \exp\left(-\frac{E_2}{0.025}\right)}{a \cdot x + \exp\left(-\frac{E_2}{0.025}\right)}$"
@@ -91,6 +100,31 @@ ss_tot = np.sum((y1 - np.mean(y1)) ** 2)
 r_squared = 1 - (ss_res / ss_tot)
 st.subheader(f"R²: {r_squared:.4f}")
 
+if bootstrap_fit:
+    with st.spinner("Running bootstrap refits..."):
+        with profiler.stage("bootstrap_curve_fit"):
+            bootstrap_stats = bootstrap_curve_fit(
+                two_term_function, x1, y1, params,
+                n_resamples=bootstrap_resamples,
+                time_budget=bootstrap_budget,
+                bounds=([0, 0, 0, 0], [np.inf, np.inf, np.inf, np.inf]),
+                maxfev=200000,
+            )
+    intervals = confidence_intervals(bootstrap_stats['samples'], ["N₁", "E₁", "N₂", "E₂"], confidence_level)
+    st.subheader(f"{confidence_level*100:.0f}% Confidence Intervals")
+    st.write(pd.DataFrame(
+        {
+            "Parameter": list(intervals.keys()),
+            "Estimate": [f"{p:e}" for p in params],
+            "Lower": [f"{low:e}" for low, _ in intervals.values()],
+            "Upper": [f"{high:e}" for _, high in intervals.values()],
+        }
+    ))
+    st.caption(f"{bootstrap_stats['n_resamples']} resamples ({bootstrap_stats['n_failed']} failed) in {bootstrap_stats['elapsed']:.1f} s")
+
+# matplotlib and scipy are imported where they are first used, so the uploader shows up quickly
+import matplotlib.pyplot as plt
+
 # Prepare figure and axis
 fig, ax = plt.subplots(figsize=(fig_width / 100, fig_height / 100))
 
@@ -130,5 +164,7 @@ if log_x == False:
     ax.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
 
 # Show plot in Streamlit
-st.pyplot(fig)
+with profiler.stage("matplotlib_render"):
+    st.pyplot(fig)
 
+show_profile(profiler)
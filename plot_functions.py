@@ -0,0 +1,196 @@
+import numpy as np
+import plotly.colors as pc
+import plotly.graph_objects as go
+
+
+def decimate(df, max_points):
+    """Every n-th row of df so that at most max_points rows are left."""
+    step = max(1, -(-len(df) // max_points))
+    return df.iloc[::step]
+
+
+def subplot_grid(n_panels, n_cols, horizontal_spacing=0.02, vertical_spacing=0.02):
+    """x and y domains of a row-major grid of n_panels subplots, in paper coordinates."""
+    n_rows = max(1, -(-n_panels // n_cols))
+    width = (1 - horizontal_spacing * (n_cols - 1)) / n_cols
+    height = (1 - vertical_spacing * (n_rows - 1)) / n_rows
+    domains = []
+    for i in range(n_panels):
+        row, col = divmod(i, n_cols)
+        x0 = col * (width + horizontal_spacing)
+        y1 = 1 - row * (height + vertical_spacing)
+        domains.append(([x0, x0 + width], [y1 - height, y1]))
+    return n_rows, domains
+
+
+def small_multiples_figure(panels, n_cols=4, colors=None, max_points=1000, panel_height=220,
+                           log_x=False, log_y=False, shared_yaxes=True):
+    """One subplot grid with a panel per I-t trace, instead of one chart per file.
+
+    panels is a list of dicts with `label`, `trace` (DataFrame with `Aligned_time (s)` and
+    `Current (A)`), optional `top_edge` / `falling_edge` DataFrames to overlay, optional
+    `leakage_stats` / `afterglow_stats` from leakage_current_functions and the
+    `leakage_times` (first, last aligned time of the top edge) to place the leakage markers at. Leakage and afterglow
+    are drawn as markers with hover text rather than annotated lines, and traces are
+    decimated to max_points and drawn with WebGL. All traces, axes and titles are collected
+    first and the figure is built in one go, which is much faster than make_subplots and
+    add_trace per panel when there are 100+ files.
+    """
+    colors = colors or ["#636EFA", "#EF553B", "#00CC96"]
+    n_rows, domains = subplot_grid(len(panels), n_cols, vertical_spacing=min(0.04, 0.5 / max(len(panels) // n_cols, 1)))
+    data = []
+    layout = {}
+    annotations = []
+    for i, (panel, (x_domain, y_domain)) in enumerate(zip(panels, domains)):
+        suffix = "" if i == 0 else str(i + 1)
+        axes = dict(xaxis=f"x{suffix}", yaxis=f"y{suffix}", showlegend=False)
+        trace = decimate(panel['trace'], max_points)
+        data.append(go.Scattergl(x=trace["Aligned_time (s)"], y=trace["Current (A)"], mode="lines",
+                                 line=dict(width=1, color=colors[0]), name=panel['label'], **axes))
+        for key, color in (("top_edge", colors[1 % len(colors)]), ("falling_edge", colors[2 % len(colors)])):
+            edge = panel.get(key)
+            if edge is not None and len(edge):
+                edge = decimate(edge, max_points)
+                data.append(go.Scattergl(x=edge["Aligned_time (s)"], y=edge["Current (A)"], mode="lines",
+                                         line=dict(width=1, color=color), name=key.replace("_", " "), **axes))
+
+        marker_x, marker_y, marker_text = [], [], []
+        leakage_stats = panel.get('leakage_stats')
+        leakage_times = panel.get('leakage_times')
+        if leakage_stats is not None and leakage_times is not None:
+            marker_x += list(leakage_times)
+            marker_y += [leakage_stats['start'], leakage_stats['end']]
+            marker_text += [f"Start: {leakage_stats['start']:.2e} A",
+                            f"End: {leakage_stats['end']:.2e} A<br>Leakage: {leakage_stats['difference']:.2e} A"]
+        afterglow_stats = panel.get('afterglow_stats')
+        if afterglow_stats is not None and 'end_current' in afterglow_stats:
+            marker_x.append(afterglow_stats['time_index'])
+            marker_y.append(afterglow_stats['threshold_drop'] + afterglow_stats['end_current'])
+            marker_text.append(f"Time drop: {afterglow_stats['time_drop'] * 1e3:.2f} ms")
+        if marker_x:
+            data.append(go.Scatter(x=marker_x, y=marker_y, mode="markers", text=marker_text, hoverinfo="text",
+                                   marker=dict(symbol="diamond", size=7, color="black"), **axes))
+
+        layout[f"xaxis{suffix}"] = dict(
+            domain=x_domain, anchor=f"y{suffix}", matches="x" if i else None,
+            showticklabels=i >= len(panels) - n_cols, type="log" if log_x else "linear",
+            showgrid=True, gridcolor="lightgrey",
+        )
+        layout[f"yaxis{suffix}"] = dict(
+            domain=y_domain, anchor=f"x{suffix}", matches="y" if i and shared_yaxes else None,
+            showticklabels=i % n_cols == 0 or not shared_yaxes, type="log" if log_y else "linear",
+            showgrid=True, gridcolor="lightgrey", exponentformat="e", showexponent="all",
+        )
+        annotations.append(dict(text=panel['label'], x=(x_domain[0] + x_domain[1]) / 2, y=y_domain[1],
+                                xref="paper", yref="paper", xanchor="center", yanchor="bottom",
+                                showarrow=False, font=dict(size=11)))
+
+    fig = go.Figure(data=data, layout=dict(
+        layout,
+        annotations=annotations,
+        height=n_rows * panel_height + 80,
+        margin=dict(l=40, r=10, t=40, b=40),
+        hovermode="closest",
+        font=dict(size=10),
+    ))
+    return fig
+
+
+def density_histogram(xs, ys, x_edges, y_edges, log_x=False, log_y=False, resample=True):
+    """Number of samples of all traces in every (y, x) pixel of the grid given by the bin edges.
+
+    xs and ys are lists of per-trace arrays. With log_x / log_y the edges and the data are
+    binned in log10 of the absolute value. With resample, every trace is first interpolated at
+    the pixel column centres inside its own x range, so sparse traces (I-V sweeps) still show
+    up as continuous curves and every trace adds about one sample per column.
+    Returns a (len(y_edges) - 1, len(x_edges) - 1) integer array.
+    """
+    transform_x = (lambda v: np.log10(np.abs(v))) if log_x else np.asarray
+    transform_y = (lambda v: np.log10(np.abs(v))) if log_y else np.asarray
+    x_edges = transform_x(np.asarray(x_edges, dtype=float))
+    y_edges = transform_y(np.asarray(y_edges, dtype=float))
+    n_x, n_y = len(x_edges) - 1, len(y_edges) - 1
+    x_centres = (x_edges[:-1] + x_edges[1:]) / 2
+    all_x, all_y = [], []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for x, y in zip(xs, ys):
+            x, y = transform_x(np.asarray(x, dtype=float)), transform_y(np.asarray(y, dtype=float))
+            valid = np.isfinite(x) & np.isfinite(y)
+            x, y = x[valid], y[valid]
+            if resample and len(x) > 1:
+                order = np.argsort(x, kind="stable")
+                x, y = x[order], y[order]
+                columns = x_centres[(x_centres >= x[0]) & (x_centres <= x[-1])]
+                x, y = columns, np.interp(columns, x, y)
+            all_x.append(x)
+            all_y.append(y)
+    x = np.concatenate(all_x) if all_x else np.empty(0)
+    y = np.concatenate(all_y) if all_y else np.empty(0)
+    # np.histogram2d sorts every sample into the bins, a uniform grid only needs an index
+    x_index = np.floor((x - x_edges[0]) / (x_edges[-1] - x_edges[0]) * n_x).astype(np.int64)
+    y_index = np.floor((y - y_edges[0]) / (y_edges[-1] - y_edges[0]) * n_y).astype(np.int64)
+    inside = (x_index >= 0) & (x_index < n_x) & (y_index >= 0) & (y_index < n_y)
+    counts = np.bincount(y_index[inside] * n_x + x_index[inside], minlength=n_x * n_y)
+    return counts.reshape(n_y, n_x)
+
+
+def density_range(values, log=False):
+    """(min, max) of the finite values for a density axis, of |values| > 0 on a log axis.
+    A single value is widened to a half decade (log) or 10 % either side, so the bin edges
+    do not collapse. None when there are no values to bin."""
+    values = np.asarray(values, dtype=float)
+    values = np.abs(values[values != 0]) if log else values
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return None
+    low, high = values.min(), values.max()
+    if low == high:
+        if log:
+            return low / np.sqrt(10), high * np.sqrt(10)
+        pad = 0.1 * abs(low) or 1.0
+        return low - pad, high + pad
+    return low, high
+
+
+def density_figure(groups, x_range, y_range, colors=None, width=800, height=400, log_x=False, log_y=False,
+                   log_counts=True, resample=True):
+    """Density image of many traces: one heatmap trace per group instead of one scatter per trace.
+
+    groups maps a group label to a (xs, ys) pair of per-trace array lists. Counts are binned on
+    a width x height pixel grid with density_histogram and shown as log10(1 + count) when
+    log_counts is set. With one group the heatmap uses a colour scale; with several groups
+    every group is drawn in its own colour fading to transparent, so overlapping groups stay
+    visible. The figure size depends on the pixel grid, not on the number of samples.
+    """
+    colors = colors or ["#636EFA", "#EF553B", "#00CC96", "#AB63FA", "#FFA15A"]
+    x_edges = (np.logspace(np.log10(x_range[0]), np.log10(x_range[1]), width + 1) if log_x
+               else np.linspace(x_range[0], x_range[1], width + 1))
+    y_edges = (np.logspace(np.log10(y_range[0]), np.log10(y_range[1]), height + 1) if log_y
+               else np.linspace(y_range[0], y_range[1], height + 1))
+    x_centres = np.sqrt(x_edges[:-1] * x_edges[1:]) if log_x else (x_edges[:-1] + x_edges[1:]) / 2
+    y_centres = np.sqrt(y_edges[:-1] * y_edges[1:]) if log_y else (y_edges[:-1] + y_edges[1:]) / 2
+
+    data = []
+    for group_idx, (label, (xs, ys)) in enumerate(groups.items()):
+        counts = density_histogram(xs, ys, x_edges, y_edges, log_x, log_y, resample).astype(float)
+        counts[counts == 0] = np.nan  # empty pixels stay transparent
+        z = (np.log10(1 + counts) if log_counts else counts).astype(np.float32)  # halves the figure JSON
+        heatmap = dict(x=x_centres, y=y_centres, z=z, name=f"{label} (n={len(xs)})", zmin=0,
+                       hovertemplate="x=%{x:.3g}<br>y=%{y:.3e}<br>" + ("log10(1+count)" if log_counts else "count")
+                       + "=%{z:.2f}<extra>%{fullData.name}</extra>")
+        if len(groups) == 1:
+            heatmap.update(colorscale="Viridis", colorbar=dict(title="log10(1+n)" if log_counts else "n"))
+        else:
+            r, g, b = pc.convert_colors_to_same_type([colors[group_idx % len(colors)]], colortype="tuple")[0][0]
+            rgb = f"{r * 255:.0f}, {g * 255:.0f}, {b * 255:.0f}"
+            heatmap.update(colorscale=[[0, f"rgba({rgb}, 0.1)"], [1, f"rgba({rgb}, 1)"]], showscale=False,
+                           showlegend=True)
+        data.append(go.Heatmap(**heatmap))
+
+    fig = go.Figure(data=data, layout=dict(
+        xaxis=dict(type="log" if log_x else "linear", showgrid=True, gridcolor="lightgrey"),
+        yaxis=dict(type="log" if log_y else "linear", showgrid=True, gridcolor="lightgrey",
+                   exponentformat="e", showexponent="all"),
+        plot_bgcolor="white",
+    ))
+    return fig
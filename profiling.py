@@ -0,0 +1,107 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+import streamlit as st
+
+
+class StageProfiler:
+    """Wall time and, optionally, Python memory of the named stages of one page rerun.
+
+    Wrap each stage in `with profiler.stage("name"):`. Stages that run once per file are
+    recorded every time and summed in the table. Memory tracking uses tracemalloc, which
+    slows the page down, so it is off unless track_memory is set. Stages should not be
+    nested when memory is tracked, because each stage resets the tracemalloc peak.
+    """
+
+    def __init__(self, page, track_memory=False):
+        self.page = page
+        self.track_memory = track_memory
+        self.records = []
+        self.start = time.perf_counter()
+        self.started_tracemalloc = track_memory and not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            memory_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        stage_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': name,
+                'start_s': stage_start - self.start,
+                'duration_s': time.perf_counter() - stage_start,
+            }
+            if self.track_memory:
+                memory_after, memory_peak = tracemalloc.get_traced_memory()
+                record['peak_memory_bytes'] = memory_peak - memory_before
+                record['memory_delta_bytes'] = memory_after - memory_before
+            self.records.append(record)
+
+    def finish(self):
+        """Stop memory tracking and return the total run time."""
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        return time.perf_counter() - self.start
+
+    def summary(self) -> pd.DataFrame:
+        """One row per stage: number of calls, total and mean time, largest memory peak."""
+        if not self.records:
+            return pd.DataFrame(columns=["stage", "calls", "total_ms", "mean_ms"])
+        df = pd.DataFrame(self.records)
+        aggregations = dict(calls=("duration_s", "size"), total_ms=("duration_s", "sum"), mean_ms=("duration_s", "mean"))
+        if self.track_memory:
+            aggregations["peak_memory_mb"] = ("peak_memory_bytes", "max")
+            aggregations["memory_delta_mb"] = ("memory_delta_bytes", "sum")
+        summary = df.groupby("stage", sort=False).agg(**aggregations).reset_index()
+        summary[["total_ms", "mean_ms"]] *= 1e3
+        if self.track_memory:
+            summary[["peak_memory_mb", "memory_delta_mb"]] /= 1e6
+        return summary.sort_values("total_ms", ascending=False)
+
+    def trace_events(self) -> str:
+        """The stages in Chrome trace event JSON, for chrome://tracing or ui.perfetto.dev."""
+        events = []
+        for record in self.records:
+            event = {
+                'name': record['stage'],
+                'cat': self.page,
+                'ph': "X",
+                'ts': record['start_s'] * 1e6,
+                'dur': record['duration_s'] * 1e6,
+                'pid': os.getpid(),
+                'tid': 0,
+            }
+            if self.track_memory:
+                event['args'] = {key: record[key] for key in ("peak_memory_bytes", "memory_delta_bytes")}
+            events.append(event)
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': "ms"})
+
+
+def start_profiler(page) -> StageProfiler:
+    """Profiler for this rerun of the page. The memory tracking switch is drawn by
+    show_profile at the end of the run, so its value is read from the session state here.
+    """
+    return StageProfiler(page, st.session_state.get(f"profile_memory_{page}", False))
+
+
+def show_profile(profiler: StageProfiler):
+    """Collapsible per-rerun profile table in the sidebar, with a trace file download."""
+    total_time = profiler.finish()
+    summary = profiler.summary()
+    with st.sidebar:
+        with st.expander(f"Profile ({total_time * 1e3:.0f} ms)", expanded=False):
+            st.dataframe(summary.round(2), hide_index=True, use_container_width=True)
+            profiled = summary["total_ms"].sum() if len(summary) else 0.0
+            st.caption(f"Profiled stages: {profiled:.0f} ms of {total_time * 1e3:.0f} ms")
+            st.download_button("Download trace", profiler.trace_events(),
+                               file_name=f"{profiler.page}_trace.json", mime="application/json")
+            st.checkbox("Track stage memory (slower)", value=False, key=f"profile_memory_{profiler.page}")
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+from resampling_functions import batched_interp
+
+
+def find_threshold_crossings(time, current, threshold, hysteresis=0.5):
+    """Sub-sample times at which the current rises through the threshold.
+
+    A Schmitt trigger suppresses noise: after a crossing, the current has to fall below
+    threshold * (1 - hysteresis) before the next rising crossing counts. The crossing time
+    is linearly interpolated between the two samples that straddle the threshold.
+    """
+    time = np.asarray(time, dtype=float)
+    current = np.asarray(current, dtype=float)
+    above = current > threshold
+    below = current < threshold * (1 - hysteresis)
+    # Carry the last decisive sample (above or below) forward to get the trigger state
+    last_decisive = np.maximum.accumulate(np.where(above | below, np.arange(len(current)), -1))
+    state = (last_decisive >= 0) & above[np.maximum(last_decisive, 0)]
+    idx = np.flatnonzero(~state[:-1] & state[1:])
+    fraction = (threshold - current[idx]) / (current[idx + 1] - current[idx])
+    return time[idx] + fraction * (time[idx + 1] - time[idx])
+
+
+class OnsetTracker:
+    """Rising threshold crossings of a trace that arrives in pieces.
+
+    The samples since the last one that decided the Schmitt trigger state (above the
+    threshold or below the release level) are carried into the next update, so crossings
+    are the same as find_threshold_crossings on the whole trace.
+    """
+
+    def __init__(self, threshold, hysteresis=0.5, holdoff=0.05):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.holdoff = holdoff
+        self.carry_time = np.empty(0)
+        self.carry_current = np.empty(0)
+        self.onsets = []
+
+    def update(self, time, current):
+        """Add new samples and return the onsets found in them."""
+        time = np.concatenate([self.carry_time, np.asarray(time, dtype=float)])
+        current = np.concatenate([self.carry_current, np.asarray(current, dtype=float)])
+        new_onsets = []
+        last_onset = self.onsets[-1] if self.onsets else -np.inf
+        for onset in find_threshold_crossings(time, current, self.threshold, self.hysteresis):
+            if onset > last_onset + self.holdoff:
+                new_onsets.append(onset)
+                last_onset = onset
+        self.onsets.extend(new_onsets)
+
+        decisive = np.flatnonzero((current > self.threshold) | (current < self.threshold * (1 - self.hysteresis)))
+        start = decisive[-1] if len(decisive) else 0
+        self.carry_time = time[start:]
+        self.carry_current = current[start:]
+        return new_onsets
+
+
+class PulseAverager:
+    """Running sum of pulse windows on a fixed time grid relative to the pulse onset.
+    Only the sums are kept, so memory does not grow with the number of pulses.
+    """
+
+    def __init__(self, pre_time=0.2, post_time=2.0, time_step=1e-3):
+        self.time_grid = np.arange(-pre_time, post_time + time_step / 2, time_step)
+        self.pre_time = pre_time
+        self.post_time = post_time
+        self.current_sum = np.zeros_like(self.time_grid)
+        self.current_sum_sq = np.zeros_like(self.time_grid)
+        self.n_pulses = 0
+
+    def add_pulse(self, time, current, onset_time):
+        """Interpolate one pulse onto the grid at its sub-sample onset and add it to the sums."""
+        window = np.interp(onset_time + self.time_grid, time, current)
+        self.current_sum += window
+        self.current_sum_sq += window ** 2
+        self.n_pulses += 1
+
+    def result(self) -> pd.DataFrame:
+        """Averaged pulse response with its per-point standard deviation across pulses."""
+        n = max(self.n_pulses, 1)
+        mean = self.current_sum / n
+        std = np.sqrt(np.maximum(self.current_sum_sq / n - mean ** 2, 0.0))
+        return pd.DataFrame({
+            "Time (s)": self.time_grid + self.pre_time,
+            "Current (A)": mean,
+            "Current Std (A)": std,
+        })
+
+
+def average_pulses(chunks, threshold, pre_time=0.2, post_time=2.0, time_step=None, holdoff=0.05):
+    """Coherently average every LED pulse in an I-t acquisition read in chunks.
+
+    chunks is an iterable of DataFrames with `Time (s)` and `Current (A)`, e.g. from
+    pd.read_csv(..., chunksize=n). Pulses are found by rising threshold crossings (ignoring
+    crossings within `holdoff` seconds of the previous onset), aligned at their sub-sample
+    onset time and summed into a PulseAverager. Only the samples that a pending pulse window
+    may still need are carried between chunks. The default time step is the median sample
+    interval of the first chunk. Returns (averaged DataFrame, number of pulses).
+    """
+    averager = None
+    carry_time = np.empty(0)
+    carry_current = np.empty(0)
+    last_onset = -np.inf
+    pending = []
+    for chunk in chunks:
+        time = np.concatenate([carry_time, chunk["Time (s)"].to_numpy(dtype=float)])
+        current = np.concatenate([carry_current, chunk["Current (A)"].to_numpy(dtype=float)])
+        if averager is None:
+            if time_step is None:
+                time_step = float(np.median(np.diff(time))) if len(time) > 1 else 1e-3
+            averager = PulseAverager(pre_time, post_time, time_step)
+
+        for onset in find_threshold_crossings(time, current, threshold):
+            if onset > last_onset + holdoff:
+                pending.append(onset)
+                last_onset = onset
+        # Pulses whose whole window has arrived are accumulated; the rest wait for more data
+        complete = [onset for onset in pending if onset + post_time <= time[-1]]
+        pending = [onset for onset in pending if onset + post_time > time[-1]]
+        for onset in complete:
+            if onset - pre_time >= time[0]:
+                averager.add_pulse(time, current, onset)
+
+        # Keep one sample before the earliest window still needed, so windows and
+        # crossings that straddle the chunk boundary stay intact
+        keep_from = min(pending + [time[-1]]) - pre_time
+        start = max(np.searchsorted(time, keep_from, side="right") - 1, 0)
+        carry_time = time[start:]
+        carry_current = current[start:]
+
+    if averager is None:
+        return pd.DataFrame(columns=["Time (s)", "Current (A)", "Current Std (A)"]), 0
+    return averager.result(), averager.n_pulses
+
+
+def xcorr_edge_times(traces, reference=None, template_halfwidth=25, time_step=None):
+    """Rising edge time of every trace by FFT cross-correlation with a reference edge template.
+
+    traces is a list of (time, current) arrays. All traces are resampled onto one uniform
+    time grid and normalised to their own 1st-99th percentile range, so photocurrent
+    magnitude does not matter. The template is the normalised derivative of the reference
+    trace (by default the one with the largest current step) within template_halfwidth
+    samples of its steepest rise. Every trace is correlated with it in one batched FFT, and
+    the peak is refined to sub-sample precision with a parabola through its neighbours.
+    Returns (edge_times, peak_scores), where the score is the normalised correlation at the
+    peak (1 means the trace edge matches the template). Traces without a matching edge, or
+    all traces if even the reference is flat, get a NaN edge time and score.
+    """
+    if time_step is None:
+        time_step = float(np.median(np.concatenate([np.diff(np.asarray(time, dtype=float)) for time, _ in traces])))
+    t_start = min(np.nanmin(time) for time, _ in traces)
+    t_end = max(np.nanmax(time) for time, _ in traces)
+    time_grid = np.arange(t_start, t_end + time_step / 2, time_step)
+    stack = batched_interp([time for time, _ in traces], [current for _, current in traces], time_grid)
+
+    low = np.nanpercentile(stack, 1, axis=1, keepdims=True)
+    high = np.nanpercentile(stack, 99, axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        derivative = np.nan_to_num(np.diff((stack - low) / (high - low), axis=1), posinf=0.0, neginf=0.0)
+
+    if reference is None:
+        reference = int(np.argmax(np.nan_to_num(high - low)[:, 0]))
+    steepest = int(np.argmax(derivative[reference]))
+    lo = max(steepest - template_halfwidth, 0)
+    template = derivative[reference, lo:steepest + template_halfwidth + 1]
+    template_norm = np.linalg.norm(template)
+    if not template_norm > 0:
+        return np.full(len(traces), np.nan), np.full(len(traces), np.nan)
+    template = template / template_norm
+
+    n_fft = derivative.shape[1] + len(template)
+    correlation = np.fft.irfft(
+        np.fft.rfft(derivative, n_fft, axis=1) * np.conj(np.fft.rfft(template, n_fft))[np.newaxis, :],
+        n_fft, axis=1,
+    )[:, :derivative.shape[1] - len(template) + 1]
+
+    peak = np.argmax(correlation, axis=1)
+    rows = np.arange(len(traces))
+    left = correlation[rows, np.maximum(peak - 1, 0)]
+    centre = correlation[rows, peak]
+    right = correlation[rows, np.minimum(peak + 1, correlation.shape[1] - 1)]
+    curvature = left - 2 * centre + right
+    shift = np.where(curvature < 0, 0.5 * (left - right) / np.where(curvature < 0, curvature, 1), 0.0)
+
+    # Windowed norm of each trace's derivative turns the peak into a normalised score
+    energy = np.concatenate([np.zeros((len(traces), 1)), np.cumsum(derivative ** 2, axis=1)], axis=1)
+    window_norm = np.sqrt(energy[rows, peak + len(template)] - energy[rows, peak])
+    peak_scores = np.where(window_norm > 0, centre / np.where(window_norm > 0, window_norm, 1), np.nan)
+
+    # Position of the reference's steepest sample inside the template, +0.5 for np.diff
+    edge_index = peak + shift + (steepest - lo) + 0.5
+    edge_times = time_grid[0] + edge_index * time_step
+    no_edge = ~(peak_scores > 0)
+    edge_times[no_edge] = np.nan
+    peak_scores[no_edge] = np.nan
+    return edge_times, peak_scores
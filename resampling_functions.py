@@ -0,0 +1,70 @@
+import warnings
+import numpy as np
+
+
+def batched_interp(x_list, y_list, x_query, atol=0.0):
+    """Linear interpolation of many curves onto a shared query grid with one np.interp call.
+
+    Each curve's x values are shifted by a per-curve offset larger than any span in the data,
+    so the concatenated curves stay sorted and no query can fall between two curves. Curves
+    need not be sorted or share a length; NaN points are dropped. Query points more than atol
+    outside a curve's own x range are NaN; those within atol of an end get the end value.
+    Returns an array of shape (n_curves, len(x_query)).
+    """
+    x_query = np.atleast_1d(np.asarray(x_query, dtype=float))
+    n_curves = len(x_list)
+    resampled = np.full((n_curves, len(x_query)), np.nan)
+    if n_curves == 0:
+        return resampled
+
+    curve_ids, x_all, y_all = [], [], []
+    for i, (x, y) in enumerate(zip(x_list, y_list)):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        mask = np.isfinite(x) & np.isfinite(y)
+        curve_ids.append(np.full(mask.sum(), i))
+        x_all.append(x[mask])
+        y_all.append(y[mask])
+    curve_ids = np.concatenate(curve_ids)
+    x_all = np.concatenate(x_all)
+    y_all = np.concatenate(y_all)
+    if len(x_all) == 0:
+        return resampled
+
+    x_min = np.full(n_curves, np.inf)
+    x_max = np.full(n_curves, -np.inf)
+    np.minimum.at(x_min, curve_ids, x_all)
+    np.maximum.at(x_max, curve_ids, x_all)
+
+    span = max(np.ptp(x_all), np.ptp(x_query))
+    offset = 2 * (span + 1) + np.abs(x_all).max() + np.abs(x_query).max()
+    order = np.lexsort((x_all, curve_ids))
+    shifts = np.arange(n_curves)[:, np.newaxis] * offset
+    # Clipped to each curve's range, so queries within atol of an end never reach the next curve
+    with np.errstate(invalid="ignore"):
+        clipped = np.clip(x_query[np.newaxis, :], x_min[:, np.newaxis], x_max[:, np.newaxis])
+    resampled = np.interp(clipped + shifts, x_all[order] + curve_ids[order] * offset, y_all[order])
+
+    outside = ((x_query[np.newaxis, :] < x_min[:, np.newaxis] - atol)
+               | (x_query[np.newaxis, :] > x_max[:, np.newaxis] + atol) | ~np.isfinite(clipped))
+    resampled[outside] = np.nan
+    return resampled
+
+
+def ensemble_stats(stack, percentiles=(10, 90)):
+    """NaN-aware summary of stacked curves (n_curves, n_points) at every grid point.
+    Returns a dict with mean, std, median, count and one entry per requested percentile.
+    """
+    count = np.isfinite(stack).sum(axis=0)
+    # Grid points no curve covers are all-NaN columns; their stats are NaN without a warning
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        stats = {
+            'mean': np.nanmean(stack, axis=0),
+            'std': np.nanstd(stack, axis=0),
+            'median': np.nanmedian(stack, axis=0),
+            'count': count,
+        }
+        for percentile in percentiles:
+            stats[percentile] = np.nanpercentile(stack, percentile, axis=0)
+    return stats
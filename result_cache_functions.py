@@ -0,0 +1,157 @@
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from functools import lru_cache
+import numpy as np
+
+# Shared by every session and user of the app; point it at a network drive to share results
+RESULT_CACHE_PATH = os.environ.get(
+    "RESULT_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results.sqlite")
+)
+
+
+@lru_cache(maxsize=64)
+def _source_digest(path, mtime_ns, size):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def code_version(*sources) -> str:
+    """Fingerprint of the analysis code: the source files of the given .py paths and module names.
+
+    Editing any of them gives new cache keys, so results of older code are never returned.
+    """
+    digests = []
+    for source in sources:
+        path = source if os.fspath(source).endswith(".py") else inspect.getsourcefile(importlib.import_module(source))
+        stat = os.stat(path)
+        digests.append(_source_digest(os.fspath(path), stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha256("".join(digests).encode()).hexdigest()[:16]
+
+
+def result_key(digest, params, version) -> str:
+    """Cache key of one analysis of one file: its content digest, the analysis parameters
+    and the code version. Parameters are a dict of JSON serialisable settings."""
+    payload = json.dumps([digest, params, version], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _to_json(value):
+    # NumPy arrays and scalars in results are stored as lists and Python numbers
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} results cannot be cached")
+
+
+class ResultCache:
+    """Analysis results by result_key, stored as JSON in an SQLite file so they outlive the
+    session and the server. Results are dicts, lists, strings and numbers; tuples and NumPy
+    arrays come back as lists. JSON rather than pickle, so a shared cache file cannot run
+    code in the processes reading it.
+
+    Least recently used results are deleted once they take more than max_bytes. SQLite and
+    file system errors (read-only or locked file) turn the cache into a no-op rather than
+    failing the analysis.
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_bytes=256 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.ready = False
+
+    def _connect(self):
+        if not self.ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.ready:
+            # WAL lets several sessions read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            connection.commit()
+            self.ready = True
+        return connection
+
+    def get_many(self, keys) -> dict:
+        """Results of the keys that are cached, in one query, marking them as recently used."""
+        keys = list(dict.fromkeys(keys))
+        results = {}
+        try:
+            with closing(self._connect()) as connection, connection:
+                for start in range(0, len(keys), 500):  # stay below SQLite's variable limit
+                    chunk = keys[start:start + 500]
+                    rows = connection.execute(
+                        f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, value in rows:
+                        try:
+                            results[key] = json.loads(value)
+                        except Exception:
+                            pass  # written by an incompatible version, recomputed and replaced
+                now = time.time()
+                connection.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in results])
+        except (sqlite3.Error, OSError):
+            return {}
+        self.hits += len(results)
+        self.misses += len(keys) - len(results)
+        return results
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, results):
+        """Store a dict of key to result, then evict down to max_bytes."""
+        if not results:
+            return
+        now = time.time()
+        rows = []
+        for key, value in results.items():
+            text = json.dumps(value, default=_to_json)
+            rows.append((key, text, len(text), now))
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+                # Keep the most recently used results that fit in max_bytes
+                connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM "
+                    "(SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total FROM results) "
+                    "WHERE total > ?)",
+                    (self.max_bytes,),
+                )
+        except (sqlite3.Error, OSError):
+            pass
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def clear(self):
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.execute("DELETE FROM results")
+        except (sqlite3.Error, OSError):
+            pass
+
+    def info(self) -> dict:
+        """Number of cached results, their total size and this process's hits and misses."""
+        try:
+            with closing(self._connect()) as connection:
+                n_results, n_bytes = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        except (sqlite3.Error, OSError):
+            n_results, n_bytes = 0, 0
+        return {'results': n_results, 'bytes': n_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+result_cache = ResultCache()
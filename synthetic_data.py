@@ -0,0 +1,179 @@
+"""Reproducible synthetic I-t and I-V data sets for scale benchmarks.
+
+    python synthetic_data.py --folder SYNTHETIC --it-files 1000 --iv-files 1000 --samples 10000 --seed 0
+    python synthetic_data.py --folder SYNTHETIC_LONG --it-files 4 --samples 10000000 --formats csv parquet
+
+Files use the PyMeasure CSV layout of SAMPLES. Parquet files hold the same columns, with the
+header parameters stored in the schema metadata. File i only depends on the seed and i, so
+a larger data set starts with the same files as a smaller one.
+"""
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from instrument_simulator import IT_COLUMNS, IV_COLUMNS, pymeasure_header, sweep_voltages
+
+SURFACE_TREATMENTS = ["TiO2", "CdS_1mTorr_12nm", "CdS_10mTorr_12nm", "Al2O3", "Untreated"]
+
+
+def synthetic_metadata(measurement_type, index) -> dict:
+    """Header parameters of one synthetic device, cycling through treatments and guard rings."""
+    guard_ring = bool(index % 2)
+    device_id = f"SYN{index // 2:05d}_{'guarded' if guard_ring else 'unguarded'}"
+    metadata = {
+        "Contact ID": f"{'guarded' if guard_ring else 'unguarded'}_centerpixel",
+        "Device ID": device_id,
+        "Surface Treatment": SURFACE_TREATMENTS[(index // 2) % len(SURFACE_TREATMENTS)],
+        "Guard Ring": guard_ring,
+        "Probe Location": "center_pixel",
+        "Seed Index": index,
+    }
+    if measurement_type == "I-t":
+        metadata["Voltage (V)"] = 1000
+    else:
+        metadata["Maximum Voltage"] = 1000
+        metadata["Minimum Voltage"] = -1000
+    return metadata
+
+
+def synthetic_it_trace(n_samples=10000, sample_rate=800.0, pulse_start=5.0, pulse_width=1.0,
+                       dark_current=2e-9, photocurrent=5e-6, plateau_drift=0.02, dark_drift=1e-12,
+                       afterglow_amplitudes=(0.7, 0.25, 0.05), afterglow_times=(1e-3, 1e-2, 1e-1),
+                       rise_time=1e-3, noise=1e-9, spike_rate=1e-3, spike_amplitude=2e-7, rng=None):
+    """Synthetic I-t trace of one LED pulse.
+
+    The photocurrent rises exponentially, drifts by `plateau_drift` (relative) over the pulse,
+    and decays after the pulse as a sum of exponentials. The dark current drifts linearly.
+    Gaussian noise is added everywhere and a fraction `spike_rate` of samples get a spike.
+    Returns a DataFrame with `Time (s)` and `Current (A)`.
+    """
+    rng = rng or np.random.default_rng()
+    time = np.arange(n_samples) / sample_rate
+    on_time = time - pulse_start
+    during = (on_time >= 0) & (on_time < pulse_width)
+    after = on_time >= pulse_width
+
+    plateau = photocurrent * (1 + plateau_drift * on_time / pulse_width)
+    rise = plateau * (1 - np.exp(-np.maximum(on_time, 0) / rise_time))
+    end_current = photocurrent * (1 + plateau_drift) * (1 - np.exp(-pulse_width / rise_time))
+    off_time = np.maximum(on_time - pulse_width, 0)[:, np.newaxis]
+    decay = (np.asarray(afterglow_amplitudes) * np.exp(-off_time / np.asarray(afterglow_times))).sum(axis=1)
+    light = np.where(during, rise, np.where(after, end_current * decay, 0.0))
+
+    current = dark_current + dark_drift * time + light + noise * rng.standard_normal(n_samples)
+    spikes = rng.random(n_samples) < spike_rate
+    current[spikes] += spike_amplitude * rng.choice([-1.0, 1.0], spikes.sum()) * rng.random(spikes.sum())
+    return pd.DataFrame({"Time (s)": time, "Current (A)": current})
+
+
+def synthetic_iv_sweep(n_points=50, ohmic_current=1e-9, sclc_voltage=30.0, sclc_exponent=2.0,
+                       trap_voltage=300.0, trap_exponent=5.0, breakdown_voltage=800.0, compliance=1e-4,
+                       noise=0.01, rng=None):
+    """Synthetic negative-to-positive I-V sweep with ohmic, SCLC and trap-limited power law
+    regions, a steep breakdown above breakdown_voltage and a compliance limit.
+    Returns a DataFrame with `Voltage (V)`, `Current (A)` and `Current Std (A)`.
+    """
+    rng = rng or np.random.default_rng()
+    voltage = sweep_voltages(n_points=n_points)
+    magnitude = np.abs(voltage)
+    current = (ohmic_current * magnitude
+               * np.maximum(1.0, magnitude / sclc_voltage) ** (sclc_exponent - 1)
+               * np.maximum(1.0, magnitude / trap_voltage) ** (trap_exponent - sclc_exponent)
+               * np.exp(np.maximum(magnitude - breakdown_voltage, 0) / 20.0))
+    current = np.minimum(current, compliance) * (1 + noise * rng.standard_normal(len(voltage)))
+    return pd.DataFrame({
+        "Voltage (V)": voltage,
+        "Current (A)": np.sign(voltage) * current,
+        "Current Std (A)": np.abs(current) * noise,
+    })
+
+
+def random_it_settings(rng) -> dict:
+    """Per-file variation of the I-t model parameters."""
+    return dict(
+        photocurrent=10 ** rng.uniform(-5.6, -5),
+        plateau_drift=rng.uniform(-0.02, 0.05),
+        dark_current=10 ** rng.uniform(-10, -8.5),
+        afterglow_times=tuple(np.sort(10 ** rng.uniform([-3.5, -2.5, -1.5], [-2.5, -1.5, -0.5]))),
+        pulse_start=rng.uniform(4.0, 6.0),
+    )
+
+
+def random_iv_settings(rng) -> dict:
+    """Per-file variation of the I-V model parameters."""
+    return dict(
+        ohmic_current=10 ** rng.uniform(-11, -8),
+        sclc_voltage=10 ** rng.uniform(0.5, 2),
+        trap_voltage=10 ** rng.uniform(2, 2.7),
+        breakdown_voltage=rng.uniform(500, 1200),
+    )
+
+
+def write_pymeasure_csv(df, file_path, metadata, columns):
+    """Write df in the PyMeasure CSV layout with metadata as header parameters."""
+    with open(file_path, "w", newline="") as file:
+        file.write(pymeasure_header(metadata, columns))
+        df[columns].to_csv(file, index=False, header=False, lineterminator="\n")
+
+
+def write_parquet(df, file_path, metadata):
+    """Write df to Parquet with the header parameters as JSON in the schema metadata."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b"pymeasure_parameters": json.dumps(metadata).encode()})
+    pq.write_table(table, file_path)
+
+
+def generate_dataset(folder, n_it_files=10, n_iv_files=10, n_samples=10000, sample_rate=800.0,
+                     n_voltage_points=50, seed=0, formats=("csv",)):
+    """Write n_it_files I-t traces and n_iv_files I-V sweeps to folder. Returns the written paths."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    jobs = [("I-t", i) for i in range(n_it_files)] + [("I-V", i) for i in range(n_iv_files)]
+    for measurement_type, index in jobs:
+        stream = 0 if measurement_type == "I-t" else 1
+        rng = np.random.default_rng([seed, stream, index])
+        metadata = synthetic_metadata(measurement_type, index)
+        if measurement_type == "I-t":
+            df = synthetic_it_trace(n_samples, sample_rate, rng=rng, **random_it_settings(rng))
+            df["Voltage (V)"] = 1000.0
+            columns = IT_COLUMNS
+        else:
+            df = synthetic_iv_sweep(n_voltage_points, rng=rng, **random_iv_settings(rng))
+            df["Temperature (C)"] = np.nan
+            columns = IV_COLUMNS
+        df["Device ID"] = metadata["Device ID"]
+        df["Contact ID"] = metadata["Contact ID"]
+
+        base_name = os.path.join(folder, f"{measurement_type}_{metadata['Device ID']}_{metadata['Contact ID']}_{index}")
+        if "csv" in formats:
+            write_pymeasure_csv(df, base_name + ".csv", metadata, columns)
+            paths.append(base_name + ".csv")
+        if "parquet" in formats:
+            write_parquet(df[columns], base_name + ".parquet", metadata)
+            paths.append(base_name + ".parquet")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="SYNTHETIC")
+    parser.add_argument("--it-files", type=int, default=10, help="number of I-t traces")
+    parser.add_argument("--iv-files", type=int, default=10, help="number of I-V sweeps")
+    parser.add_argument("--samples", type=int, default=10000, help="samples per I-t trace")
+    parser.add_argument("--sample-rate", type=float, default=800.0, help="I-t samples per second")
+    parser.add_argument("--voltage-points", type=int, default=50, help="points per I-V sweep")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--formats", nargs="+", default=["csv"], choices=["csv", "parquet"])
+    args = parser.parse_args()
+
+    paths = generate_dataset(args.folder, args.it_files, args.iv_files, args.samples, args.sample_rate,
+                             args.voltage_points, args.seed, args.formats)
+    print(f"Wrote {len(paths)} files to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
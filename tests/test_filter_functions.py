@@ -0,0 +1,70 @@
+import numpy as np
+from filter_functions import filter_current, fit_baselines, hampel_filter
+
+
+def test_hampel_replaces_spikes():
+    rng = np.random.default_rng(0)
+    current = 1e-9 + rng.normal(0, 1e-11, 1000)
+    current[[100, 500]] = 5e-8
+    filtered, replaced = hampel_filter(current, half_window=5, n_sigmas=5.0)
+    assert replaced[[100, 500]].all()
+    assert replaced.sum() < 10  # small windows give a few false positives on Gaussian noise
+    assert abs(filtered[100] - 1e-9) < 1e-10
+
+
+def test_hampel_keeps_quantised_steps_on_flat_windows():
+    # Quantised readings: flat windows (MAD of 0) with a one-count change, then a pulse edge
+    current = np.r_[np.full(20, 1.000e-9), 1.001e-9, np.full(20, 1.000e-9), np.full(20, 5e-6)]
+    current[41] = 4e-6
+    filtered, replaced = hampel_filter(current, half_window=3, n_sigmas=3.0)
+    assert not replaced.any()
+    np.testing.assert_array_equal(filtered, current)
+
+    # Without the floor every change on a flat window would be replaced
+    _, replaced = hampel_filter(current, half_window=3, n_sigmas=3.0, min_mad_fraction=0.0)
+    assert replaced[20]
+
+
+def test_blocks_match_one_pass():
+    rng = np.random.default_rng(1)
+    current = rng.normal(1e-9, 1e-11, 5000)
+    current[rng.integers(0, 5000, 20)] = 1e-7
+    whole = filter_current(current, 4, 3.0, savgol_window=11)
+    blocks = filter_current(current, 4, 3.0, savgol_window=11, block_size=700)
+    np.testing.assert_allclose(blocks[0], whole[0])
+    np.testing.assert_array_equal(blocks[1], whole[1])
+
+
+def drifting_trace(n, drift, seed=0):
+    """Pulse on a known baseline drift, with spikes and a NaN in the dark samples."""
+    rng = np.random.default_rng(seed)
+    time = np.linspace(0, 10, n)
+    baseline = drift(time)
+    current = baseline + rng.normal(0, 1e-12, n)
+    dark = (time < 3) | (time > 7)
+    current[~dark] += 1e-8
+    current[rng.choice(np.flatnonzero(dark), 10, replace=False)] += 1e-9
+    current[np.flatnonzero(dark)[5]] = np.nan
+    return time, current, dark, baseline
+
+
+def test_fit_baselines_recovers_drift_despite_spikes():
+    linear = drifting_trace(1000, lambda time: 1e-10 + 2e-11 * time)
+    quadratic = drifting_trace(600, lambda time: 5e-11 + 1e-12 * (time - 4) ** 2, seed=1)
+    times, currents, dark_masks, _ = zip(linear, quadratic)
+    for degree in (1, 2):
+        baselines = fit_baselines(list(times), list(currents), list(dark_masks), degree=degree)
+        assert [len(baseline) for baseline in baselines] == [1000, 600]
+        np.testing.assert_allclose(baselines[0], linear[3], atol=5e-13)
+        if degree == 2:
+            np.testing.assert_allclose(baselines[1], quadratic[3], atol=5e-13)
+
+
+def test_fit_baselines_needs_enough_dark_samples():
+    time, current, dark, baseline = drifting_trace(200, lambda time: 1e-10 + 2e-11 * time)
+    few_dark = np.zeros_like(dark)
+    few_dark[:2] = True
+    baselines = fit_baselines([time, time], [current, current], [dark, few_dark], degree=2)
+    np.testing.assert_allclose(baselines[0], baseline, atol=5e-13)
+    assert np.isnan(baselines[1]).all()
+    assert fit_baselines([], [], []) == []
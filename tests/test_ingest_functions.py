@@ -0,0 +1,37 @@
+import os
+import pytest
+from ingest_functions import data_root_path
+
+
+@pytest.fixture
+def data_root(tmp_path):
+    root = tmp_path / "data"
+    (root / "run1").mkdir(parents=True)
+    (tmp_path / "outside").mkdir()
+    return root
+
+
+def test_data_root_path_accepts_relative_path(data_root):
+    assert data_root_path("run1", str(data_root)) == os.path.realpath(data_root / "run1")
+    assert data_root_path(".", str(data_root)) == os.path.realpath(data_root)
+
+
+def test_data_root_path_accepts_absolute_path_inside(data_root):
+    assert data_root_path(str(data_root / "run1"), str(data_root)) == os.path.realpath(data_root / "run1")
+
+
+@pytest.mark.parametrize("path", ["..", "../outside", "run1/../../outside", "../data_other"])
+def test_data_root_path_rejects_parent_escape(data_root, path):
+    with pytest.raises(ValueError, match="outside the data folder"):
+        data_root_path(path, str(data_root))
+
+
+def test_data_root_path_rejects_absolute_path_outside(data_root, tmp_path):
+    with pytest.raises(ValueError, match="outside the data folder"):
+        data_root_path(str(tmp_path / "outside"), str(data_root))
+
+
+def test_data_root_path_rejects_symlink_out_of_root(data_root, tmp_path):
+    os.symlink(tmp_path / "outside", data_root / "link")
+    with pytest.raises(ValueError, match="outside the data folder"):
+        data_root_path("link", str(data_root))
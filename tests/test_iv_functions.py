@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from iv_functions import (CONDUCTION_REGIMES, classify_conduction_regime, log_log_slope_with_uncertainty,
+                          parse_region_edges, resample_iv_curves, segment_power_law, stack_iv_curves,
+                          weighted_fit_rows, weighted_power_law_fit)
+
+
+def sweep(voltage, current, current_std=None):
+    df = pd.DataFrame({"Voltage (V)": voltage, "Current (A)": current})
+    if current_std is not None:
+        df["Current Std (A)"] = current_std
+    return df
+
+
+@pytest.mark.parametrize("text, edges", [
+    ("1, 10, 100, 1000", [1.0, 10.0, 100.0, 1000.0]),
+    ("1,10,", [1.0, 10.0]),
+    (" 1 ,, 10 ", [1.0, 10.0]),
+])
+def test_parse_region_edges(text, edges):
+    assert parse_region_edges(text) == edges
+
+
+@pytest.mark.parametrize("text", ["", "5", "1,x", "10,1", "1,1,10", "0,10", "-1,10", "1,nan"])
+def test_parse_region_edges_rejects(text):
+    with pytest.raises(ValueError):
+        parse_region_edges(text)
+
+
+def test_stack_aligns_curves_and_averages_repeated_voltages():
+    up_down = sweep([1, 10, 100, 10, 1], [1.0, 2.0, 3.0, 4.0, 5.0], [0.3, 0.4, 0.5, 0.3, 0.4])
+    other = sweep([10.000000001, 1000, -10], [7.0, 8.0, 9.0], [0.1, 0.1, 0.1])
+    voltage_grid, stacked = stack_iv_curves([up_down, other])
+    np.testing.assert_allclose(voltage_grid, [1, 10, 100, 1000])
+    np.testing.assert_allclose(stacked["Current (A)"], [[3.0, 3.0, 3.0, np.nan], [np.nan, 7.0, np.nan, 8.0]])
+    np.testing.assert_allclose(stacked["Current Std (A)"][0], [0.25, 0.25, 0.5, np.nan])
+
+
+def test_log_log_slope_of_power_law():
+    voltage = np.logspace(0, 3, 20)
+    current = 1e-12 * voltage ** 2
+    slope, slope_err = log_log_slope_with_uncertainty(voltage, current, current * 0.01)
+    np.testing.assert_allclose(slope, 2.0)
+    assert np.all(slope_err > 0)
+
+
+@pytest.mark.parametrize("n_points", [0, 1])
+def test_log_log_slope_needs_two_points(n_points):
+    slope, slope_err = log_log_slope_with_uncertainty(np.ones(n_points), np.ones(n_points), np.ones(n_points))
+    assert slope.shape == slope_err.shape == (n_points,)
+    assert np.isnan(slope).all() and np.isnan(slope_err).all()
+
+
+def test_weighted_fit_per_region():
+    voltage = np.logspace(0, 3, 31)
+    current = np.where(voltage < 10, 1e-12 * voltage, 1e-13 * voltage ** 2)
+    voltage_grid, stacked = stack_iv_curves([sweep(voltage, current, current * 0.01)])
+    edges = [1, 10, 1000]
+    fit_stats = weighted_power_law_fit(voltage_grid, stacked["Current (A)"], stacked["Current Std (A)"], edges)
+    np.testing.assert_allclose(fit_stats['slope'][0], [1.0, 2.0])
+
+    rows = weighted_fit_rows(fit_stats, ["curve"], edges, "V ≥ 0")
+    assert [row['Region (|V|)'] for row in rows] == ["1-10", "10-1000"]
+    assert [row['Exponent'] for row in rows] == [1.0, 2.0]
+
+
+def test_weighted_fit_counts_edge_points_once():
+    voltage_grid = np.array([1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0])
+    current = 1e-12 * voltage_grid[np.newaxis, :]
+    fit_stats = weighted_power_law_fit(voltage_grid, current, current * 0.01, [1, 10, 100])
+    # 10 V opens the second region; the last region keeps its upper edge, 100 V
+    np.testing.assert_array_equal(fit_stats['n_points'][0], [3, 4])
+
+
+def test_resample_keeps_sweep_ending_just_below_grid_point():
+    voltage = np.array([10.0, 100.0, 1000 * (1 - 1e-12)])
+    current = 1e-12 * voltage ** 2
+    resampled = resample_iv_curves([sweep(voltage, current)], [10.0, 100.0, 1000.0, 1001.0])
+    np.testing.assert_allclose(resampled[0, :3], [1e-10, 1e-8, 1e-6])
+    assert np.isnan(resampled[0, 3])
+
+
+def ohmic_then_sclc(voltage):
+    # Slope 1 below 10 V and slope 2 above, continuous at 10 V
+    return np.where(voltage < 10, 1e-12 * voltage, 1e-13 * voltage ** 2)
+
+
+def test_segment_power_law_finds_known_slopes_and_change_voltage():
+    voltage_grid = np.logspace(0, 3, 31)
+    segments, = segment_power_law(voltage_grid, ohmic_then_sclc(voltage_grid)[np.newaxis, :])
+    assert [segment['regime'] for segment in segments] == ["ohmic", "SCLC"]
+    np.testing.assert_allclose([segment['slope'] for segment in segments], [1.0, 2.0], atol=1e-9)
+    np.testing.assert_allclose([segment['intercept'] for segment in segments], [-12.0, -13.0], atol=1e-9)
+    assert segments[0]['start_voltage'] == voltage_grid[0] and segments[1]['end_voltage'] == voltage_grid[-1]
+    # 10 V lies on both lines, so it may close the first segment or open the second
+    assert 10 ** 0.9 <= segments[0]['end_voltage'] <= 10 and 10 <= segments[1]['start_voltage'] <= 10 ** 1.1
+    assert segments[0]['n_points'] + segments[1]['n_points'] == len(voltage_grid)
+
+
+def test_segment_power_law_ignores_nan_gaps():
+    voltage_grid = np.logspace(0, 3, 31)
+    current = np.tile(ohmic_then_sclc(voltage_grid), (3, 1))
+    current[0, [0, 5, 6, 25, 30]] = np.nan
+    current[1] = 1e-12 * voltage_grid
+    current[1, 10:20] = np.nan
+    current[2] = np.nan
+    segments = segment_power_law(voltage_grid, current)
+    np.testing.assert_allclose([segment['slope'] for segment in segments[0]], [1.0, 2.0], atol=1e-9)
+    assert segments[0][0]['start_voltage'] == voltage_grid[1] and segments[0][-1]['end_voltage'] == voltage_grid[29]
+    assert sum(segment['n_points'] for segment in segments[0]) == 26
+    assert len(segments[1]) == 1 and segments[1][0]['n_points'] == 21
+    np.testing.assert_allclose(segments[1][0]['slope'], 1.0)
+    assert segments[2] == []
+
+
+@pytest.mark.parametrize("slope, regime", [
+    (0.2, "saturated"), (1.0, "ohmic"), (2.0, "SCLC"), (5.0, "trap-limited"), (20.0, "breakdown"),
+])
+def test_classify_conduction_regime(slope, regime):
+    assert classify_conduction_regime(slope) == regime
+
+
+def test_conduction_regime_bounds_are_exclusive():
+    # Each bound opens the next regime
+    for (upper_slope, _), (_, next_regime) in zip(CONDUCTION_REGIMES, CONDUCTION_REGIMES[1:]):
+        assert classify_conduction_regime(upper_slope) == next_regime
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import pandas as pd
+from live_functions import RingBuffer, TailReader
+from pulse_functions import OnsetTracker, find_threshold_crossings
+
+HEADER = "#Parameters:\n#\tDevice ID: D1\n#\tStart Time (Unix s): {start}\n#Data:\nTime (s),Current (A)\n"
+
+
+def write(path, text, mode="w"):
+    with open(path, mode) as file:
+        file.write(text)
+
+
+def test_tail_reader_reads_only_new_complete_lines(tmp_path):
+    path = tmp_path / "I-t_run.csv"
+    write(path, HEADER.format(start=100) + "0.0,1e-9\n0.1,2e-9\n0.2,3")
+    reader = TailReader(path)
+    df = reader.read_new()
+    assert list(df.columns) == ["Time (s)", "Current (A)"]
+    assert df["Time (s)"].tolist() == [0.0, 0.1]
+    assert reader.metadata["Device ID"] == "D1"
+
+    write(path, "e-9\n0.3,4e-9\n", mode="a")
+    assert reader.read_new()["Current (A)"].tolist() == [3e-9, 4e-9]
+    assert reader.read_new().empty
+    assert reader.generation == 0
+
+
+def test_tail_reader_restarts_on_truncation(tmp_path):
+    path = tmp_path / "I-t_run.csv"
+    write(path, HEADER.format(start=100) + "".join(f"{i},1e-9\n" for i in range(50)))
+    reader = TailReader(path)
+    assert len(reader.read_new()) == 50
+
+    write(path, HEADER.format(start=200) + "0,5e-9\n")
+    df = reader.read_new()
+    assert reader.generation == 1
+    assert df["Current (A)"].tolist() == [5e-9]
+    assert reader.metadata["Start Time (Unix s)"] == "200"
+
+
+def test_tail_reader_restarts_on_larger_replacement(tmp_path):
+    path = tmp_path / "I-t_run.csv"
+    write(path, HEADER.format(start=100) + "0,1e-9\n")
+    reader = TailReader(path)
+    reader.read_new()
+
+    # A new run, written under a temporary name and moved over the old file, already longer
+    replacement = tmp_path / "new.csv"
+    write(replacement, HEADER.format(start=200) + "".join(f"{i},2e-9\n" for i in range(10)))
+    os.replace(replacement, path)
+    df = reader.read_new()
+    assert reader.generation == 1
+    assert len(df) == 10
+    assert reader.metadata["Start Time (Unix s)"] == "200"
+
+
+def test_tail_reader_lag(tmp_path):
+    path = tmp_path / "I-t_run.csv"
+    write(path, HEADER.format(start=100) + "0,1e-9\n2.5,1e-9\n")
+    reader = TailReader(path)
+    assert reader.lag() is None
+    reader.read_new()
+    assert reader.lag() == reader.read_time - 100 - 2.5
+
+
+def rows(start, stop):
+    time = np.arange(start, stop, dtype=float)
+    return pd.DataFrame({"Time (s)": time, "Current (A)": time * 1e-9})
+
+
+def test_ring_buffer_keeps_newest_rows():
+    buffer = RingBuffer(capacity=5)
+    for start in (0, 3, 6):
+        buffer.append(rows(start, start + 3))
+    assert buffer.to_frame()["Time (s)"].tolist() == [4.0, 5.0, 6.0, 7.0, 8.0]
+    assert buffer.n_total == 9
+
+    buffer.append(rows(9, 21))  # more rows than the capacity at once
+    assert buffer.to_frame()["Time (s)"].tolist() == [16.0, 17.0, 18.0, 19.0, 20.0]
+
+
+def test_threshold_crossings_interpolate_and_ignore_noise():
+    time = np.arange(12, dtype=float)
+    # Rising through 1.0 between samples 1 and 2, noise dipping to 0.8 (above the 0.5
+    # release level), then a real second pulse after falling to 0
+    current = np.array([0, 0.5, 1.5, 2, 0.8, 1.2, 2, 0, 0, 3, 3, 0])
+    crossings = find_threshold_crossings(time, current, threshold=1.0, hysteresis=0.5)
+    np.testing.assert_allclose(crossings, [1.5, 8 + 1 / 3])
+
+
+def test_threshold_crossings_without_crossing():
+    assert len(find_threshold_crossings(np.arange(5.0), np.full(5, 2.0), threshold=1.0)) == 0
+    assert len(find_threshold_crossings(np.arange(5.0), np.zeros(5), threshold=1.0)) == 0
+
+
+def test_onset_tracker_matches_whole_trace():
+    rng = np.random.default_rng(0)
+    time = np.arange(5000) * 1e-3
+    current = np.where((time % 1.0) < 0.3, 5e-6, 1e-9) + rng.normal(0, 2e-7, len(time))
+    tracker = OnsetTracker(threshold=2e-6, holdoff=0.05)
+    for start in range(0, len(time), 137):
+        tracker.update(time[start:start + 137], current[start:start + 137])
+    np.testing.assert_allclose(tracker.onsets, find_threshold_crossings(time, current, 2e-6))
+    assert len(tracker.onsets) == 4  # the trace starts inside the first pulse
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pulse_functions import average_pulses, xcorr_edge_times
+
+
+def step_trace(edge_time, height, time_step=1e-3, duration=1.0, seed=0):
+    time = np.arange(0, duration, time_step)
+    noise = np.random.default_rng(seed).normal(0, 1e-3 * height, len(time)) if height else 0.0
+    return time, np.where(time >= edge_time, height, 0.0) + noise
+
+
+def test_xcorr_recovers_known_shift():
+    traces = [step_trace(0.3, 1e-9), step_trace(0.4235, 5e-9, seed=1), step_trace(0.6, 2e-10, seed=2)]
+    edge_times, scores = xcorr_edge_times(traces)
+    np.testing.assert_allclose(edge_times, [0.3, 0.4235, 0.6], atol=1e-3)
+    assert np.all(scores > 0.9)
+
+
+def test_xcorr_skips_flat_first_trace():
+    traces = [step_trace(0.3, 0.0), step_trace(0.3, 1e-9), step_trace(0.5, 1e-9, seed=1)]
+    edge_times, scores = xcorr_edge_times(traces)
+    assert np.isnan(edge_times[0]) and np.isnan(scores[0])
+    np.testing.assert_allclose(edge_times[1:], [0.3, 0.5], atol=1e-3)
+
+
+def test_xcorr_all_flat_traces_have_no_edge():
+    edge_times, scores = xcorr_edge_times([step_trace(0.3, 0.0), step_trace(0.5, 0.0)])
+    assert np.isnan(edge_times).all() and np.isnan(scores).all()
+
+
+def pulse_train(n_pulses=12, period=0.5, width=0.2, time_step=1e-3, seed=0):
+    """Noisy LED pulse train with slightly jittered onsets, as one DataFrame."""
+    rng = np.random.default_rng(seed)
+    time = np.arange(0, (n_pulses + 1) * period, time_step)
+    onsets = period * (np.arange(n_pulses) + 0.5) + rng.uniform(0, time_step, n_pulses)
+    lit = ((time[:, np.newaxis] >= onsets) & (time[:, np.newaxis] < onsets + width)).any(axis=1)
+    current = np.where(lit, 1e-7, 1e-9) + rng.normal(0, 1e-9, len(time))
+    return pd.DataFrame({"Time (s)": time, "Current (A)": current})
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100, 499, 1000])
+@pytest.mark.parametrize("pre_time, n_expected", [(0.1, 12), (0.3, 11)])
+def test_average_pulses_is_independent_of_chunking(tmp_path, chunk_size, pre_time, n_expected):
+    df = pulse_train()
+    csv_file = tmp_path / "pulses.csv"
+    df.to_csv(csv_file, index=False)
+    # With a 0.3 s pre-trigger window the first pulse starts too early and is skipped
+    settings = dict(threshold=5e-8, pre_time=pre_time, post_time=0.3, time_step=1e-3)
+
+    single_pass, n_single = average_pulses([df], **settings)
+    chunked, n_chunked = average_pulses(pd.read_csv(csv_file, chunksize=chunk_size), **settings)
+    assert n_single == n_chunked == n_expected
+    pd.testing.assert_frame_equal(chunked, single_pass, rtol=1e-12)
+
+
+def test_average_pulses_recovers_pulse_shape():
+    averaged, n_pulses = average_pulses([pulse_train()], threshold=5e-8, pre_time=0.1, post_time=0.3, time_step=1e-3)
+    assert n_pulses == 12
+    time = averaged["Time (s)"].to_numpy() - 0.1
+    current = averaged["Current (A)"].to_numpy()
+    np.testing.assert_allclose(current[(time > 0.01) & (time < 0.19)], 1e-7, rtol=0.02)
+    np.testing.assert_allclose(current[(time < -0.01) | (time > 0.21)], 1e-9, atol=1e-9)
@@ -0,0 +1,59 @@
+import numpy as np
+from result_cache_functions import ResultCache, code_version, result_key
+
+
+def test_round_trip_as_json(tmp_path):
+    cache = ResultCache(tmp_path / "results.sqlite")
+    fit = {'popt': np.array([1.0, -2.5, 3e-8]), 'tau': np.float64(0.25), 'n_resamples': np.int64(500)}
+    cache.put("fit", fit)
+    cache.put("stats", ({'difference': 1e-9}, None))
+    assert cache.get("fit") == {'popt': [1.0, -2.5, 3e-8], 'tau': 0.25, 'n_resamples': 500}
+    assert cache.get("stats") == [{'difference': 1e-9}, None]
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_undecodable_entries_are_misses(tmp_path):
+    cache = ResultCache(tmp_path / "results.sqlite")
+    cache.put("key", 1.0)
+    with cache._connect() as connection:
+        connection.execute("UPDATE results SET value = ? WHERE key = 'key'", (b"\x80\x05pickled",))
+    assert cache.get("key") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "results.sqlite", max_bytes=10_000)
+    value = "x" * 998  # 1000 bytes of JSON
+    for i in range(8):
+        cache.put(f"key{i}", value)
+    cache.get("key0")  # used again, so it outlives the newer key1
+    for i in range(8, 12):
+        cache.put(f"key{i}", value)
+
+    info = cache.info()
+    assert info['bytes'] <= 10_000
+    assert info['results'] == 10
+    assert cache.get("key0") == value
+    assert cache.get("key1") is None
+    assert cache.get("key11") == value
+
+
+def test_unwritable_cache_is_a_no_op(tmp_path):
+    (tmp_path / "file").write_text("")
+    cache = ResultCache(tmp_path / "file" / "results.sqlite")
+    cache.put("key", 1.0)
+    assert cache.get_many(["key"]) == {}
+    assert cache.info()['results'] == 0
+
+
+def test_keys_depend_on_params_and_version(tmp_path):
+    key = result_key("digest", {'threshold': 2000, 'margins': (0, 0)}, "v1")
+    assert key == result_key("digest", {'margins': (0, 0), 'threshold': 2000}, "v1")
+    assert key != result_key("digest", {'threshold': 2001, 'margins': (0, 0)}, "v1")
+    assert key != result_key("digest", {'threshold': 2000, 'margins': (0, 0)}, "v2")
+
+    source = tmp_path / "analysis.py"
+    source.write_text("A = 1\n")
+    version = code_version(source)
+    source.write_text("A = 22\n")
+    assert code_version(source) != version
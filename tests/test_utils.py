@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils import detect_pulse_edges, mean_shift_gain
+
+
+def pulse_trace(start, end, n=1000, height=1e-7, noise=1e-9, seed=0):
+    """Dark current with one pulse from sample start to sample end inclusive."""
+    current = np.random.default_rng(seed).normal(1e-9, noise, n)
+    current[start:end + 1] += height
+    return pd.DataFrame({"Time (s)": np.arange(n) * 1e-3, "Current (A)": current})
+
+
+def test_mean_shift_gain_matches_direct_split():
+    current = np.random.default_rng(0).normal(size=50)
+    total = ((current - current.mean()) ** 2).sum()
+    direct = [total - ((current[:k] - current[:k].mean()) ** 2).sum() - ((current[k:] - current[k:].mean()) ** 2).sum()
+              for k in range(1, len(current))]
+    np.testing.assert_allclose(mean_shift_gain(current), direct)
+
+
+@pytest.mark.parametrize("start, end", [(300, 699), (100, 900), (600, 650), (20, 979)])
+def test_detect_pulse_edges_finds_known_indices(start, end):
+    edges = detect_pulse_edges(pulse_trace(start, end))
+    assert edges['start_index'] == start and edges['end_index'] == end
+    assert edges['start_ci'][0] <= start <= edges['start_ci'][1]
+    assert edges['end_ci'][0] <= end <= edges['end_ci'][1]
+    assert edges['start_snr'] > 50 and edges['end_snr'] > 50
+
+
+def test_detect_pulse_edges_ignores_isolated_spikes():
+    df = pulse_trace(300, 699)
+    df.loc[[100, 850], "Current (A)"] += 5e-7
+    edges = detect_pulse_edges(df)
+    assert edges['start_index'] == 300 and edges['end_index'] == 699
+
+
+def test_detect_pulse_edges_without_falling_edge():
+    edges = detect_pulse_edges(pulse_trace(400, 999))
+    assert edges['start_index'] == 400
+    assert edges['end_snr'] < edges['start_snr'] / 10
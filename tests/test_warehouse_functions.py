@@ -0,0 +1,86 @@
+import datetime
+import os
+import pytest
+from warehouse_functions import (_compact_partition, append_results, compact_results, params_sets, query_results,
+                                 result_row, rollup_table, trend_table)
+
+REFERENCE = {'threshold': 2000, 'percent_drop': 0.98}
+
+
+def row(digest, leakage, params=REFERENCE, version="v1", day=18, treatment="CdS", guard_ring=True):
+    metadata = {"Surface Treatment": treatment, "Guard Ring": guard_ring, "Device ID": "D1"}
+    return result_row("I-t", f"I-t_{digest}_2025-03-{day:02d}_1.csv", "", digest, metadata,
+                      params=params, version=version, leakage_current=leakage)
+
+
+def parquet_files(path):
+    return [os.path.join(directory, name) for directory, _, names in os.walk(path)
+            for name in names if name.endswith(".parquet") and "_rollups" not in directory]
+
+
+def test_row_partitions_and_date():
+    result = row("a", 1e-9)
+    assert result['month'] == "2025-03"
+    assert result['measured_at'] == datetime.datetime(2025, 3, 18)
+    assert (result['surface_treatment'], result['guard_ring']) == ("CdS", "True")
+
+
+def test_append_skips_rows_already_stored(tmp_path):
+    assert append_results([row("a", 1e-9), row("b", 2e-9)], path=tmp_path) == 2
+    assert append_results([row("a", 1e-9), row("b", 2e-9)], path=tmp_path) == 0
+    assert append_results([row("a", 1.5e-9, version="v2"), row("c", 3e-9)], path=tmp_path) == 2
+    assert len(query_results(path=tmp_path, latest=False)) == 4
+
+    # The newest analysis of a file and params is the one returned
+    df = query_results(columns=["digest", "leakage_current"], path=tmp_path).sort_values("digest")
+    assert df["leakage_current"].tolist() == [1.5e-9, 2e-9, 3e-9]
+
+
+def test_results_of_other_params_are_kept_apart(tmp_path):
+    other = dict(REFERENCE, threshold=1500)
+    append_results([row("a", 1e-9), row("b", 2e-9)], path=tmp_path)
+    append_results([row("a", 9e-9, params=other)], path=tmp_path)
+
+    sets = params_sets("I-t", path=tmp_path)
+    assert sets["files"].tolist() == [2, 1]
+    reference = sets["params"].iloc[0]
+    df = query_results(columns=["digest", "leakage_current"], params=reference, path=tmp_path)
+    assert sorted(df["leakage_current"]) == [1e-9, 2e-9]
+    assert len(query_results(path=tmp_path)) == 3
+
+    trend = trend_table("leakage_current", freq="W", params=reference, path=tmp_path)
+    assert trend["count"].tolist() == [2]
+    assert trend["p50"].iloc[0] == pytest.approx(1.5e-9)
+    assert rollup_table("leakage_current", "W", params=reference, path=tmp_path)["count"].tolist() == [2]
+
+
+def test_compaction_merges_files_and_keeps_latest_rows(tmp_path):
+    for i in range(3):
+        append_results([row("a", [1e-9, 2e-9, 3e-9][i], version=f"v{i}")], path=tmp_path, max_files=10)
+    files = parquet_files(tmp_path)
+    assert len(files) == 3
+
+    _compact_partition(os.path.dirname(files[0]))
+    assert len(parquet_files(tmp_path)) == 1
+    df = query_results(path=tmp_path, latest=False)
+    assert df["leakage_current"].tolist() == [3e-9]
+
+
+def test_append_compacts_partitions_with_too_many_files(tmp_path):
+    for i in range(5):
+        append_results([row(f"d{i}", 1e-9), row(f"e{i}", 1e-9, treatment="TiO2")], path=tmp_path, max_files=4)
+    assert len(parquet_files(tmp_path)) == 2
+    assert len(query_results(path=tmp_path, latest=False)) == 10
+    assert compact_results(tmp_path) == 0
+
+
+def test_rollup_on_read_only_warehouse(tmp_path, monkeypatch):
+    append_results([row("a", 1e-9), row("b", 2e-9)], path=tmp_path)
+
+    def read_only(*args, **kwargs):
+        raise PermissionError("read-only file system")
+
+    monkeypatch.setattr(os, "makedirs", read_only)
+    trend = rollup_table("leakage_current", "W", path=tmp_path)
+    assert trend["count"].tolist() == [2]
+    assert not os.path.exists(tmp_path / "_rollups")
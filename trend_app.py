@@ -0,0 +1,239 @@
+import json
+import streamlit as st
+import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+from utils import get_colors
+from profiling import start_profiler, show_profile
+from ingest_functions import file_digest, measurement_cache, read_measurement, resolve_source
+from warehouse_functions import (WAREHOUSE_PATH, METRIC_TYPES, params_sets, query_results, rollup_table,
+                                 warehouse_stamp)
+
+st.set_page_config(layout="wide")
+profiler = start_profiler("trend_app")
+
+# Set page title
+st.title("Results Trends")
+st.caption("Created by: John Feng")
+
+METRIC_LABELS = {
+    "leakage_current": "Leakage current (A)",
+    "afterglow_time": "Afterglow time (s)",
+    "dark_current_1000V": "Dark current at 1000 V (A)",
+}
+GROUPINGS = {
+    "Surface Treatment + Guard Ring": ("surface_treatment", "guard_ring"),
+    "Surface Treatment": ("surface_treatment",),
+    "Guard Ring": ("guard_ring",),
+}
+
+# The warehouse is a server setting (RESULTS_WAREHOUSE_PATH), never a browser input: its
+# rows name the files the drill down reads
+warehouse_path = WAREHOUSE_PATH
+
+with st.sidebar:
+    st.caption(f"Results warehouse: {warehouse_path}, filled by the I-t and I-V pages with every analysed file")
+    rollup = st.radio("Rollup", options=["Daily", "Weekly"], index=1, horizontal=True)
+    freq = {"Daily": "D", "Weekly": "W"}[rollup]
+    grouping = st.selectbox("Group by", list(GROUPINGS), index=0)
+    metrics = st.multiselect("Metrics", list(METRIC_LABELS), default=list(METRIC_LABELS), format_func=METRIC_LABELS.get)
+    show_band = st.checkbox("P10-P90 band", value=True)
+    log_y = st.checkbox("Log y-axis", value=False)
+    plot_height = st.slider("Plot height", min_value=200, max_value=1000, value=350, step=50)
+    color_scheme = st.selectbox("Color scheme", ["Plotly", "Set1", "Set2", "Set3", "D3", "G10", "T10"])
+by = GROUPINGS[grouping]
+
+
+# Keyed by the warehouse stamp, so reruns skip even the rollup file until new results arrive
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_params_sets(measurement_type, path, stamp):
+    return params_sets(measurement_type, path)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_rollup(metric, freq, by, params, path, stamp):
+    trend = rollup_table(metric, freq, by, params, path)
+    parts = [trend[column].astype(str) for column in by]
+    if "guard_ring" in by:
+        parts[-1] = "Guard-" + parts[-1]
+    trend["group"] = parts[0].str.cat(parts[1:], sep="_") if len(parts) > 1 else parts[0]
+    return trend
+
+
+if not metrics:
+    st.info("Select at least one metric")
+    show_profile(profiler)
+    st.stop()
+
+with profiler.stage("warehouse_stamp"):
+    stamp = warehouse_stamp(warehouse_path)
+
+
+def params_label(params, reference, files):
+    """Settings that differ from the most used set, with the number of files."""
+    if params == reference:
+        return f"Most used settings ({files} files)"
+    values, reference_values = json.loads(params), json.loads(reference)
+    changes = [f"{key}={value}" for key, value in values.items() if reference_values.get(key) != value]
+    return f"{', '.join(changes) or params} ({files} files)"
+
+
+# Files analysed with other settings have their own results, so trends show one settings
+# set per measurement type, the most used one unless another is selected
+selected_params = {}
+with st.sidebar:
+    for measurement_type in dict.fromkeys(METRIC_TYPES[metric] for metric in metrics):
+        with profiler.stage("params_sets"):
+            sets = cached_params_sets(measurement_type, warehouse_path, stamp)
+        if len(sets) > 1:
+            files = dict(zip(sets["params"], sets["files"]))
+            selected_params[measurement_type] = st.selectbox(
+                f"{measurement_type} analysis settings", list(files),
+                format_func=lambda params: params_label(params, sets["params"].iloc[0], files[params]),
+            )
+        elif len(sets):
+            selected_params[measurement_type] = sets["params"].iloc[0]
+with profiler.stage("read_rollups"):
+    rollups = {metric: cached_rollup(metric, freq, by, selected_params.get(METRIC_TYPES[metric]), warehouse_path, stamp)
+               for metric in metrics}
+if not any(len(trend) for trend in rollups.values()):
+    st.info("No results in the warehouse yet. Files analysed on the I-t and I-V pages are added to it.")
+    show_profile(profiler)
+    st.stop()
+
+all_periods = pd.concat([trend["period"] for trend in rollups.values()])
+all_groups = sorted(set().union(*[trend["group"] for trend in rollups.values()]))
+c1, c2 = st.columns(2)
+with c1:
+    date_range = st.date_input("Date range", value=(all_periods.min().date(), all_periods.max().date()))
+with c2:
+    groups = st.multiselect("Groups", all_groups, default=all_groups)
+start_date = pd.Timestamp(date_range[0])
+end_date = pd.Timestamp(date_range[-1])
+colors = get_colors(color_scheme, len(all_groups))
+group_colors = dict(zip(all_groups, colors))
+
+# One chart per metric: median per period and group, with the P10-P90 band. Clicking a
+# median point selects it for the drill down below
+selection = None
+for metric in metrics:
+    trend = rollups[metric]
+    trend = trend[(trend["period"] >= start_date) & (trend["period"] <= end_date) & trend["group"].isin(groups)]
+    fig = go.Figure()
+    median_traces = {}
+    for group, df_group in trend.groupby("group", sort=True):
+        color = group_colors[group]
+        if show_band:
+            fig.add_scatter(
+                x=pd.concat([df_group["period"], df_group["period"][::-1]]),
+                y=pd.concat([df_group["p90"], df_group["p10"][::-1]]),
+                fill="toself",
+                fillcolor=color,
+                opacity=0.2,
+                line=dict(width=0),
+                hoverinfo="skip",
+                legendgroup=group,
+                showlegend=False,
+            )
+        fig.add_scatter(
+            x=df_group["period"],
+            y=df_group["p50"],
+            mode="lines+markers",
+            name=group,
+            legendgroup=group,
+            line=dict(color=color),
+            marker=dict(color=color),
+            customdata=np.column_stack([df_group["count"], df_group["p10"], df_group["p90"]]),
+            hovertemplate="%{x|%Y-%m-%d}<br>median %{y:.3e}<br>P10 %{customdata[1]:.3e}, P90 %{customdata[2]:.3e}"
+                          "<br>%{customdata[0]} files<extra>" + group + "</extra>",
+        )
+        median_traces[len(fig.data) - 1] = group
+    fig.update_layout(
+        title=f"{METRIC_LABELS[metric]}, {rollup.lower()} median",
+        height=plot_height,
+        xaxis=dict(title="Measurement date", showgrid=True, gridcolor="lightgrey"),
+        yaxis=dict(title=METRIC_LABELS[metric], type="log" if log_y else "linear", showgrid=True,
+                   gridcolor="lightgrey", exponentformat="e"),
+    )
+    with profiler.stage("plotly_chart_trend"):
+        event = st.plotly_chart(fig, use_container_width=True, on_select="rerun", selection_mode="points",
+                                key=f"trend_{metric}")
+    for point in event.selection.points if event else []:
+        if point.get("curve_number") in median_traces:
+            selection = (metric, median_traces[point["curve_number"]], pd.Timestamp(point["x"]))
+
+# Drill down: the files of one period and group from the warehouse, and the raw trace of
+# one of them, read from its source file alone
+st.subheader("Drill down")
+if selection is not None:
+    st.session_state.trend_selection = selection
+selected_metric, selected_group, selected_period = st.session_state.get("trend_selection", (metrics[0], None, None))
+drill_metrics = [metric for metric in metrics if len(rollups[metric])]
+c1, c2, c3 = st.columns(3)
+with c1:
+    drill_metric = st.selectbox("Metric", drill_metrics, format_func=METRIC_LABELS.get,
+                                index=drill_metrics.index(selected_metric) if selected_metric in drill_metrics else 0)
+drill_rollup = rollups[drill_metric]
+drill_groups = sorted(drill_rollup["group"].unique())
+with c2:
+    drill_group = st.selectbox("Group", drill_groups,
+                               index=drill_groups.index(selected_group) if selected_group in drill_groups else 0)
+group_rollup = drill_rollup[drill_rollup["group"] == drill_group].sort_values("period", ascending=False)
+periods = list(group_rollup["period"])
+with c3:
+    drill_period = st.selectbox("Period", periods, format_func=lambda period: f"{period:%Y-%m-%d}",
+                                index=periods.index(selected_period) if selected_period in periods else 0)
+group_values = group_rollup.iloc[periods.index(drill_period)]
+
+with profiler.stage("query_period_files"):
+    period_files = query_results(
+        columns=["file_name", "device_id", "contact_id", "measured_at", drill_metric, "measurement_type", "source", "digest"],
+        start=drill_period,
+        end=pd.Period(drill_period, freq).end_time.normalize(),
+        surface_treatments=[group_values["surface_treatment"]] if "surface_treatment" in by else None,
+        guard_rings=[group_values["guard_ring"]] if "guard_ring" in by else None,
+        params=selected_params.get(METRIC_TYPES[drill_metric]),
+        path=warehouse_path,
+    )
+period_files = period_files.dropna(subset=[drill_metric]).sort_values(drill_metric).reset_index(drop=True)
+st.dataframe(period_files.drop(columns=["source", "digest"]), hide_index=True, use_container_width=True)
+if period_files.empty:
+    show_profile(profiler)
+    st.stop()
+
+file_idx = st.selectbox("File", range(len(period_files)),
+                        format_func=lambda idx: f"{period_files['file_name'][idx]} ({period_files[drill_metric][idx]:.3e})")
+file_row = period_files.iloc[file_idx]
+data_file = resolve_source(file_row["source"])
+with profiler.stage("read_measurement"):
+    if data_file is not None:
+        digest = file_digest(data_file)
+        df, metadata = read_measurement(data_file, digest)
+        if digest != file_row["digest"]:
+            st.warning(f"{file_row['file_name']} changed since it was analysed")
+    else:
+        # Uploaded files can only be shown while they are still in memory
+        cached = measurement_cache.get(file_row["digest"])
+        df, metadata = (cached[0].copy(), dict(cached[1])) if cached is not None else (None, None)
+if df is None:
+    st.warning(f"The raw data of {file_row['file_name']} is not available: it was uploaded, moved or deleted")
+    show_profile(profiler)
+    st.stop()
+
+fig_raw = go.Figure()
+if file_row["measurement_type"] == "I-V":
+    fig_raw.add_scatter(x=df["Voltage (V)"].abs(), y=df["Current (A)"].abs(), mode="markers+lines",
+                        name=file_row["file_name"])
+    fig_raw.update_xaxes(title="Absolute Voltage (V)", type="log")
+    fig_raw.update_yaxes(title="Absolute Current (A)", type="log", exponentformat="e")
+else:
+    fig_raw.add_scatter(x=df["Time (s)"], y=df["Current (A)"], mode="lines", name=file_row["file_name"])
+    fig_raw.update_xaxes(title="Time (s)")
+    fig_raw.update_yaxes(title="Current (A)", exponentformat="e")
+fig_raw.update_layout(title=file_row["file_name"], height=400)
+with profiler.stage("plotly_chart_raw"):
+    st.plotly_chart(fig_raw, use_container_width=True)
+with st.expander("Header parameters", expanded=False):
+    st.write(metadata)
+
+show_profile(profiler)
@@ -0,0 +1,5 @@
+import math
+
+
+def two_term_function(x, N_1, E1p, N_2, E2p):
+    return (N_1*1.3E-6*x)/(1.3E-6*x+math.exp(-E1p/0.025))-(N_2*math.exp(-E2p/0.025))/(1.3E-6*x+math.exp(-E2p/0.025))
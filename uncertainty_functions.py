@@ -0,0 +1,161 @@
+import os
+import time
+import pickle
+import threading
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+def residual_resamples(y_fit, residuals, n_resamples, rng):
+    """Build bootstrap data sets by adding resampled residuals to the fitted curve.
+    Returns an array of shape (n_resamples, len(y_fit)).
+    """
+    idx = rng.integers(0, len(residuals), size=(n_resamples, len(residuals)))
+    return y_fit[np.newaxis, :] + residuals[idx]
+
+
+def bootstrap_linear_fit(x, y, n_resamples=1000, time_budget=5.0, seed=None, chunk_size=2000):
+    """Residual bootstrap of the straight line y = slope * x + intercept.
+    The model is linear in its parameters, so every resample in a chunk is solved
+    with a single matrix product against the pseudo-inverse of the design matrix.
+    """
+    start_time = time.perf_counter()
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    design = np.column_stack([x, np.ones_like(x)])
+    design_pinv = np.linalg.pinv(design)
+    popt = design_pinv @ y
+    y_fit = design @ popt
+    residuals = y - y_fit
+
+    rng = np.random.default_rng(seed)
+    samples = []
+    n_done = 0
+    while n_done < n_resamples and time.perf_counter() - start_time < time_budget:
+        n_chunk = min(chunk_size, n_resamples - n_done)
+        y_resampled = residual_resamples(y_fit, residuals, n_chunk, rng)
+        samples.append((design_pinv @ y_resampled.T).T)
+        n_done += n_chunk
+
+    bootstrap_stats = {
+        'popt': popt,
+        'samples': np.vstack(samples) if samples else np.empty((0, 2)),
+        'n_resamples': n_done,
+        'n_failed': 0,
+        'elapsed': time.perf_counter() - start_time,
+    }
+    return bootstrap_stats
+
+
+def _refit_resamples(model, x, y_resampled, p0, bounds, maxfev):
+    """Refit the model to each row of y_resampled. Failed fits are left as NaN."""
+    from scipy.optimize import curve_fit
+    params = np.full((len(y_resampled), len(p0)), np.nan)
+    for i, y in enumerate(y_resampled):
+        try:
+            params[i], _ = curve_fit(model, x, y, p0=p0, bounds=bounds, maxfev=maxfev)
+        except (RuntimeError, ValueError):
+            pass
+    return params
+
+
+# One process pool for every bootstrap in this process (all sessions and reruns), created
+# on first use and replaced if a worker dies
+_pool = None
+_pool_lock = threading.Lock()
+CHUNK_SECONDS = 0.2  # target run time of one submitted chunk of refits
+
+
+def _process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or getattr(_pool, "_broken", False):
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _pool
+
+
+def bootstrap_curve_fit(model, x, y, popt, n_resamples=500, time_budget=5.0,
+                        bounds=(-np.inf, np.inf), maxfev=10000, seed=None, max_workers=None):
+    """Residual bootstrap of a nonlinear curve_fit model, spread across a shared process pool.
+
+    Resamples are refitted in chunks of about CHUNK_SECONDS, with at most one chunk per
+    worker in flight. A new chunk is only submitted if it can finish within the time
+    budget, and the chunks in flight are collected before returning, so no refits keep
+    running after the call. The model must be a module-level function so that it can be
+    sent to the worker processes.
+    """
+    start_time = time.perf_counter()
+    deadline = start_time + time_budget
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    popt = np.asarray(popt, dtype=float)
+    y_fit = model(x, *popt)
+    residuals = y - y_fit
+    rng = np.random.default_rng(seed)
+    n_workers = max_workers or os.cpu_count() or 1
+
+    # Time a single refit to size the chunks
+    samples = [_refit_resamples(model, x, residual_resamples(y_fit, residuals, 1, rng), popt, bounds, maxfev)]
+    time_per_fit = max(time.perf_counter() - start_time, 1e-6)
+    chunk_size = max(1, int(CHUNK_SECONDS / time_per_fit))
+    n_remaining = n_resamples - 1
+
+    def next_chunk():
+        nonlocal n_remaining
+        if n_remaining <= 0 or time.perf_counter() + chunk_size * time_per_fit > deadline:
+            return None
+        n_chunk = min(chunk_size, n_remaining)
+        n_remaining -= n_chunk
+        return residual_resamples(y_fit, residuals, n_chunk, rng)
+
+    try:
+        executor = _process_pool()
+        running = {}
+        while True:
+            while len(running) < n_workers:
+                chunk = next_chunk()
+                if chunk is None:
+                    break
+                future = executor.submit(_refit_resamples, model, x, chunk, popt, bounds, maxfev)
+                running[future] = (time.perf_counter(), len(chunk))
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                submitted, n_chunk = running.pop(future)
+                samples.append(future.result())
+                # Time queued behind other sessions' chunks counts too: it is what the budget sees
+                time_per_fit = (time.perf_counter() - submitted) / n_chunk
+    except (OSError, BrokenProcessPool, pickle.PicklingError, AttributeError, TypeError):
+        # No process pool available (or the model cannot be pickled): refit in this process
+        samples = samples[:1]
+        n_remaining = n_resamples - 1
+        chunk = next_chunk()
+        while chunk is not None:
+            samples.append(_refit_resamples(model, x, chunk, popt, bounds, maxfev))
+            chunk = next_chunk()
+
+    samples = np.vstack(samples)
+    n_failed = int(np.isnan(samples).any(axis=1).sum())
+    bootstrap_stats = {
+        'popt': popt,
+        'samples': samples,
+        'n_resamples': len(samples),
+        'n_failed': n_failed,
+        'elapsed': time.perf_counter() - start_time,
+    }
+    return bootstrap_stats
+
+
+def confidence_intervals(samples, names, confidence_level=0.95):
+    """Percentile confidence intervals for each column of the bootstrap samples.
+    Returns a dict mapping parameter name to (lower, upper).
+    """
+    samples = np.asarray(samples, dtype=float)
+    alpha = (1.0 - confidence_level) / 2.0
+    if len(samples) == 0 or np.isnan(samples).all():
+        return {name: (np.nan, np.nan) for name in names}
+    lower = np.nanpercentile(samples, 100 * alpha, axis=0)
+    upper = np.nanpercentile(samples, 100 * (1.0 - alpha), axis=0)
+    return {name: (lower[i], upper[i]) for i, name in enumerate(names)}
@@ -1,41 +1,51 @@
-import plotly.express as px
+from plotly.colors import qualitative, sequential
 import pandas as pd
 import numpy as np
 import os
-import streamlit as st
+import tarfile
+import zipfile
+from itertools import takewhile
+from iv_functions import log_log_slope_with_uncertainty
+from ingest_functions import (DATA_ROOT, 
+                              data_root_path, 
+                              file_digest, 
+                              find_duplicates, 
+                              is_archive, 
+                              list_archive, 
+                              parse_header, 
+                              prefetch_measurements)
 
 def get_colors(color_scheme, n_files=None):
     # qualitative color schemes
     if color_scheme == 'Plotly':
-        colors = px.colors.qualitative.Plotly
+        colors = qualitative.Plotly
     elif color_scheme == 'G10':
-        colors = px.colors.qualitative.G10
+        colors = qualitative.G10
     elif color_scheme == 'T10':
-        colors = px.colors.qualitative.T10
+        colors = qualitative.T10
     elif color_scheme == 'Set1':
-        colors = px.colors.qualitative.Set1
+        colors = qualitative.Set1
     elif color_scheme == 'Set2':
-        colors = px.colors.qualitative.Set2
+        colors = qualitative.Set2
     elif color_scheme == 'Set3':
-        colors = px.colors.qualitative.Set3
+        colors = qualitative.Set3
     elif color_scheme == 'Dark24':
-        colors = px.colors.qualitative.Dark24
+        colors = qualitative.Dark24
     # sequential color schemes
     elif color_scheme == 'Viridis':
-        colors = px.colors.sequential.Viridis
+        colors = sequential.Viridis
     elif color_scheme == 'Plasma':
-        colors = px.colors.sequential.Plasma
+        colors = sequential.Plasma
     elif color_scheme == 'Rainbow':
-        colors = px.colors.sequential.Rainbow
+        colors = sequential.Rainbow
     elif color_scheme == 'Turbo':
-        colors = px.colors.sequential.Turbo
+        colors = sequential.Turbo
     elif color_scheme == 'D3':
-        colors = px.colors.qualitative.D3
+        colors = qualitative.D3
     if n_files is None:
         return colors
-    if n_files > len(colors):
-        st.error(f"Number of files ({n_files}) exceeds the number of colors ({len(colors)})")
-    return colors[:n_files]
+    # more files than colors: cycle through the palette again
+    return [colors[i % len(colors)] for i in range(n_files)]
 
 def find_pulse_start(df: pd.DataFrame, pulse_start_current: float = 1e-7) -> tuple[int, float]:
     filter = df['Current (A)'] > pulse_start_current
@@ -60,17 +70,82 @@ def find_pulse_end(df: pd.DataFrame, threshold_current: float = 2e-6,
         return pulse_end_index, pulse_end_time
     else:
         return df.index[-1], df.loc[df.index[-1], 'Time (s)']
-    
+
+def mean_shift_gain(current: np.ndarray) -> np.ndarray:
+    """Drop in squared error from splitting the trace into two constant segments,
+    for every split position k = 1..n-1 (element k-1). O(n) from one cumulative sum.
+    """
+    n = len(current)
+    k = np.arange(1, n)
+    cumulative = np.cumsum(current)[:-1]
+    return (cumulative - k * current.sum() / n) ** 2 * n / (k * (n - k))
+
+def detect_pulse_edges(df: pd.DataFrame) -> dict:
+    """Change-point alternative to the threshold search for the pulse start and end.
+
+    The trace is split at the single mean shift that best explains it (binary segmentation,
+    O(n) per scan); that is either the rising or the falling edge, and the other edge is the
+    best split on the corresponding side. Noise is estimated from the median absolute first
+    difference, so isolated spikes barely move the edges. For each edge this reports the step
+    size in noise units (snr) and a 95% likelihood interval of split positions (ci_start,
+    ci_end) as a measure of confidence. Indices follow find_pulse_start/find_pulse_end: the
+    start is the first sample of the pulse, the end is its last sample.
+    """
+    current = df['Current (A)'].to_numpy(dtype=float)
+    n = len(current)
+    differences = np.diff(current)
+    sigma = 1.4826 * np.median(np.abs(differences - np.median(differences))) / np.sqrt(2)
+    sigma = sigma if sigma > 0 else np.finfo(float).tiny
+
+    def best_split(offset, segment):
+        gain = mean_shift_gain(segment)
+        best = int(np.argmax(gain))
+        # Splits whose log-likelihood is within 1.92 of the best (chi2 95% / 2)
+        in_interval = np.flatnonzero(gain >= gain[best] - 3.84 * sigma ** 2)
+        rising = segment[best + 1:].mean() > segment[:best + 1].mean()
+        return {
+            'split': offset + best + 1,
+            'rising': rising,
+            'snr': np.sqrt(gain[best]) / sigma,
+            'ci_start': offset + in_interval[0] + 1,
+            'ci_end': offset + in_interval[-1] + 1,
+        }
+
+    first = best_split(0, current)
+    if first['rising']:
+        rise = first
+        fall = best_split(rise['split'], current[rise['split']:]) if n - rise['split'] > 2 else None
+    else:
+        fall = first
+        rise = best_split(0, current[:fall['split']]) if fall['split'] > 2 else None
+
+    edges = {}
+    for name, edge, index_shift in [('start', rise, 0), ('end', fall, -1)]:
+        if edge is None:
+            edges.update({f'{name}_index': 0 if name == 'start' else n - 1,
+                          f'{name}_snr': 0.0, f'{name}_ci': (0, n - 1)})
+            continue
+        edges[f'{name}_index'] = edge['split'] + index_shift
+        edges[f'{name}_snr'] = edge['snr']
+        edges[f'{name}_ci'] = (edge['ci_start'] + index_shift, edge['ci_end'] + index_shift)
+    return edges
+
 def calculate_first_derivative(df: pd.DataFrame) -> pd.DataFrame:
     
     """
     Calculate the first derivative of a log-log plot of current vs voltage.
+    When the file has a `Current Std (A)` column, its uncertainty is propagated
+    into a `power_law_slope_err` column.
     """
     df['Abs Current (A)'] = df['Current (A)'].abs()
     df['Abs Voltage (V)'] = df['Voltage (V)'].abs()
     df['log10_current'] = np.log10(df['Abs Current (A)'])
     df['log10_voltage'] = np.log10(df['Abs Voltage (V)'])
     df['power_law_slope'] = np.gradient(df['log10_current'], df['log10_voltage'])
+    if 'Current Std (A)' in df:
+        _, df['power_law_slope_err'] = log_log_slope_with_uncertainty(
+            df['Voltage (V)'].to_numpy(), df['Current (A)'].to_numpy(), df['Current Std (A)'].to_numpy()
+        )
     return df
 
 def get_sample_data(measurement_type: str, folder_path: str):
@@ -94,8 +169,10 @@ def get_sample_data(measurement_type: str, folder_path: str):
         raise ValueError("Invalid measurement type")
 
 def data_extractor(measurement_type: str):
+    # imported here so that CLI tools using utils do not load streamlit
+    import streamlit as st
     data_source = st.radio(
-        "Choose data source", ["Upload CSV", "Load samples"], horizontal=True,
+        "Choose data source", ["Upload CSV", "Load samples", "Load archive"], horizontal=True,
         index=1
     )
     if measurement_type == "I-V":
@@ -106,42 +183,98 @@ def data_extractor(measurement_type: str):
         st.error("Invalid measurement type")
         st.stop()
     if data_source == "Load samples":
+        # Files with the same content as an earlier sample are flagged and left out by default
+        duplicates = find_duplicates(all_sample_files, [file_digest(file) for file in all_sample_files])
         selected_sample_files = st.multiselect(
-            "Select sample files", options=all_sample_files, default=all_sample_files,
+            "Select sample files", options=all_sample_files,
+            default=[file for file in all_sample_files if file not in duplicates],
+            format_func=lambda file: f"{file} (duplicate of {os.path.basename(duplicates[file])})"
+            if file in duplicates else file,
             label_visibility="visible", help="Select the sample file for analysis"
         )
         data_files = selected_sample_files
 
     elif data_source == "Upload CSV":
         uploaded_files = st.file_uploader(
-            "Upload CSV files", type=["csv"], accept_multiple_files=True
+            "Upload CSV files", type=["csv", "zip", "gz", "tgz"], accept_multiple_files=True,
+            help="CSV files, or .zip, .tar.gz and .csv.gz archives of them"
         )
         if uploaded_files:
             data_files = uploaded_files
         else:
             st.warning("Please upload CSV files to begin analysis")
             st.stop()
-    
+
+    elif data_source == "Load archive":
+        archive_paths = st.text_area("Archive paths", help=f"One .zip, .tar.gz or .csv.gz path per line, "
+                                                           f"inside {DATA_ROOT} (the DATA_ROOT setting)")
+        data_files = []
+        for path in archive_paths.splitlines():
+            if not path.strip():
+                continue
+            try:
+                data_files.append(data_root_path(path.strip()))
+            except ValueError as error:
+                st.error(str(error))
+        if not data_files:
+            st.warning("Please enter an archive path to begin analysis")
+            st.stop()
+
+    # Archives are listed by their headers only, so the metadata filter runs before anything is loaded
+    archives = [file for file in data_files if is_archive(getattr(file, "name", file))]
+    if archives:
+        members = []
+        for archive in archives:
+            try:
+                members += [member for member in list_archive(archive) if member.name.startswith(measurement_type)]
+            except (OSError, zipfile.BadZipFile, tarfile.TarError) as error:
+                st.error(f"Could not read {getattr(archive, 'name', archive)}: {error}")
+        data_files = [file for file in data_files if file not in archives] + filter_by_metadata(members)
+        if not data_files:
+            st.warning(f"No {measurement_type} files selected from the archives")
+            st.stop()
+
+    # Parse everything not seen before on a worker pool, the pages then read from the cache
+    with st.spinner(f"Reading {len(data_files)} files..."):
+        prefetch_measurements(data_files)
+
+    # Identical payloads are analysed once, whatever they are called
+    duplicates = find_duplicates(data_files, [file_digest(file) for file in data_files])
+    if duplicates:
+        st.info("Skipped files with the same content as another selected file: " + ", ".join(
+            f"{os.path.basename(getattr(file, 'name', file))} (= {os.path.basename(getattr(original, 'name', original))})"
+            for file, original in duplicates.items()
+        ))
+        data_files = [file for file in data_files if file not in duplicates]
+
     return data_source, data_files
 
+def filter_by_metadata(data_files, keys=("Surface Treatment", "Guard Ring", "Device ID", "Contact ID")):
+    """Narrow down archive members by the values of their header metadata."""
+    import streamlit as st
+    with st.expander(f"Filter archive contents ({len(data_files)} files)", expanded=False):
+        for key in keys:
+            values = sorted({data_file.metadata[key] for data_file in data_files if key in data_file.metadata})
+            if len(values) < 2:
+                continue
+            selected = st.multiselect(key, values, default=values, key=f"archive_filter_{key}")
+            data_files = [data_file for data_file in data_files if data_file.metadata.get(key) in selected]
+        st.caption(f"{len(data_files)} files selected")
+    return data_files
+
 def get_file_name(file_path: str) -> str:
     return file_path.split("\\")[-1].split(".")[0]
 
 def extract_filename(data_source, data_file):
-    if data_source == "Load samples":
+    if isinstance(data_file, str):
         file_name = data_file.split("/")[-1].split(".")[0]
-    elif data_source == "Upload CSV":
+    else:  # uploaded file or archive member
         file_name = data_file.name
     return file_name
 
 def extract_metadata(csv_file: str) -> dict:
-    metadata = {}
     with open(csv_file, 'r') as file:
-        for line in file:
-            if line.startswith("#"):
-                key, value = line.strip("#").split(":")
-                metadata[key.strip()] = value.strip()
-    return metadata
+        return parse_header(takewhile(lambda line: line.startswith("#"), file))
 
 if __name__ == "__main__":
     # csv_file = r"SAMPLES/TiO2/I-t/I-t_31AF25_guardedtest_5800mV10kR_guarded_centerpixel_10min_2025-03-18_1.csv"
@@ -0,0 +1,372 @@
+"""Per-file analysis results of every run, as a Parquet dataset partitioned by measurement
+month, surface treatment and guard ring, and queries for lot and trend tables over it.
+
+    python warehouse_functions.py --compact
+    python warehouse_functions.py --trend leakage_current --freq W
+    python warehouse_functions.py --rollups
+
+Pages append one row per analysed file and analysis settings (params); rows already stored
+for the same file, settings and code version are skipped. A file analysed with several
+settings has a row for each, so trends and rollups are always of one settings set. Opening a Parquet file costs a few ms, so the
+dataset is kept to few files: partitions are by month rather than by day (the measurement
+date is a column), and a partition is merged into one file once an append leaves it with
+more than APPEND_MAX_FILES files. --compact merges every partition.
+
+Rollups are trend tables of the whole dataset stored next to it, so a dashboard reads one
+small file instead of every result. They are recomputed on first use after the dataset
+changed; --rollups prebuilds all of them.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+WAREHOUSE_PATH = os.environ.get(
+    "RESULTS_WAREHOUSE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "RESULTS")
+)
+APPEND_MAX_FILES = 4
+PARTITION_SCHEMA = pa.schema([
+    ("month", pa.string()),
+    ("surface_treatment", pa.string()),
+    ("guard_ring", pa.string()),
+])
+FILE_SCHEMA = pa.schema([
+    ("measurement_type", pa.string()),
+    ("file_name", pa.string()),
+    ("source", pa.string()),  # ingest_functions.source_locator, "" for uploads
+    ("digest", pa.string()),
+    ("device_id", pa.string()),
+    ("contact_id", pa.string()),
+    ("measured_at", pa.timestamp("s")),
+    ("analysed_at", pa.timestamp("s")),
+    ("leakage_current", pa.float64()),
+    ("photocurrent_start", pa.float64()),
+    ("photocurrent_end", pa.float64()),
+    ("afterglow_time", pa.float64()),
+    ("leakage_current_corrected", pa.float64()),
+    ("afterglow_time_corrected", pa.float64()),
+    ("baseline_drift", pa.float64()),
+    ("dark_current_1000V", pa.float64()),
+    ("params", pa.string()),  # JSON of the analysis settings
+    ("code_version", pa.string()),  # result_cache_functions.code_version of the analysis
+])
+RESULT_SCHEMA = pa.schema([*FILE_SCHEMA, *PARTITION_SCHEMA])
+METRICS = ("leakage_current", "afterglow_time", "dark_current_1000V")
+METRIC_TYPES = {"leakage_current": "I-t", "afterglow_time": "I-t", "dark_current_1000V": "I-V"}
+ROLLUP_FREQS = ("D", "W")
+ROLLUP_GROUPS = (("surface_treatment", "guard_ring"), ("surface_treatment",), ("guard_ring",))
+ROLLUP_DIR = "_rollups"  # dataset discovery skips names starting with _ or .
+
+
+def measurement_date(file_name, metadata) -> datetime.date:
+    """Date a file was measured: the YYYY-MM-DD in its name, else a Date header, else today."""
+    for text in (file_name, metadata.get("Date", ""), metadata.get("Start Time", "")):
+        match = re.search(r"(\d{4})-(\d{2})-(\d{2})", str(text))
+        if match:
+            try:
+                return datetime.date(*map(int, match.groups()))
+            except ValueError:
+                pass
+    return datetime.date.today()
+
+
+def params_json(params):
+    """The params column value of a dict of analysis settings."""
+    return json.dumps(params, sort_keys=True, default=str) if params is not None else None
+
+
+def result_row(measurement_type, file_name, source, digest, metadata, params=None, version=None, **metrics) -> dict:
+    """One warehouse row for one analysed file. metrics are RESULT_SCHEMA float columns,
+    e.g. leakage_current=..., afterglow_time=...; missing ones are left null."""
+    measured = measurement_date(file_name, metadata)
+    row = {
+        'measurement_type': measurement_type,
+        'file_name': file_name,
+        'source': source,
+        'digest': digest,
+        'device_id': str(metadata.get("Device ID", "")),
+        'contact_id': str(metadata.get("Contact ID", "")),
+        'measured_at': datetime.datetime.combine(measured, datetime.time()),
+        'analysed_at': datetime.datetime.now().replace(microsecond=0),
+        'params': params_json(params),
+        'code_version': version,
+        'month': measured.strftime("%Y-%m"),
+        'surface_treatment': str(metadata.get("Surface Treatment", "unknown")),
+        'guard_ring': str(metadata.get("Guard Ring", "unknown")),
+    }
+    for metric, value in metrics.items():
+        row[metric] = None if value is None else float(value)
+    return row
+
+
+def _latest(df) -> pd.DataFrame:
+    """Only the most recent row of every file analysed more than once with the same settings."""
+    return df.sort_values("analysed_at", kind="stable").drop_duplicates(
+        ["measurement_type", "digest", "params"], keep="last")
+
+
+def _stored_keys(rows, path=WAREHOUSE_PATH) -> set:
+    """(measurement_type, digest, params, code_version) of the rows already in the dataset,
+    reading only the months of the given rows."""
+    dataset = results_dataset(path)
+    if dataset is None:
+        return set()
+    key_columns = ["measurement_type", "digest", "params", "code_version"]
+    expression = (ds.field("month").isin(sorted({row['month'] for row in rows}))
+                  & ds.field("digest").isin(sorted({row['digest'] for row in rows})))
+    for attempt in range(2):
+        try:
+            table = dataset.to_table(columns=key_columns, filter=expression)
+            break
+        except FileNotFoundError:
+            if attempt:  # a partition was merged between listing and reading it
+                raise
+            dataset = results_dataset(path)
+    return set(zip(*[table[column].to_pylist() for column in key_columns]))
+
+
+def _part_name() -> str:
+    # Names sort in write order, so rows analysed within the same second (analysed_at has
+    # second resolution) are still read oldest first and _latest keeps the newest
+    return f"part-{time.time_ns():020d}-{uuid.uuid4().hex}"
+
+
+def _compact_partition(directory):
+    """Merge the files of one partition directory into one, keeping the latest rows.
+
+    The merged file is in place before the old ones are removed, so a concurrent query sees
+    every row (some twice, which query_results drops) and files appended meanwhile are kept.
+    """
+    files = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".parquet"))
+    df = _latest(pa.concat_tables([pq.ParquetFile(file).read() for file in files]).to_pandas())
+    basename = f"{_part_name()}-0.parquet"
+    # Dot files are skipped by dataset discovery until they are renamed
+    pq.write_table(pa.Table.from_pandas(df, schema=FILE_SCHEMA, preserve_index=False),
+                   os.path.join(directory, "." + basename))
+    os.replace(os.path.join(directory, "." + basename), os.path.join(directory, basename))
+    for file in files:
+        os.remove(file)
+
+
+def append_results(rows, path=WAREHOUSE_PATH, max_files=APPEND_MAX_FILES) -> int:
+    """Append rows from result_row to the dataset, one new file per partition, and merge the
+    partitions that now have more than max_files files.
+
+    Rows of a file, params and code version already in the dataset are skipped, so pages can
+    pass every file they show on every rerun. Returns the number of rows appended.
+    """
+    if not rows:
+        return 0
+    stored = _stored_keys(rows, path)
+    rows = [row for row in rows
+            if (row['measurement_type'], row['digest'], row['params'], row['code_version']) not in stored]
+    if not rows:
+        return 0
+    touched = set()
+    ds.write_dataset(
+        pa.Table.from_pylist(rows, schema=RESULT_SCHEMA), path, format="parquet",
+        partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+        basename_template=f"{_part_name()}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        file_visitor=lambda written: touched.add(os.path.dirname(written.path)),
+    )
+    for directory in touched:
+        if sum(name.endswith(".parquet") for name in os.listdir(directory)) > max_files:
+            _compact_partition(directory)
+    return len(rows)
+
+
+def results_dataset(path=WAREHOUSE_PATH):
+    """The results as a pyarrow dataset, or None before anything was written."""
+    if not os.path.isdir(path):
+        return None
+    return ds.dataset(path, schema=RESULT_SCHEMA, format="parquet",
+                      partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"))
+
+
+def _filter(measurement_type=None, start=None, end=None, surface_treatments=None, guard_rings=None, params=None):
+    # Conditions on the partition columns prune whole directories before any file is opened
+    conditions = []
+    if measurement_type is not None:
+        conditions.append(ds.field("measurement_type") == measurement_type)
+    if params is not None:
+        conditions.append(ds.field("params") == params)
+    if start is not None:
+        start = pd.Timestamp(start).normalize()
+        conditions.append(ds.field("month") >= start.strftime("%Y-%m"))
+        conditions.append(ds.field("measured_at") >= pa.scalar(start.to_pydatetime(), pa.timestamp("s")))
+    if end is not None:
+        end = pd.Timestamp(end).normalize()
+        conditions.append(ds.field("month") <= end.strftime("%Y-%m"))
+        conditions.append(ds.field("measured_at") <= pa.scalar(end.to_pydatetime(), pa.timestamp("s")))
+    if surface_treatments:
+        conditions.append(ds.field("surface_treatment").isin([str(value) for value in surface_treatments]))
+    if guard_rings:
+        conditions.append(ds.field("guard_ring").isin([str(value) for value in guard_rings]))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def query_results(columns=None, measurement_type=None, start=None, end=None, surface_treatments=None,
+                  guard_rings=None, params=None, latest=True, path=WAREHOUSE_PATH) -> pd.DataFrame:
+    """Warehouse rows as a DataFrame, filtered on measurement type, measurement date range
+    (inclusive), surface treatments, guard rings and params (a params column value). With
+    latest, a file analysed several times with the same params only keeps its most recent row.
+    """
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(
+            [*columns, *(["measurement_type", "digest", "params", "analysed_at"] if latest else [])]))
+    expression = _filter(measurement_type, start, end, surface_treatments, guard_rings, params)
+    for attempt in range(2):
+        dataset = results_dataset(path)
+        if dataset is None:
+            df = RESULT_SCHEMA.empty_table().to_pandas()
+            break
+        try:
+            df = dataset.to_table(columns=read_columns, filter=expression).to_pandas()
+            break
+        except FileNotFoundError:
+            if attempt:  # a partition was merged between listing and reading it
+                raise
+    if latest and len(df):
+        df = _latest(df)
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def params_sets(measurement_type, path=WAREHOUSE_PATH) -> pd.DataFrame:
+    """The params values of a measurement type with their number of files, most files first."""
+    df = query_results(columns=["params", "digest"], measurement_type=measurement_type, path=path)
+    counts = df.groupby("params")["digest"].nunique().sort_values(ascending=False, kind="stable")
+    return counts.rename("files").reset_index()
+
+
+def default_params(metric, path=WAREHOUSE_PATH):
+    """The params value most files of a metric's measurement type were analysed with."""
+    sets = params_sets(METRIC_TYPES[metric], path)
+    return sets["params"].iloc[0] if len(sets) else None
+
+
+def trend_table(metric, freq="W", by=("surface_treatment", "guard_ring"), percentiles=(10, 50, 90),
+                measurement_type=None, start=None, end=None, surface_treatments=None, guard_rings=None,
+                params=None, path=WAREHOUSE_PATH) -> pd.DataFrame:
+    """Percentiles of a metric per period (pandas frequency, e.g. "D" or "W") and group.
+
+    One row per period and group, with the period start, the group columns, the number of
+    files and a pNN column per percentile. Only the needed columns are read. Pass params to
+    only use results of one analysis settings set (see params_sets).
+    """
+    by = list(by)
+    df = query_results(columns=["measured_at", metric, *by], measurement_type=measurement_type, start=start,
+                       end=end, surface_treatments=surface_treatments, guard_rings=guard_rings, params=params,
+                       path=path)
+    df = df.dropna(subset=[metric])
+    if df.empty:
+        return pd.DataFrame(columns=["period", *by, "count", *[f"p{percentile}" for percentile in percentiles]])
+    df["period"] = df["measured_at"].dt.to_period(freq).dt.start_time
+    grouped = df.groupby(["period", *by], observed=True)[metric]
+    trend = grouped.quantile([percentile / 100 for percentile in percentiles]).unstack()
+    trend.columns = [f"p{percentile}" for percentile in percentiles]
+    trend.insert(0, "count", grouped.size())
+    return trend.reset_index()
+
+
+def compact_results(path=WAREHOUSE_PATH) -> int:
+    """Merge every partition into one file with only the latest row per file.
+    Returns the number of partitions merged."""
+    n_merged = 0
+    for directory, directories, names in os.walk(path):
+        directories[:] = [name for name in directories if not name.startswith(("_", "."))]
+        if sum(name.endswith(".parquet") for name in names) > 1:
+            _compact_partition(directory)
+            n_merged += 1
+    return n_merged
+
+
+def warehouse_stamp(path=WAREHOUSE_PATH) -> str:
+    """Fingerprint of the dataset's files. Files are never modified, only added and merged
+    into new files with new names, so the names alone change with every write."""
+    names = []
+    for directory, directories, files in os.walk(path):
+        directories[:] = [name for name in directories if not name.startswith(("_", "."))]
+        names += [os.path.join(directory, name) for name in files
+                  if name.endswith(".parquet") and not name.startswith(("_", "."))]
+    return hashlib.sha256("\n".join(sorted(names)).encode()).hexdigest()[:16]
+
+
+def rollup_table(metric, freq="W", by=("surface_treatment", "guard_ring"), params=None,
+                 path=WAREHOUSE_PATH) -> pd.DataFrame:
+    """trend_table of all results with the given params, read from its stored rollup unless
+    the dataset changed since the rollup was computed. If the rollup cannot be written, the
+    trend is computed on every call."""
+    by = list(by)
+    stamp = warehouse_stamp(path).encode()
+    params_id = hashlib.sha256(str(params).encode()).hexdigest()[:12]
+    rollup_file = os.path.join(path, ROLLUP_DIR, f"{metric}-{freq}-{'+'.join(by)}-{params_id}.parquet")
+    if os.path.exists(rollup_file):
+        table = pq.read_table(rollup_file)
+        if table.schema.metadata.get(b"warehouse_stamp") == stamp:
+            return table.to_pandas()
+    trend = trend_table(metric, freq, by, params=params, path=path)
+    if len(trend):
+        table = pa.Table.from_pandas(trend, preserve_index=False)
+        table = table.replace_schema_metadata({**table.schema.metadata, b"warehouse_stamp": stamp})
+        # Written under a temporary name so concurrent readers never see half a file
+        temporary_file = f"{rollup_file}.{uuid.uuid4().hex}"
+        try:
+            os.makedirs(os.path.dirname(rollup_file), exist_ok=True)
+            pq.write_table(table, temporary_file)
+            os.replace(temporary_file, rollup_file)
+        except OSError:
+            # Read-only or shared warehouse: the trend is still returned, just not stored
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+    return trend
+
+
+def update_rollups(path=WAREHOUSE_PATH) -> int:
+    """Recompute the outdated rollups of every metric, frequency, grouping and params."""
+    n_rollups = 0
+    for metric in METRICS:
+        for params in params_sets(METRIC_TYPES[metric], path)["params"]:
+            for freq in ROLLUP_FREQS:
+                for by in ROLLUP_GROUPS:
+                    rollup_table(metric, freq, by, params, path)
+                    n_rollups += 1
+    return n_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=WAREHOUSE_PATH)
+    parser.add_argument("--compact", action="store_true", help="one file per partition, latest rows only")
+    parser.add_argument("--trend", choices=METRICS, help="print the percentile trend table of a metric")
+    parser.add_argument("--freq", default="W", help="trend period, a pandas frequency such as D or W")
+    parser.add_argument("--params", help="params JSON of the trend, by default the one of most files")
+    parser.add_argument("--rollups", action="store_true", help="recompute the outdated rollups")
+    args = parser.parse_args()
+
+    if args.compact:
+        print(f"Merged {compact_results(args.path)} partitions in {args.path}")
+    if args.trend:
+        params = args.params if args.params is not None else default_params(args.trend, args.path)
+        print(f"params: {params}")
+        print(trend_table(args.trend, freq=args.freq, params=params, path=args.path).to_string(index=False))
+    if args.rollups:
+        print(f"Checked {update_rollups(args.path)} rollups in {args.path}")
+
+
+if __name__ == "__main__":
+    main()